@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Nhật ký cảnh báo dạng append-only (NDJSON: mỗi dòng một JSON).
+
+Thay cho việc đọc - sửa - ghi lại toàn bộ firewall_alerts.json mỗi lần chặn:
+- AlertJournal (phía detector): gom cảnh báo trong bộ đệm rồi ghi một lần
+  (group commit), xoay vòng file theo dung lượng và theo tuổi.
+- read_from / AlertTail / tail (phía đọc): đọc tiếp từ một byte offset, chỉ
+  lấy các dòng đã ghi trọn vẹn nên không bao giờ đọc phải bản ghi đang ghi dở.
+
+File cũ dạng mảng JSON ('[...]') vẫn đọc được và được chuyển sang NDJSON khi
+detector mở journal lần đầu.
+"""
+import json
+import os
+import time
+import logging
+
+ALERT_FILE = '/var/log/firewall_alerts.json'
+
+
+def _parse_lines(data):
+    records = []
+    for line in data.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+    return records
+
+
+def _read_legacy(path):
+    """Đọc file cũ dạng mảng JSON, trả về list hoặc None nếu không phải định dạng cũ"""
+    with open(path, 'rb') as f:
+        head = f.read(64).lstrip()
+        if not head.startswith(b'['):
+            return None
+        f.seek(0)
+        try:
+            data = json.loads(f.read().decode('utf-8'))
+        except ValueError:
+            return []
+    if isinstance(data, dict):
+        return [data]
+    return data if isinstance(data, list) else []
+
+
+def read_from(path, offset=0):
+    """Đọc các bản ghi trọn vẹn từ byte `offset`. Trả về (records, offset mới)."""
+    try:
+        if offset == 0:
+            legacy = _read_legacy(path)
+            if legacy is not None:
+                return legacy, os.path.getsize(path)
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except (FileNotFoundError, IsADirectoryError):
+        return [], 0
+    # Chỉ lấy đến ký tự xuống dòng cuối cùng (phần sau có thể đang được ghi)
+    end = data.rfind(b'\n') + 1
+    return _parse_lines(data[:end].decode('utf-8', 'replace')), offset + end
+
+
+def tail(path, limit):
+    """`limit` bản ghi mới nhất, mới nhất đứng trước. Đọc ngược từ cuối file."""
+    try:
+        if _read_legacy(path) is not None:
+            return list(reversed(_read_legacy(path)[-limit:]))
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            pos = end = f.tell()
+            block = 64 * 1024
+            data = b''
+            while pos > 0 and data.count(b'\n') <= limit:
+                step = min(block, pos)
+                pos -= step
+                f.seek(pos)
+                data = f.read(step) + data
+    except FileNotFoundError:
+        return []
+    data = data[:data.rfind(b'\n') + 1] if end else data
+    newest = list(reversed(_parse_lines(data.decode('utf-8', 'replace'))[-limit:]))
+    if len(newest) < limit and os.path.exists(path + '.1'):
+        # Vừa xoay vòng: lấy thêm từ file trước đó
+        newest += tail(path + '.1', limit - len(newest))
+    return newest
+
+
+def clear(path):
+    """Xóa sạch nhật ký (giữ file rỗng để detector tiếp tục ghi)"""
+    with open(path, 'w'):
+        pass
+
+
+class AlertTail:
+    """Theo dõi file nhật ký, mỗi lần poll() chỉ trả về các bản ghi mới"""
+
+    def __init__(self, path=ALERT_FILE):
+        self.path = path
+        self.offset = 0
+        self.inode = None
+
+    def reset(self):
+        self.offset = 0
+        self.inode = None
+
+    def poll(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self.reset()
+            return []
+        records = []
+        if self.inode is not None and (st.st_ino != self.inode or st.st_size < self.offset):
+            # File đã bị xoay vòng hoặc bị xóa: đọc nốt phần còn lại của file cũ
+            if st.st_ino != self.inode and os.path.exists(self.path + '.1'):
+                records, _ = read_from(self.path + '.1', self.offset)
+            self.offset = 0
+        self.inode = st.st_ino
+        new, self.offset = read_from(self.path, self.offset)
+        return records + new
+
+
+class AlertJournal:
+    """Ghi cảnh báo NDJSON với group commit và xoay vòng file"""
+
+    def __init__(self, path=ALERT_FILE, max_bytes=10 * 1024 * 1024, max_age=86400,
+                 backups=5, flush_records=100, flush_interval=1.0, store=None):
+        self.path = path
+        self.store = store  # EventStore (tùy chọn) nhận cùng lô sự kiện
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.time()
+        self._migrate_legacy()
+        self.opened_at = self._file_age_start()
+
+    def _file_age_start(self):
+        try:
+            return os.stat(self.path).st_mtime if os.path.getsize(self.path) else time.time()
+        except OSError:
+            return time.time()
+
+    def _migrate_legacy(self):
+        """Chuyển file mảng JSON cũ sang NDJSON (một lần)"""
+        try:
+            legacy = _read_legacy(self.path)
+        except FileNotFoundError:
+            return
+        if legacy is None:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            for record in legacy:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(tmp, self.path)
+
+    def append(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.flush_records or time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Ghi toàn bộ bộ đệm bằng một lần write + fsync"""
+        self.last_flush = time.time()
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        data = ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in batch)
+        try:
+            self._maybe_rotate(len(data))
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data.encode('utf-8'))
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except Exception as e:
+            logging.error(f"Lỗi ghi nhật ký cảnh báo: {e}")
+        if self.store:
+            try:
+                self.store.add_events(batch)
+            except Exception as e:
+                logging.error(f"Lỗi ghi kho sự kiện: {e}")
+
+    def _maybe_rotate(self, incoming):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            self.opened_at = time.time()
+            return
+        too_big = size + incoming > self.max_bytes
+        too_old = size > 0 and time.time() - self.opened_at > self.max_age
+        if not (too_big or too_old):
+            return
+        # firewall_alerts.json -> .1 -> .2 ... (bỏ file cũ nhất)
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        os.replace(self.path, self.path + '.1')
+        self.opened_at = time.time()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Chế độ daemon asyncio cho DosDetector.
+
+Vòng lặp tuần tự của DosDetector.run chờ lần lượt TCP -> UDP -> phát hiện ->
+gỡ chặn -> sleep, nên một lần dump conntrack chậm làm trễ cả việc chặn SYN flood.
+AsyncDetectorDaemon chạy mỗi collector thành một task riêng với nhịp riêng:
+
+- tcp_loop / udp_loop: lấy số liệu trong thread pool (collector là code chặn),
+  phân tích ngay khi có kết quả rồi áp dụng lệnh chặn luôn.
+- packet_loop (packet_collector = "ring"): tốc độ gói theo nguồn mỗi packet_interval giây.
+- expiry_loop: gỡ chặn IP hết hạn, thức dậy đúng lúc lệnh chặn gần nhất hết hạn.
+- config: fd inotify của ConfigManager đăng ký với event loop (add_reader), config
+  mới được áp dụng ngay khi file đổi; không có inotify thì kiểm tra stat theo nhịp.
+- state_loop: lưu snapshot trạng thái (state_store) mỗi state_interval giây.
+
+Lệnh iptables / ipset / conntrack chạy qua asyncio subprocess, số tiến trình
+con đồng thời bị giới hạn bởi config['max_subprocs'].
+
+Dùng:
+    sudo python3 auto_block_sua1.py --async     # hoặc daemon_mode = "async"
+    python3 async_daemon.py replay [giây]       # đo time-to-ban với flood giả lập
+"""
+import asyncio
+import logging
+import time
+
+from instrumentation import Cycle, subprocess_started
+
+
+class AsyncDetectorDaemon:
+    def __init__(self, detector, max_subprocs=None):
+        self.detector = detector
+        self.max_subprocs = int(max_subprocs or detector.config.get('max_subprocs', 8))
+        self.semaphore = None
+        self.tasks = []
+        self.config_fd = None
+
+    def interval(self, key):
+        config = self.detector.config
+        return float(config.get(key) or config.get('check_interval', 5))
+
+    # --- Thực thi lệnh chặn ---
+    async def run_command(self, cmd):
+        """Bản async của ban_backend.run_command, chạy trong giới hạn max_subprocs"""
+        async with self.semaphore:
+            if cmd.skip_if_ok:
+                subprocess_started(cmd.skip_if_ok)
+                check = await asyncio.create_subprocess_exec(
+                    *cmd.skip_if_ok, stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+                if await check.wait() == 0:
+                    return True
+            subprocess_started(cmd.argv)
+            proc = await asyncio.create_subprocess_exec(
+                *cmd.argv,
+                stdin=asyncio.subprocess.PIPE if cmd.input is not None else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+            _, stderr = await proc.communicate(cmd.input.encode() if cmd.input is not None else None)
+        if proc.returncode != 0:
+            logging.error(f"Lệnh thất bại: {' '.join(cmd.argv)} - {stderr.decode(errors='replace').strip()}")
+            return False
+        return True
+
+    async def apply(self, bans, unbans):
+        """Giống BanBackend.apply nhưng các lệnh chạy song song. Trả về tập IP chặn lỗi."""
+        backend = self.detector.ban_backend
+        commands = backend.commands(bans, unbans)
+        # conntrack -D chỉ chạy sau khi rule chặn đã có, tránh luồng mới lọt qua
+        rules = [c for c in commands if c.argv[0] != 'conntrack']
+        flushes = [c for c in commands if c.argv[0] == 'conntrack']
+        failed = set()
+        results = await asyncio.gather(*(self.run_command(c) for c in rules), return_exceptions=True)
+        for cmd, ok in zip(rules, results):
+            if isinstance(ok, Exception):
+                logging.error(f"Lỗi chạy {cmd.argv[0]}: {ok}")
+                ok = False
+            if not ok:
+                failed.update(backend._ips_of(cmd, bans))
+        await asyncio.gather(*(self.run_command(c) for c in flushes), return_exceptions=True)
+        return failed
+
+    async def enforce(self):
+        """Áp dụng ngay các ban/unban đang chờ"""
+        bans, unbans = self.detector.take_pending_bans()
+        if not bans and not unbans:
+            return
+        try:
+            failed = await self.apply(bans, unbans)
+        except Exception as e:
+            logging.error(f"Lỗi backend {self.detector.ban_backend.name}: {e}")
+            failed = {b.ip for b in bans}
+        self.detector.finish_bans(bans, unbans, failed)
+        self.detector.journal.flush()
+
+    # --- Các task ---
+    async def _every(self, name, interval_key, step, wake_at=None):
+        """Chạy step theo nhịp interval_key; wake_at() cho phép thức dậy sớm hơn"""
+        while True:
+            start = time.monotonic()
+            try:
+                await step()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Lỗi {name}: {e}")
+            delay = self.interval(interval_key) - (time.monotonic() - start)
+            due = wake_at() if wake_at else None
+            if due is not None:
+                delay = min(delay, due - time.time())
+            await asyncio.sleep(max(delay, 0))
+
+    async def tcp_step(self):
+        loop = asyncio.get_running_loop()
+        cycle = Cycle('tcp')
+        with cycle.stage('tcp_collect'):
+            syn, conn = await loop.run_in_executor(None, self.detector.get_tcp_stats)
+        with cycle.stage('detect'):
+            self.detector.check_tcp(syn, conn)
+        with cycle.stage('enforce'):
+            await self.enforce()
+        self.detector.finish_cycle(cycle)
+
+    async def udp_step(self):
+        loop = asyncio.get_running_loop()
+        cycle = Cycle('udp')
+        with cycle.stage('udp_collect'):
+            udp = await loop.run_in_executor(None, self.detector.get_udp_stats)
+        with cycle.stage('detect'):
+            self.detector.check_udp(udp)
+        with cycle.stage('enforce'):
+            await self.enforce()
+        self.detector.finish_cycle(cycle)
+
+    async def packet_step(self):
+        # snapshot() chỉ đổi bộ đếm do thread ring đã gom sẵn, không cần executor
+        cycle = Cycle('packet')
+        with cycle.stage('packet'):
+            self.detector.check_packets(self.detector.get_packet_stats())
+        with cycle.stage('enforce'):
+            await self.enforce()
+        self.detector.finish_cycle(cycle)
+
+    async def expiry_step(self):
+        cycle = Cycle('expiry')
+        with cycle.stage('unban'):
+            self.detector.unban_old_ips()
+        with cycle.stage('enforce'):
+            await self.enforce()
+        self.detector.finish_cycle(cycle)
+
+    async def config_step(self):
+        self.detector.refresh_config()
+
+    def on_config_event(self):
+        """fd inotify đọc được: nạp config mới trên thread của event loop"""
+        try:
+            self.detector.refresh_config()
+        except Exception as e:
+            logging.error(f"Lỗi nạp config: {e}")
+        manager = self.detector.config_manager
+        if manager.fd is None:
+            # Mất watch (thư mục bị xóa...): chuyển sang kiểm tra stat theo nhịp
+            asyncio.get_running_loop().remove_reader(self.config_fd)
+            self.config_fd = None
+            self.tasks.append(asyncio.create_task(self._every('đọc config', 'check_interval', self.config_step)))
+
+    async def state_step(self):
+        import state_store
+        # Đóng gói trên thread của event loop (không ai sửa trạng thái lúc này), ghi file trong executor
+        data = state_store.snapshot(self.detector)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, state_store.write_atomic, self.detector.state_file, data)
+
+    async def main(self):
+        self.semaphore = asyncio.Semaphore(self.max_subprocs)
+        self.tasks = [
+            asyncio.create_task(self._every('TCP collector', 'tcp_interval', self.tcp_step)),
+            asyncio.create_task(self._every('UDP collector', 'udp_interval', self.udp_step)),
+            asyncio.create_task(self._every('gỡ chặn', 'expiry_interval', self.expiry_step,
+                                            self.detector.ban_scheduler.next_due)),
+        ]
+        if self.detector.packet_collector:
+            self.tasks.append(asyncio.create_task(self._every('packet collector', 'packet_interval', self.packet_step)))
+        self.config_fd = self.detector.config_manager.fd
+        if self.config_fd is not None:
+            asyncio.get_running_loop().add_reader(self.config_fd, self.on_config_event)
+        elif self.detector.config_manager.path is not None:
+            self.tasks.append(asyncio.create_task(self._every('đọc config', 'check_interval', self.config_step)))
+        if self.detector.state_file and int(self.detector.config.get('state_interval', 60)) > 0:
+            self.tasks.append(asyncio.create_task(self._every('lưu trạng thái', 'state_interval', self.state_step)))
+        try:
+            await asyncio.gather(*self.tasks)
+        finally:
+            if self.config_fd is not None:
+                asyncio.get_running_loop().remove_reader(self.config_fd)
+            for task in self.tasks:
+                task.cancel()
+            self.detector.journal.flush()
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+
+    def run(self):
+        logging.info(f"Firewall Monitor (asyncio, tối đa {self.max_subprocs} lệnh song song) Started...")
+        print("Đang chạy (async)... Nhấn Ctrl+C để dừng.")
+        try:
+            asyncio.run(self.main())
+        except KeyboardInterrupt:
+            print("\nDừng chương trình.")
+            self.detector.checkpoint(force=True)
+
+
+# === REPLAY FLOOD GIẢ LẬP: ĐO TIME-TO-BAN ===
+class FloodScenario:
+    """Lịch tấn công: mỗi IP tấn công bắt đầu flood tại một thời điểm (giây từ t0).
+    Khóa là địa chỉ dạng int của ipaddr, như số liệu của collector thật; một nửa
+    IP tấn công SYN là IPv6."""
+
+    def __init__(self, duration=20.0, attackers=200, background=500, seed=1):
+        import random
+        from ipaddr import pack
+        rng = random.Random(seed)
+        self.duration = duration
+        self.t0 = time.monotonic()
+        self.syn_starts = {pack(f"10.1.{i >> 8}.{i & 255}" if i % 2 else f"2001:db8:1::{i:x}"):
+                           rng.uniform(1, duration - 4) for i in range(attackers)}
+        self.udp_starts = {pack(f"10.2.{i >> 8}.{i & 255}"): rng.uniform(1, duration - 4)
+                           for i in range(attackers // 4)}
+        self.background = [pack(f"172.16.{i >> 8}.{i & 255}") for i in range(background)]
+        self.rng = rng
+
+    def now(self):
+        return time.monotonic() - self.t0
+
+    def stats(self, starts):
+        from collections import defaultdict
+        now = self.now()
+        stats = defaultdict(int, ((ip, self.rng.randint(0, 20)) for ip in self.background))
+        for ip, start in starts.items():
+            if now >= start:
+                stats[ip] = 500  # Vượt HARD LIMIT -> chặn ngay khi được thấy
+        return stats
+
+
+class _FloodTcpCollector:
+    name = 'replay'
+    syn_ports = {}
+
+    def __init__(self, scenario, cost):
+        self.scenario = scenario
+        self.cost = cost
+
+    def collect(self, whitelist):
+        time.sleep(self.cost)
+        return self.scenario.stats(self.scenario.syn_starts), self.scenario.stats({})
+
+
+def _replay_detector(scenario, journal_path, tcp_cost, udp_cost, config):
+    from alert_journal import AlertJournal
+    from auto_block_sua1 import DosDetector
+    from ban_backend import IptablesBackend
+    from ipaddr import try_pack
+
+    class ReplayDetector(DosDetector):
+        """DosDetector dùng collector giả lập, không đụng tới file hệ thống"""
+
+        def __init__(self):
+            self.ban_times = {}
+            super().__init__(config=config, journal=AlertJournal(journal_path), ban_backend=IptablesBackend(),
+                             tcp_collector=_FloodTcpCollector(scenario, tcp_cost), state_file=None)
+
+        def get_udp_stats(self):
+            time.sleep(udp_cost)  # Dump conntrack chậm
+            return scenario.stats(scenario.udp_starts)
+
+        def finish_bans(self, bans, unbans, failed):
+            now = scenario.now()
+            for b in bans:
+                if b.ip not in failed:
+                    self.ban_times.setdefault(try_pack(b.ip), now)
+            super().finish_bans(bans, unbans, failed)
+
+    return ReplayDetector()
+
+
+def _percentiles(values):
+    values = sorted(values)
+    if not values:
+        return 'không có IP nào bị chặn'
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return f"p50={pick(0.5) * 1000:7.0f} ms  p90={pick(0.9) * 1000:7.0f} ms  p99={pick(0.99) * 1000:7.0f} ms"
+
+
+def replay(duration=20.0, tcp_cost=0.05, udp_cost=0.8):
+    """Chạy cùng một kịch bản flood ở chế độ tuần tự và async, in phân vị time-to-ban"""
+    import contextlib
+    import io
+    import os
+    import tempfile
+    from ban_backend import _install_fake_binaries
+
+    config = {'check_interval': 1, 'tcp_interval': 0.25, 'udp_interval': 1, 'expiry_interval': 1,
+              'syn_threshold': 50, 'conn_threshold': 100, 'udp_threshold': 100, 'ban_time': 3600,
+              'max_subprocs': 8, 'state_interval': 0, 'whitelist': [],
+              # Như detector trước khi có gộp dải / conntrack -E: chỉ so ngưỡng theo từng IP
+              'subnet_levels': [], 'subnet_levels_v6': [], 'udp_collector': 'dump'}
+    logging.disable(logging.WARNING)  # Bỏ log 'ĐÃ CHẶN IP' của từng IP
+    with tempfile.TemporaryDirectory() as tmp:
+        _install_fake_binaries(tmp)
+        os.environ['PATH'] = tmp + os.pathsep + os.environ.get('PATH', '')
+        for mode in ('tuần tự', 'async'):
+            scenario = FloodScenario(duration)
+            detector = _replay_detector(scenario, os.path.join(tmp, f'alerts-{mode == "async"}.json'),
+                                        tcp_cost, udp_cost, config)
+            with contextlib.redirect_stdout(io.StringIO()):  # Bỏ dòng [DEBUG] của analyze_and_block
+                if mode == 'async':
+                    daemon = AsyncDetectorDaemon(detector)
+
+                    async def bounded():
+                        asyncio.get_running_loop().call_later(duration, daemon.stop)
+                        try:
+                            await daemon.main()
+                        except asyncio.CancelledError:
+                            pass
+                    asyncio.run(bounded())
+                else:
+                    while scenario.now() < duration:
+                        detector.run_cycle()
+                        time.sleep(config['check_interval'])
+            for label, starts in (('SYN', scenario.syn_starts), ('UDP', scenario.udp_starts)):
+                latency = [detector.ban_times[ip] - start for ip, start in starts.items() if ip in detector.ban_times]
+                print(f"{mode:8s} {label}: {len(latency):4d}/{len(starts)} IP bị chặn, {_percentiles(latency)}")
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:2] == ['replay']:
+        replay(float(sys.argv[2]) if len(sys.argv) > 2 else 20.0)
+    else:
+        print(__doc__)
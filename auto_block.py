@@ -6,6 +6,8 @@ from collections import defaultdict, deque
 import json
 import os
 import sys
+from alert_journal import AlertJournal
+from event_store import open_store
 
 # --- CẤU HÌNH ---
 CONFIG_FILE = '/etc/firewall_auto_block.json'
@@ -25,6 +27,7 @@ logging.basicConfig(
 class DosDetector:
     def __init__(self):
         self.banned_ips = {}
+        self.journal = AlertJournal(ALERT_FILE, store=open_store(migrate_from=ALERT_FILE))
         self.config = self.load_config()
         self.sync_blocked_ips_from_system()
 
@@ -182,23 +185,8 @@ class DosDetector:
                     del self.banned_ips[ip]
 
     def write_alert(self, alert_data):
-        try:
-            alerts = []
-            if os.path.exists(ALERT_FILE):
-                with open(ALERT_FILE, 'r') as f:
-                    try:
-                        data = f.read().strip()
-                        if data: alerts = json.loads(data)
-                    except: pass
-            
-            if not isinstance(alerts, list): alerts = []
-            alerts.append(alert_data)
-            if len(alerts) > 100: alerts = alerts[-100:] # Giữ 100 log mới nhất
-            
-            with open(ALERT_FILE, 'w') as f:
-                json.dump(alerts, f, indent=2)
-        except Exception as e:
-            logging.error(f"Lỗi ghi JSON: {e}")
+        # Ghi nối vào nhật ký NDJSON, flush theo lô ở cuối mỗi chu kỳ
+        self.journal.append(alert_data)
 
     def run(self):
         logging.info("Auto-Block Service started...")
@@ -209,6 +197,7 @@ class DosDetector:
                 syn, conn = self.get_network_stats()
                 self.check_for_attacks(syn, conn)
                 self.unban_old_ips()
+                self.journal.flush()
                 
                 # Sleep theo config
                 time.sleep(self.config.get('check_interval', 5))
@@ -2,12 +2,29 @@
 import subprocess
 import time
 import logging
-from collections import defaultdict, deque
-import json
+from collections import defaultdict
 import os
 import sys
-import math
-import statistics
+from alert_journal import AlertJournal
+from event_store import open_store
+import functools
+from ban_backend import Ban, create_backend
+from blocklist import BlocklistLoader
+from tcp_collector import create_collector
+from udp_collector import ConntrackEventCounter, parse_conntrack_dport
+from packet_collector import create_packet_collector
+from zscore_engine import create_history
+from sharded_pipeline import create_pipeline
+from ban_scheduler import BanScheduler
+import state_store
+from prefix_table import PrefixTable
+from ipaddr import is_valid, try_pack, unpack, parse_cidr, format_cidr
+from subnet_aggregator import create_aggregator
+import sketch
+from config_manager import ConfigManager
+import instrumentation
+from instrumentation import BANS, BANS_PER_CYCLE, BANNED, CONFIG_VERSION, FLOWS, SOCKETS, TRACKED_KEYS, UNBANS, Cycle, stage
+from distribution_metrics import SOURCE_METRICS, create_metrics, sketch_residual
 
 # --- CẤU HÌNH ---
 CONFIG_FILE = '/etc/firewall_auto_block.json'
@@ -20,259 +37,579 @@ MIN_SAMPLES = 5         # Cần ít nhất 5 mẫu để bắt đầu tính Z-Sc
 Z_THRESHOLD = 3.0       # Độ lệch chuẩn ( >3 là bất thường)
 HARD_LIMIT_MULTIPLIER = 3 # Nếu vượt ngưỡng gấp 3 lần -> Chặn ngay không cần Z-Score
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
-
 class DosDetector:
-    def __init__(self):
+    def __init__(self, config=None, journal=None, ban_backend=None, tcp_collector=None,
+                 state_file=state_store.STATE_FILE):
+        """Mặc định đọc file config / nhật ký / snapshot của hệ thống. Giả lập và test truyền vào
+        config tĩnh (dict), journal, backend, collector TCP riêng; state_file=None: không lưu trạng thái."""
         self.banned_ips = {}
-        # Bộ nhớ lịch sử cho Z-Score
-        self.syn_history = defaultdict(lambda: deque(maxlen=HISTORY_LEN))
-        self.conn_history = defaultdict(lambda: deque(maxlen=HISTORY_LEN))
-        self.udp_history = defaultdict(lambda: deque(maxlen=HISTORY_LEN))
-        
-        self.config = self.load_config()
-        self.sync_blocked_ips_from_system()
-
-    def load_config(self):
-        default_config = {
-            'check_interval': 5,
-            'syn_threshold': 50,
-            'conn_threshold': 100,
-            'udp_threshold': 100,
-            'ban_time': 300,
-            'whitelist': ['127.0.0.1', '::1']
-        }
-        if os.path.exists(CONFIG_FILE):
+        self.ban_reasons = {}
+        self.banned_nets = PrefixTable(128)  # Các dải CIDR đang bị chặn (khóa ipaddr, IPv4 + IPv6)
+        # Nhật ký NDJSON + kho sự kiện SQLite (ghi cùng một lô mỗi chu kỳ)
+        if journal is None:
+            journal = AlertJournal(ALERT_FILE, store=open_store(migrate_from=ALERT_FILE))
+        self.journal = journal
+        self.state_file = state_file
+        # Config theo dõi bằng inotify; snapshot (config + whitelist + ngưỡng) dựng lại khi file đổi
+        self.config_manager = ConfigManager(CONFIG_FILE) if config is None else ConfigManager(None, config)
+        self.settings = self.config_manager.snapshot
+        self.config = self.settings.config
+        self.whitelist = self.settings.whitelist
+
+        # Bộ nhớ lịch sử cho Z-Score (ma trận NumPy nếu có), giới hạn số IP theo dõi
+        max_ips = int(self.config.get('history_max_ips', 200000))
+        idle_ttl = int(self.config.get('history_idle_ttl', 900))
+        # pipeline_workers > 1: lịch sử chia shard cho các tiến trình worker (fork trước khi mở thread collector)
+        self.pipeline = None
+        try:
+            self.pipeline = create_pipeline(self.config, HISTORY_LEN, MIN_SAMPLES)
+        except Exception as e:
+            logging.error(f"Không khởi động được worker, chạy một tiến trình: {e}")
+        if self.pipeline:
+            self.syn_history, self.conn_history, self.udp_history, self.pkt_history = (
+                self.pipeline.history(name) for name in ('syn', 'conn', 'udp', 'pkt'))
+        else:
+            self.syn_history = create_history(HISTORY_LEN, MIN_SAMPLES, max_ips, idle_ttl)
+            self.conn_history = create_history(HISTORY_LEN, MIN_SAMPLES, max_ips, idle_ttl)
+            self.udp_history = create_history(HISTORY_LEN, MIN_SAMPLES, max_ips, idle_ttl)
+            self.pkt_history = create_history(HISTORY_LEN, MIN_SAMPLES, max_ips, idle_ttl)
+        self.last_evictions = 0
+        # Gộp số đếm lên /24, /16, ASN để chặn botnet phân tán theo dải CIDR
+        self.subnet_aggregator = create_aggregator(self.config)
+        # Backend chặn (iptables / ipset), ban/unban gom theo từng chu kỳ
+        if ban_backend is None:
+            ban_backend = create_backend(self.config)
             try:
-                with open(CONFIG_FILE, 'r') as f:
-                    data = json.load(f)
-                    default_config.update(data)
-                    return default_config
+                ban_backend.setup()
             except Exception as e:
-                logging.error(f"Lỗi đọc config: {e}")
-        return default_config
+                logging.error(f"Lỗi khởi tạo backend {ban_backend.name}: {e}")
+        self.ban_backend = ban_backend
+        self.pending_bans = []
+        self.pending_unbans = []
+        self.unban_reasons = {}  # ip -> lý do gỡ khác hết hạn (vd. đã nằm trong dải vừa chặn)
+        # Blocklist từ file feed cục bộ: set riêng, đọc lại theo blocklist_refresh trên thread riêng
+        self.blocklist = BlocklistLoader()
+        # Lịch hết hạn lệnh chặn (heap), TTL tăng dần với IP tái phạm
+        self.ban_scheduler = BanScheduler()
+        self.apply_config()
+        # Chế độ đếm: dict chính xác, hoặc sketch bộ nhớ cố định (flood giả mạo nguồn)
+        self.sketches = None
+        self.source_cardinality = {}
+        # Entropy nguồn / cổng / giao thức theo cửa sổ trượt, cập nhật tăng dần
+        self.metrics = create_metrics(self.config)
+        self.residuals = {}  # Phần ngoài top-k của sketch: (mass, keys)
+        self.udp_ports = {}
+        self.attack_shapes = {}
+        sketch_factory = None
+        if self.config.get('counting_mode') == 'sketch':
+            if sketch.np is None:
+                logging.warning("Không có NumPy: sketch chạy bản thuần Python (chậm)")
+            sketch_factory = functools.partial(sketch.create_sketch, self.config)
+            self.sketches = {'syn': sketch_factory(), 'conn': sketch_factory()}
+        # Collector TCP (netlink / proc / ss)
+        self.tcp_collector = tcp_collector or create_collector(self.config)
+        logging.info(f"TCP collector: {self.tcp_collector.name}, ban backend: {self.ban_backend.name}")
+        # Bộ đếm UDP theo sự kiện conntrack (None = dùng cách dump cũ)
+        self.udp_counter = None
+        if self.config.get('udp_collector', 'events') == 'events':
+            try:
+                counter = ConntrackEventCounter(int(self.config.get('udp_resync_interval', 300)),
+                                                sketch_factory=sketch_factory)
+                counter.start()
+                self.udp_counter = counter
+            except Exception as e:
+                logging.error(f"Không khởi động được conntrack -E, dùng dump: {e}")
+        # Đếm gói theo nguồn qua ring AF_PACKET (packet_collector = "ring")
+        self.packet_collector = None
+        try:
+            collector = create_packet_collector(self.config)
+            if collector:
+                collector.start()
+                self.packet_collector = collector
+        except Exception as e:
+            logging.error(f"Không mở được ring AF_PACKET, tắt đếm gói: {e}")
+        self.last_checkpoint = time.time()
+        self.restore_state()
+        self.blocklist.start()
+        # Đo đạc: endpoint Prometheus (chỉ 127.0.0.1) và log JSON mỗi chu kỳ
+        self.cycle_log = AlertJournal(self.config['cycle_log']) if self.config.get('cycle_log') else None
+        port = int(self.config.get('metrics_port', 0))
+        if port:
+            try:
+                instrumentation.serve(port)
+                logging.info(f"Metrics: http://127.0.0.1:{port}/metrics")
+            except OSError as e:
+                logging.error(f"Không mở được cổng metrics {port}: {e}")
+
+    def apply_config(self, settings=None):
+        """Đổi sang snapshot config mới (các cấu trúc suy ra đã dựng sẵn trong snapshot)"""
+        settings = settings or self.settings
+        self.settings = settings
+        self.config = settings.config
+        self.whitelist = settings.whitelist
+        instrumentation.configure(self.config)
+        CONFIG_VERSION.set(settings.version)
+        self.update_ban_policy()
+        self.blocklist.configure(self.config)
+
+    def refresh_config(self):
+        """Áp dụng config mới nếu file đã đổi (inotify / stat, không parse lại JSON mỗi chu kỳ)"""
+        settings = self.config_manager.poll()
+        if settings:
+            logging.info(f"Đã nạp config phiên bản {settings.version}")
+            self.apply_config(settings)
+        return settings
+
+    def update_ban_policy(self):
+        """Áp dụng cấu hình tái phạm (gọi lại mỗi khi đọc config)"""
+        scheduler = self.ban_scheduler
+        scheduler.escalation = float(self.config.get('ban_escalation', 2))
+        scheduler.max_ttl = int(self.config.get('ban_max_time', 86400))
+        scheduler.offense_window = int(self.config.get('ban_offense_window', 86400))
+
+    def restore_state(self):
+        """Nạp snapshot (nếu có) và đối chiếu với kernel, không có thì đọc lại từ kernel"""
+        start = time.perf_counter()
+        state = state_store.load(self.state_file) if self.state_file else None
+        if state is None:
+            self.sync_blocked_ips_from_system()
+            self.rebuild_banned_nets()
+            return
+        try:
+            live = self.ban_backend.list_banned()
+            stats = state_store.restore(self, state, live)
+            logging.info(f"Khôi phục trạng thái trong {(time.perf_counter() - start) * 1000:.0f} ms: "
+                         f"giữ {stats['kept']}, chặn lại {stats['reapplied']}, hết hạn {stats['expired']}, "
+                         f"nhận từ kernel {stats['adopted']}, lịch sử {stats['history']} IP")
+        except Exception as e:
+            logging.error(f"Lỗi khôi phục trạng thái: {e}")
+            self.sync_blocked_ips_from_system()
+        self.rebuild_banned_nets()
+
+    def checkpoint(self, force=False):
+        """Lưu snapshot mỗi state_interval giây (force: lưu ngay, ví dụ khi dừng)"""
+        interval = int(self.config.get('state_interval', 60))
+        if not self.state_file or (not force and (interval <= 0 or time.time() - self.last_checkpoint < interval)):
+            return
+        self.last_checkpoint = time.time()
+        try:
+            state_store.save(self, self.state_file)
+        except Exception as e:
+            logging.error(f"Lỗi lưu trạng thái: {e}")
 
     def sync_blocked_ips_from_system(self):
+        ban_time = int(self.config.get('ban_time', 300))
         try:
-            result = subprocess.run(['iptables', '-L', 'INPUT', '-n'], capture_output=True, text=True)
-            for line in result.stdout.split('\n'):
-                parts = line.split()
-                if len(parts) >= 4 and parts[0] == 'DROP':
-                    src_ip = parts[3]
-                    if self.is_valid_ip(src_ip) and src_ip != '0.0.0.0/0':
-                        self.banned_ips[src_ip] = time.time()
+            now = time.time()
+            for src_ip, remaining in self.ban_backend.list_banned().items():
+                if self.is_valid_target(src_ip):
+                    self.banned_ips[src_ip] = now
+                    # ipset cho biết thời gian còn lại; iptables thì tính lại từ đầu
+                    self.ban_scheduler.schedule(src_ip, ban_time, now,
+                                                ttl=ban_time if remaining is None else remaining)
         except Exception:
             pass
 
     def is_valid_ip(self, ip):
-        if not ip: return False
-        if ip.startswith('::ffff:'): ip = ip.replace('::ffff:', '')
-        parts = ip.split('.')
-        if len(parts) != 4: return False
-        try:
-            return all(0 <= int(part) <= 255 for part in parts)
-        except ValueError: return False
-
-    # === CÁC HÀM TOÁN HỌC (MỚI) ===
-    def calculate_z_score(self, history, current_val):
-        """Tính độ lệch chuẩn Z-Score"""
-        if len(history) < MIN_SAMPLES:
-            return 0.0
-        try:
-            mean = statistics.mean(history)
-            stdev = statistics.stdev(history)
-            if stdev == 0: return 0.0
-            return (current_val - mean) / stdev
-        except:
-            return 0.0
-
-    def calculate_entropy(self, data_dict):
-        """Tính Entropy để biết độ phân tán của cuộc tấn công"""
-        # Nếu Entropy thấp -> Tập trung vào 1 vài IP (DoS)
-        # Nếu Entropy cao -> Phân tán đều (DDoS hoặc Traffic sạch)
-        values = list(data_dict.values())
-        total = sum(values)
-        if total == 0: return 0
-        entropy = 0
-        for x in values:
-            if x > 0:
-                p = x / total
-                entropy -= p * math.log2(p)
-        return entropy
-
-    # === CÁC HÀM LẤY DỮ LIỆU (GIỮ NGUYÊN) ===
+        """IPv4, IPv6 hoặc ::ffff:a.b.c.d"""
+        return bool(ip) and is_valid(ip)
+
+    def is_valid_target(self, target):
+        """IP hoặc dải CIDR (a.b.c.d/n, 2001:db8::/n) có thể nằm trong danh sách chặn"""
+        ip, _, plen = target.partition('/')
+        bits = 128 if ':' in ip else 32
+        return self.is_valid_ip(ip) and (not plen or (plen.isdigit() and 0 < int(plen) <= bits))
+
+    def rebuild_banned_nets(self):
+        self.banned_nets = PrefixTable(128)
+        for target in self.banned_ips:
+            if '/' in target:
+                self.banned_nets.add(*parse_cidr(target))
+
+    # === CÁC HÀM LẤY DỮ LIỆU ===
     def get_tcp_stats(self):
-        syn_stats = defaultdict(int)
-        conn_stats = defaultdict(int)
-        whitelist = self.config.get('whitelist', [])
         try:
-            res_syn = subprocess.run(['ss', '-nt', 'state', 'syn-recv'], capture_output=True, text=True)
-            for line in res_syn.stdout.splitlines()[1:]:
-                self._parse_ss_line(line, syn_stats, whitelist)
-
-            res_est = subprocess.run(['ss', '-nt', 'state', 'established'], capture_output=True, text=True)
-            for line in res_est.stdout.splitlines()[1:]:
-                self._parse_ss_line(line, conn_stats, whitelist)
+            if self.sketches:
+                syn, conn = self.get_tcp_sketch()
+                SOCKETS.inc(self.sketches['syn'].total, 'syn_recv')
+                SOCKETS.inc(self.sketches['conn'].total, 'established')
+            else:
+                syn, conn = self.tcp_collector.collect(self.whitelist)
+                SOCKETS.inc(sum(syn.values()), 'syn_recv')
+                SOCKETS.inc(sum(conn.values()), 'established')
+            return syn, conn
         except Exception as e:
-            logging.error(f"Lỗi TCP Check: {e}")
-        return syn_stats, conn_stats
+            logging.error(f"Lỗi TCP Check ({self.tcp_collector.name}): {e}")
+        return defaultdict(int), defaultdict(int)
 
-    def _parse_ss_line(self, line, stats_dict, whitelist):
-        parts = line.split()
-        try:
-            peer_idx = 4 if len(parts) > 4 else 3 
-            peer_str = parts[peer_idx]
-            if ':' in peer_str:
-                if ']' in peer_str: ip = peer_str.split(']')[0].replace('[', '')
-                else: ip = peer_str.split(':')[0]
-                if self.is_valid_ip(ip) and ip not in whitelist:
-                    stats_dict[ip] += 1
-        except: pass
+    def get_tcp_sketch(self):
+        """Chế độ sketch: chỉ top-k IP (ước lượng Count-Min) được đưa vào analyze_and_block"""
+        syn, conn = self.sketches['syn'], self.sketches['conn']
+        syn.clear()
+        conn.clear()
+        self.tcp_collector.collect_sketch(syn, conn)
+        for name, counter in (('SYN', syn), ('Conn', conn)):
+            self.source_cardinality[name] = sources = counter.cardinality()
+            if sources > 10 * counter.topk.k:
+                logging.info(f"{name}: ~{sources} IP nguồn khác nhau ({counter.total} socket), "
+                             f"chỉ theo dõi top {counter.topk.k}")
+        syn_top, conn_top = syn.top(self.whitelist), conn.top(self.whitelist)
+        self.residuals['syn_src'] = sketch_residual(syn, syn_top)
+        self.residuals['conn_src'] = sketch_residual(conn, conn_top)
+        return syn_top, conn_top
 
     def get_udp_stats(self):
+        whitelist = self.whitelist
+        if self.udp_counter:
+            udp_stats = self.udp_counter.snapshot(whitelist)
+            self.udp_ports = self.udp_counter.ports()
+            if self.udp_counter.sketch is not None:
+                self.residuals['udp_src'] = sketch_residual(self.udp_counter.sketch, udp_stats)
+            FLOWS.inc(sum(udp_stats.values()))
+            return udp_stats
         udp_stats = defaultdict(int)
-        whitelist = self.config.get('whitelist', [])
+        ports = self.udp_ports = defaultdict(int)
         try:
-            cmd = "conntrack -L -p udp 2>/dev/null | head -n 5000"
-            output = subprocess.check_output(cmd, shell=True, text=True)
-            for line in output.splitlines():
-                if 'src=' in line:
-                    parts = line.split()
-                    for p in parts:
-                        if p.startswith('src='):
-                            ip = p.split('=')[1]
-                            if self.is_valid_ip(ip) and ip not in whitelist:
-                                udp_stats[ip] += 1
-                            break 
+            for family in ('ipv4', 'ipv6'):
+                cmd = f"conntrack -L -p udp -f {family} 2>/dev/null | head -n 5000"
+                output = subprocess.check_output(cmd, shell=True, text=True)
+                for line in output.splitlines():
+                    if 'src=' in line:
+                        parts = line.split()
+                        for p in parts:
+                            if p.startswith('src='):
+                                key = try_pack(p.split('=')[1])
+                                if key is not None and key not in whitelist:
+                                    udp_stats[key] += 1
+                                break 
+                        port = parse_conntrack_dport(line)
+                        if port is not None:
+                            ports[port] += 1
         except: pass
+        FLOWS.inc(sum(udp_stats.values()))
         return udp_stats
 
+    def get_packet_stats(self):
+        """Số gói / giây theo nguồn kể từ lần gọi trước (đã nhân hệ số lấy mẫu)"""
+        try:
+            return self.packet_collector.snapshot(self.whitelist)['packets']
+        except Exception as e:
+            logging.error(f"Lỗi đọc ring AF_PACKET: {e}")
+        return {}
+
     # === LOGIC CHẶN THÔNG MINH (UPDATED) ===
     def check_for_attacks(self, syn_stats, conn_stats, udp_stats):
-        syn_thresh = int(self.config.get('syn_threshold', 50))
-        conn_thresh = int(self.config.get('conn_threshold', 100))
-        udp_thresh = int(self.config.get('udp_threshold', 100))
-
-        # 1. Tính Entropy toàn cục (Để cảnh báo dạng tấn công)
-        udp_entropy = self.calculate_entropy(udp_stats)
-        if sum(udp_stats.values()) > 50 and udp_entropy < 1.0:
-            logging.info(f"CẢNH BÁO: Entropy UDP thấp ({udp_entropy:.2f}) -> Dấu hiệu tấn công tập trung!")
-
-        # 2. Kiểm tra từng loại tấn công với Z-Score
-        self.analyze_and_block(syn_stats, self.syn_history, syn_thresh, "SYN Flood")
-        self.analyze_and_block(conn_stats, self.conn_history, conn_thresh, "Conn Flood")
+        self.check_tcp(syn_stats, conn_stats)
+        self.check_udp(udp_stats)
+
+    def check_packets(self, pps_stats):
+        self.analyze_and_block(pps_stats, self.pkt_history, self.settings.thresholds['pps'], "Packet Flood")
+        self.log_history_evictions()
+
+    def check_tcp(self, syn_stats, conn_stats):
+        thresholds = self.settings.thresholds
+        self.analyze_and_block(syn_stats, self.syn_history, thresholds['syn'], "SYN Flood")
+        self.analyze_and_block(conn_stats, self.conn_history, thresholds['conn'], "Conn Flood")
+        self.log_history_evictions()
+        self.observe_tcp(syn_stats, conn_stats)
+
+    def check_udp(self, udp_stats):
+        udp_thresh = self.settings.thresholds['udp']
+        self.observe_udp(udp_stats)
+
+        # Entropy nguồn UDP trong cửa sổ (Để cảnh báo dạng tấn công)
+        udp = self.metrics.current('udp_src')
+        if udp.total > 50 and udp.entropy() < 1.0:
+            logging.info(f"CẢNH BÁO: Entropy UDP thấp ({udp.entropy():.2f}) -> Dấu hiệu tấn công tập trung!")
+
         self.analyze_and_block(udp_stats, self.udp_history, udp_thresh, "UDP Flood")
+        self.log_history_evictions()
+
+    # === PHÂN BỐ THEO CỬA SỔ TRƯỢT ===
+    def observe_tcp(self, syn_stats, conn_stats):
+        metrics = self.metrics
+        total = 0
+        for name, stats in (('syn_src', syn_stats), ('conn_src', conn_stats)):
+            residual = self.residuals.pop(name, None)
+            metrics.observe(name, stats, residual=residual)
+            total += sum(stats.values()) + (max(residual[0], 0) if residual else 0)
+        metrics.observe('syn_dport', self.tcp_collector.syn_ports)
+        metrics.observe('proto', {'tcp': total})
+        self.record_metrics()
+
+    def observe_udp(self, udp_stats):
+        metrics = self.metrics
+        residual = self.residuals.pop('udp_src', None)
+        metrics.observe('udp_src', udp_stats, residual=residual)
+        metrics.observe('udp_dport', self.udp_ports)
+        metrics.observe('proto', {'udp': sum(udp_stats.values()) + (max(residual[0], 0) if residual else 0)})
+        self.record_metrics()
+
+    def prune_store(self, store, now):
+        """Dọn kho sự kiện: chỉ số theo metrics_retention, sự kiện theo events_retention / events_max_rows"""
+        store.prune_metrics(now - float(self.config.get('metrics_retention', 7 * 86400)))
+        retention = float(self.config.get('events_retention', 30 * 86400))
+        store.prune_events(now - retention if retention else None, int(self.config.get('events_max_rows', 0)))
+
+    def record_metrics(self):
+        """Lấy mẫu mỗi bucket: ghi vào kho sự kiện, báo khi dạng tấn công (DoS / DDoS) đổi"""
+        sample = self.metrics.maybe_sample()
+        if not sample:
+            return
+        ts, values = sample
+        store = self.journal.store
+        if store:
+            try:
+                store.add_metrics(ts, values)
+                if self.metrics.samples % self.metrics.history.maxlen == 0:
+                    self.prune_store(store, ts)
+            except Exception as e:
+                logging.error(f"Lỗi ghi chỉ số phân bố: {e}")
+        thresholds = self.settings.thresholds
+        cycles = max(self.metrics.window / self.settings.check_interval, 1)
+        for name, key in zip(SOURCE_METRICS, ('syn', 'conn', 'udp')):
+            # Chỉ phân loại khi lưu lượng trung bình mỗi chu kỳ vượt mức HARD LIMIT của một IP
+            shape = self.metrics.shape(name, thresholds[key] * HARD_LIMIT_MULTIPLIER * cycles, now=ts)
+            if shape != self.attack_shapes.get(name):
+                if shape:
+                    logging.info(f"Phân bố {name}: dạng {shape} (H={values[name + '.entropy']:.2f} bit, "
+                                 f"chuẩn hóa {values[name + '.norm']:.2f}, {values[name + '.distinct']} nguồn)")
+                self.attack_shapes[name] = shape
+
+    def log_history_evictions(self):
+        metrics = self.history_metrics()
+        if metrics['evictions'] > self.last_evictions:
+            logging.info(f"Lịch sử Z-Score: theo dõi {metrics['tracked_keys']} IP, "
+                         f"đã loại {metrics['evictions'] - self.last_evictions} IP cũ")
+            self.last_evictions = metrics['evictions']
+
+    def history_metrics(self):
+        """Số IP đang theo dõi và tổng số IP đã bị loại khỏi lịch sử"""
+        stores = (self.syn_history, self.conn_history, self.udp_history, self.pkt_history)
+        return {
+            'tracked_keys': sum(h.tracked_keys for h in stores),
+            'evictions': sum(h.evictions for h in stores),
+        }
+
+    def decide(self, count, z_score, threshold, attack_name):
+        """Luật chặn chung cho IP và subnet: trả về lý do chặn hoặc None"""
+        # Điều kiện 1: Tấn công quá mạnh (Gấp 3 lần ngưỡng) -> CHẶN NGAY
+        if count > (threshold * HARD_LIMIT_MULTIPLIER):
+            return f"{attack_name} (HARD LIMIT: {count} > {threshold * HARD_LIMIT_MULTIPLIER:g})"
+
+        # Điều kiện 2: Vượt ngưỡng VÀ Bất thường (Z-Score cao) -> CHẶN
+        if count > threshold and z_score > Z_THRESHOLD:
+            return f"{attack_name} (Z-Score: {count} > {threshold:g}, Z={z_score:.2f})"
+        return None
 
     def analyze_and_block(self, current_stats, history_store, threshold, attack_name):
         """Hàm xử lý chung cho cả TCP và UDP"""
-        for ip, count in current_stats.items():
-            # Thêm vào lịch sử để học
-            history_store[ip].append(count)
-            
-            # Tính toán
-            z_score = self.calculate_z_score(history_store[ip], count)
-            
+        # Cập nhật lịch sử của mọi IP, chỉ nhận lại Z-Score của các IP vượt ngưỡng
+        # (khóa int của ipaddr, chỉ đổi sang chuỗi cho số ít IP vượt ngưỡng)
+        for key, count, z_score in history_store.update(current_stats, threshold):
+            ip = unpack(key)
             # --- LOGIC QUYẾT ĐỊNH CHẶN ---
-            should_block = False
-            reason_detail = ""
+            reason_detail = self.decide(count, z_score, threshold, attack_name)
+            should_block = reason_detail is not None
 
-            # Điều kiện 1: Tấn công quá mạnh (Gấp 3 lần ngưỡng) -> CHẶN NGAY
-            if count > (threshold * HARD_LIMIT_MULTIPLIER):
-                should_block = True
-                reason_detail = f"{attack_name} (HARD LIMIT: {count} > {threshold*3})"
-
-            # Điều kiện 2: Vượt ngưỡng VÀ Bất thường (Z-Score cao) -> CHẶN
-            elif count > threshold and z_score > Z_THRESHOLD:
-                should_block = True
-                reason_detail = f"{attack_name} (Z-Score: {count} > {threshold}, Z={z_score:.2f})"
-
-            # Debug nhẹ
+            # Debug nhẹ (bật bằng log level DEBUG, không in ra stdout trong lúc flood)
             if count > threshold:
-                print(f"[DEBUG] {ip}: Count={count}, Threshold={threshold}, Z={z_score:.2f} -> Block? {should_block}")
+                logging.debug(f"{ip}: Count={count}, Threshold={threshold}, Z={z_score:.2f} -> Block? {should_block}")
 
-            if should_block and ip not in self.banned_ips:
+            if should_block and ip not in self.banned_ips and not self.in_banned_net(key):
                 self.block_ip(ip, reason_detail)
 
+        # Gộp theo subnet: botnet giữ từng IP dưới ngưỡng vẫn bị phát hiện ở mức /24, /16, ASN (/64, /48 với IPv6)
+        if self.subnet_aggregator:
+            for targets, label, reason in self.subnet_aggregator.analyze(
+                    current_stats, threshold, attack_name, self.decide, self.skip_net):
+                for network, plen in targets:
+                    self.block_ip(format_cidr(network, plen), reason)
+
+    def in_banned_net(self, key):
+        return bool(self.banned_nets.lengths) and key in self.banned_nets
+
+    def skip_net(self, network, plen):
+        """Không chặn dải đã bị chặn hoặc chứa địa chỉ trong whitelist"""
+        return self.banned_nets.covers(network, plen) or self.whitelist.overlaps(network, plen)
+
+    def collapse_host_bans(self, nets):
+        """Gỡ các lệnh chặn một host nằm trong dải CIDR vừa chặn thành công (gộp nhiều rule thành một)"""
+        table = PrefixTable(128)
+        for network, plen in nets:
+            table.add(network, plen, format_cidr(network, plen))
+        for target in list(self.banned_ips):
+            if '/' in target:
+                continue
+            key = try_pack(target)
+            net = table.lookup(key) if key is not None else None
+            if net is not None:
+                self.forget_ban(target)
+                self.ban_scheduler.cancel(target)
+                self.queue_unban(target, f'Superseded by {net}')
+
+    def supersede_nets(self, network, plen):
+        """Gỡ (trong cùng lô) các dải hẹp hơn nằm trong dải sắp chặn.
+        Set interval của nftables không nhận phần tử chồng lấn, backend gỡ trước rồi mới thêm."""
+        for target in [t for t in self.banned_ips if '/' in t]:
+            net, length = parse_cidr(target)
+            if length > plen and net >> (128 - plen) == network >> (128 - plen):
+                self.forget_ban(target)
+                self.ban_scheduler.cancel(target)
+                self.queue_unban(target, f'Superseded by {format_cidr(network, plen)}')
+
+    def queue_unban(self, target, reason):
+        """Gỡ chặn ở lần flush tới với lý do khác hết hạn (ghi vào log / nhật ký cảnh báo)"""
+        self.pending_unbans.append(target)
+        self.unban_reasons[target] = reason
+
     def block_ip(self, ip, reason):
+        """Đưa IP vào hàng đợi chặn, áp dụng thật ở flush_bans() cuối chu kỳ"""
+        if ip in self.banned_ips: return
+        with stage('block_ip'):
+            if '/' in ip:
+                network, plen = parse_cidr(ip)
+                self.supersede_nets(network, plen)
+                self.banned_nets.add(network, plen)
+            now = time.time()
+            self.banned_ips[ip] = now
+            self.ban_reasons[ip] = reason
+            ttl = self.ban_scheduler.schedule(ip, int(self.config.get('ban_time', 300)), now)
+            self.pending_bans.append(Ban(ip, ttl, reason))
+
+    def unban_old_ips(self):
+        """Chỉ lấy các IP đã đến hạn từ heap, gỡ chặn cùng một lô ở flush_bans()"""
+        for ip in self.ban_scheduler.pop_due():
+            self.forget_ban(ip)
+            self.pending_unbans.append(ip)
+
+    def forget_ban(self, target):
+        self.banned_ips.pop(target, None)
+        self.ban_reasons.pop(target, None)
+        if '/' in target:
+            self.banned_nets.remove(*parse_cidr(target))
+
+    def take_pending_bans(self):
+        """Lấy (và xóa) các ban/unban đang chờ áp dụng"""
+        bans, unbans = self.pending_bans, self.pending_unbans
+        self.pending_bans, self.pending_unbans = [], []
+        return bans, unbans
+
+    def flush_bans(self):
+        """Áp dụng toàn bộ ban/unban của chu kỳ bằng một lô lệnh"""
+        bans, unbans = self.take_pending_bans()
+        if not bans and not unbans: return
         try:
-            check = subprocess.run(['iptables', '-C', 'INPUT', '-s', ip, '-j', 'DROP'], capture_output=True)
-            if check.returncode != 0:
-                subprocess.run(['iptables', '-I', 'INPUT', '1', '-s', ip, '-j', 'DROP'], check=True)
-                
-                if "UDP" in reason:
-                    subprocess.run(f"conntrack -D -p udp -s {ip}", shell=True, stderr=subprocess.DEVNULL)
-
-                logging.warning(f"ĐÃ CHẶN IP: {ip} - Lý do: {reason}")
-                self.banned_ips[ip] = time.time()
-                self.write_alert({
-                    'timestamp': time.time(),
-                    'ip': ip,
-                    'reason': reason,
-                    'action': 'BLOCKED'
-                })
+            failed = self.ban_backend.apply(bans, unbans)
         except Exception as e:
-            logging.error(f"Lỗi khi chặn {ip}: {e}")
+            logging.error(f"Lỗi backend {self.ban_backend.name}: {e}")
+            failed = {b.ip for b in bans}
+        self.finish_bans(bans, unbans, failed)
 
-    def unban_old_ips(self):
-        ban_time = int(self.config.get('ban_time', 300))
-        if ban_time <= 0: return
-        current_time = time.time()
-        for ip, blocked_time in list(self.banned_ips.items()):
-            if current_time - blocked_time > ban_time:
-                try:
-                    subprocess.run(['iptables', '-D', 'INPUT', '-s', ip, '-j', 'DROP'], check=True)
-                    logging.info(f"GỠ BỎ CHẶN {ip} (Hết hạn)")
-                    del self.banned_ips[ip]
-                    self.write_alert({'timestamp': time.time(), 'ip': ip, 'reason': 'Expired', 'action': 'UNBANNED'})
-                except Exception:
-                    del self.banned_ips[ip]
+    def finish_bans(self, bans, unbans, failed):
+        """Ghi log / cảnh báo sau khi backend đã áp dụng một lô"""
+        BANS_PER_CYCLE.observe(len(bans))
+        BANS.inc(len(bans) - len(failed), 'ok')
+        if failed:
+            BANS.inc(len(failed), 'failed')
+        UNBANS.inc(len(unbans))
+        for b in bans:
+            if b.ip in failed:
+                logging.error(f"Lỗi khi chặn {b.ip}")
+                self.forget_ban(b.ip)
+                self.ban_scheduler.cancel(b.ip)
+                continue
+            logging.warning(f"ĐÃ CHẶN IP: {b.ip} - Lý do: {b.reason}")
+            self.write_alert({
+                'timestamp': time.time(),
+                'ip': b.ip,
+                'reason': b.reason,
+                'action': 'BLOCKED'
+            })
+        nets = [parse_cidr(b.ip) for b in bans if '/' in b.ip and b.ip not in failed]
+        if nets:
+            self.collapse_host_bans(nets)
+        for ip in unbans:
+            reason = self.unban_reasons.pop(ip, None)
+            logging.info(f"GỠ BỎ CHẶN {ip} ({reason or 'Hết hạn'})")
+            self.write_alert({'timestamp': time.time(), 'ip': ip, 'reason': reason or 'Expired', 'action': 'UNBANNED'})
 
     def write_alert(self, alert_data):
-        try:
-            alerts = []
-            if os.path.exists(ALERT_FILE):
-                with open(ALERT_FILE, 'r') as f:
-                    try: 
-                        data = f.read().strip()
-                        if data: alerts = json.loads(data)
-                    except: pass
-            
-            if not isinstance(alerts, list): alerts = []
-            alerts.append(alert_data)
-            alerts = alerts[-100:] 
-            
-            with open(ALERT_FILE, 'w') as f:
-                json.dump(alerts, f, indent=2)
-        except Exception: pass
+        # Ghi nối vào nhật ký NDJSON, flush theo lô ở cuối mỗi chu kỳ
+        self.journal.append(alert_data)
+
+    def run_cycle(self):
+        """Một chu kỳ tuần tự: nạp config nếu đổi, lấy số liệu, phát hiện, gỡ chặn, áp dụng"""
+        cycle = Cycle('sync')
+        with cycle.stage('config'):
+            self.refresh_config()
+        with cycle.stage('tcp_collect'):
+            syn, conn = self.get_tcp_stats()
+        with cycle.stage('udp_collect'):
+            udp = self.get_udp_stats()
+
+        with cycle.stage('detect'):
+            self.check_for_attacks(syn, conn, udp)
+        if self.packet_collector:
+            with cycle.stage('packet'):
+                self.check_packets(self.get_packet_stats())
+        with cycle.stage('unban'):
+            self.unban_old_ips()
+        with cycle.stage('enforce'):
+            self.flush_bans()
+        with cycle.stage('journal'):
+            self.journal.flush()
+            self.checkpoint()
+        self.finish_cycle(cycle)
+
+    def finish_cycle(self, cycle):
+        """Cập nhật gauge và ghi một dòng log JSON cho chu kỳ / bước vừa xong"""
+        tracked = {}
+        for name in ('syn', 'conn', 'udp', 'pkt'):
+            tracked[name] = getattr(self, f'{name}_history').tracked_keys
+            TRACKED_KEYS.set(tracked[name], name)
+        BANNED.set(len(self.banned_ips))
+        record = cycle.finish(tracked_keys=tracked, banned=len(self.banned_ips))
+        if record and self.cycle_log:
+            self.cycle_log.append(record)
+
+    def wait_next_cycle(self, interval):
+        """Ngủ đến chu kỳ sau, thức dậy giữa chừng để gỡ chặn đúng hạn"""
+        deadline = time.time() + interval
+        while True:
+            due = self.ban_scheduler.next_due()
+            wake = deadline if due is None else min(deadline, due)
+            time.sleep(max(wake - time.time(), 0))
+            if time.time() >= deadline:
+                return
+            self.unban_old_ips()
+            self.flush_bans()
+            self.journal.flush()
 
     def run(self):
         logging.info("Firewall Monitor (Hybrid: Threshold + Z-Score) Started...")
         print("Đang chạy... Nhấn Ctrl+C để dừng.")
         while True:
             try:
-                self.config = self.load_config()
-                syn, conn = self.get_tcp_stats()
-                udp = self.get_udp_stats()
-                
-                self.check_for_attacks(syn, conn, udp)
-                self.unban_old_ips()
-                
-                time.sleep(self.config.get('check_interval', 5))
+                self.run_cycle()
+                self.wait_next_cycle(self.settings.check_interval)
             except KeyboardInterrupt:
                 print("\nDừng chương trình.")
+                self.checkpoint(force=True)
                 break
             except Exception as e:
                 logging.error(f"Lỗi main loop: {e}")
                 time.sleep(5)
 
 if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(LOG_FILE),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
     if os.geteuid() != 0:
         print("Cần chạy với quyền ROOT (sudo)!")
         sys.exit(1)
@@ -282,4 +619,8 @@ if __name__ == "__main__":
         time.sleep(3)
 
     app = DosDetector()
-    app.run()
+    if '--async' in sys.argv or app.config.get('daemon_mode') == 'async':
+        from async_daemon import AsyncDetectorDaemon
+        AsyncDetectorDaemon(app).run()
+    else:
+        app.run()
@@ -1,8 +1,8 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import subprocess
-import json
-import os
+from whitelist import normalize_entry
+from config_manager import DEFAULTS, read_config, save_config_atomic, validate
 
 class AutoBlockTab:
     def __init__(self, parent):
@@ -36,12 +36,12 @@ class AutoBlockTab:
         
         # Grid layout cho config
         # Row 0: SYN Threshold
-        ttk.Label(config_frame, text="Ngưỡng SYN Flood (gói/phút):").grid(row=0, column=0, sticky=tk.W, padx=10, pady=5)
+        ttk.Label(config_frame, text="Ngưỡng SYN Flood (SYN_RECV/IP mỗi chu kỳ):").grid(row=0, column=0, sticky=tk.W, padx=10, pady=5)
         self.syn_threshold = tk.StringVar()
         ttk.Spinbox(config_frame, from_=10, to=10000, textvariable=self.syn_threshold, width=10).grid(row=0, column=1, padx=5)
         
         # Row 1: Connection Threshold
-        ttk.Label(config_frame, text="Ngưỡng Kết Nối (conn/phút):").grid(row=1, column=0, sticky=tk.W, padx=10, pady=5)
+        ttk.Label(config_frame, text="Ngưỡng Kết Nối (ESTABLISHED/IP mỗi chu kỳ):").grid(row=1, column=0, sticky=tk.W, padx=10, pady=5)
         self.conn_threshold = tk.StringVar()
         ttk.Spinbox(config_frame, from_=10, to=10000, textvariable=self.conn_threshold, width=10).grid(row=1, column=1, padx=5)
         
@@ -55,9 +55,15 @@ class AutoBlockTab:
         ttk.Label(config_frame, text="Chu kỳ kiểm tra (giây):").grid(row=3, column=0, sticky=tk.W, padx=10, pady=5)
         self.check_interval = tk.StringVar()
         ttk.Entry(config_frame, textvariable=self.check_interval, width=10).grid(row=3, column=1, padx=5)
+
+        # Row 4: Packet rate threshold (chỉ dùng khi packet_collector = "ring")
+        ttk.Label(config_frame, text="Ngưỡng gói tin (gói/giây/IP):").grid(row=4, column=0, sticky=tk.W, padx=10, pady=5)
+        self.pps_threshold = tk.StringVar()
+        ttk.Entry(config_frame, textvariable=self.pps_threshold, width=10).grid(row=4, column=1, padx=5)
+        ttk.Label(config_frame, text="(cần packet_collector = ring)").grid(row=4, column=2, sticky=tk.W)
         
         # Save button
-        ttk.Button(config_frame, text="Lưu Cấu Hình", command=self.save_config).grid(row=4, column=0, columnspan=3, pady=10)
+        ttk.Button(config_frame, text="Lưu Cấu Hình", command=self.save_config).grid(row=5, column=0, columnspan=3, pady=10)
         
         # --- 3. Whitelist Frame ---
         whitelist_frame = ttk.LabelFrame(main_frame, text="IP Whitelist (Danh Sách Tin Cậy)")
@@ -124,27 +130,16 @@ class AutoBlockTab:
             messagebox.showerror("Lỗi Systemctl", f"Không thể thay đổi trạng thái dịch vụ.\nBạn có đang chạy với quyền sudo không?\n\nLỗi: {e}")
 
     def load_config(self):
-        default_config = {
-            'syn_threshold': 50,
-            'conn_threshold': 100,
-            'ban_time': 300,
-            'check_interval': 10,
-            'whitelist': ['127.0.0.1']
-        }
-        
         try:
-            if os.path.exists(self.config_file):
-                with open(self.config_file, 'r') as f:
-                    config = json.load(f)
-            else:
-                config = default_config
-        except:
-            config = default_config
+            config = dict(DEFAULTS, **read_config(self.config_file))
+        except Exception:
+            config = dict(DEFAULTS)
         
-        self.syn_threshold.set(config.get('syn_threshold', 50))
-        self.conn_threshold.set(config.get('conn_threshold', 100))
-        self.ban_time.set(config.get('ban_time', 300))
-        self.check_interval.set(config.get('check_interval', 10))
+        self.syn_threshold.set(config['syn_threshold'])
+        self.conn_threshold.set(config['conn_threshold'])
+        self.ban_time.set(config['ban_time'])
+        self.check_interval.set(config['check_interval'])
+        self.pps_threshold.set(config['pps_threshold'])
         
         self.whitelist_listbox.delete(0, tk.END)
         for ip in config.get('whitelist', []):
@@ -152,18 +147,28 @@ class AutoBlockTab:
 
     def save_config(self):
         try:
-            config = {
+            updates = {
                 'syn_threshold': int(self.syn_threshold.get()),
                 'conn_threshold': int(self.conn_threshold.get()),
                 'ban_time': int(self.ban_time.get()),
                 'check_interval': int(self.check_interval.get()),
+                'pps_threshold': int(self.pps_threshold.get()),
                 'whitelist': list(self.whitelist_listbox.get(0, tk.END))
             }
+            errors = validate(updates)
+            if errors:
+                messagebox.showerror("Cấu hình không hợp lệ", "\n".join(errors))
+                return
             
-            with open(self.config_file, 'w') as f:
-                json.dump(config, f, indent=4)
+            # Giữ các khóa khác trong file (backend, collector, subnet...), chỉ thay phần form quản lý
+            try:
+                config = read_config(self.config_file)
+            except ValueError:
+                config = {}
+            config.update(updates)
+            save_config_atomic(self.config_file, config)
             
-            messagebox.showinfo("Thành công", "Đã lưu cấu hình.\nNếu dịch vụ đang chạy, nó sẽ tự cập nhật ở chu kỳ tiếp theo.")
+            messagebox.showinfo("Thành công", "Đã lưu cấu hình.\nNếu dịch vụ đang chạy, nó sẽ áp dụng ngay khi file thay đổi.")
             
         except ValueError:
             messagebox.showerror("Lỗi nhập liệu", "Vui lòng nhập số nguyên hợp lệ cho các trường cấu hình.")
@@ -173,9 +178,11 @@ class AutoBlockTab:
     def add_whitelist_ip(self):
         ip = self.new_ip_var.get().strip()
         if not ip: return
-        # Validate sơ bộ
-        if ip.count('.') != 3:
-            messagebox.showwarning("Lỗi IP", "Định dạng IP không hợp lệ")
+        # Chấp nhận IP hoặc dải CIDR (IPv4 / IPv6), lưu ở dạng chuẩn
+        try:
+            ip = normalize_entry(ip)
+        except ValueError:
+            messagebox.showwarning("Lỗi IP", "Định dạng IP / CIDR không hợp lệ (vd: 10.0.0.0/8, 2001:db8::/32)")
             return
         
         if ip not in self.whitelist_listbox.get(0, tk.END):
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Lịch hết hạn lệnh chặn cho DosDetector (min-heap, xóa lười).
+
+unban_old_ips cũ duyệt toàn bộ banned_ips mỗi chu kỳ. BanScheduler giữ một heap
+(hết hạn lúc, ip) nên mỗi tick chỉ lấy ra đúng các IP đã đến hạn: O(k log n)
+với k IP hết hạn thay vì O(n) với n IP đang bị chặn. Gia hạn / hủy một lệnh chặn
+không xóa phần tử trong heap mà chỉ cập nhật `expires`; phần tử cũ bị bỏ qua khi
+được lấy ra.
+
+Mỗi lệnh chặn có TTL riêng. IP tái phạm trong offense_window giây bị chặn lâu hơn:
+ttl = ban_time * escalation ** (số lần đã bị chặn), tối đa max_ttl.
+
+Dùng:
+    python3 ban_scheduler.py [100000]    # benchmark chi phí tick và độ chính xác
+"""
+import heapq
+import time
+
+MAX_OFFENDERS = 200000
+
+
+class BanScheduler:
+    def __init__(self, escalation=2.0, max_ttl=86400, offense_window=86400):
+        self.escalation = escalation
+        self.max_ttl = max_ttl
+        self.offense_window = offense_window
+        self.heap = []       # (hết hạn lúc, ip), có thể chứa phần tử đã cũ
+        self.expires = {}    # ip -> thời điểm hết hạn hiện hành
+        self.offenses = {}   # ip -> (số lần bị chặn, lần chặn gần nhất)
+
+    def __len__(self):
+        return len(self.expires)
+
+    def __contains__(self, ip):
+        return ip in self.expires
+
+    def _offense_count(self, ip, now):
+        count, last = self.offenses.get(ip, (0, 0))
+        return count if now - last <= self.offense_window else 0
+
+    def ttl_for(self, ip, base, now):
+        """TTL cho lần chặn tiếp theo của ip (đã tính tái phạm)"""
+        if base <= 0:
+            return 0
+        return int(min(base * self.escalation ** self._offense_count(ip, now), max(self.max_ttl, base)))
+
+    def schedule(self, ip, base, now=None, ttl=None):
+        """Ghi nhận một lệnh chặn, trả về TTL thực tế (0 = vĩnh viễn, không hết hạn).
+        ttl: dùng đúng TTL này (khôi phục từ kernel) thay vì tính theo tái phạm."""
+        now = time.time() if now is None else now
+        if ttl is None:
+            ttl = self.ttl_for(ip, base, now)
+            self.offenses[ip] = (self._offense_count(ip, now) + 1, now)
+            if len(self.offenses) > MAX_OFFENDERS:
+                self._prune_offenses(now)
+        if ttl <= 0:
+            self.expires.pop(ip, None)
+            return 0
+        expires = now + ttl
+        self.expires[ip] = expires
+        heapq.heappush(self.heap, (expires, ip))
+        return ttl
+
+    def load(self, expires):
+        """Nạp hàng loạt {ip: thời điểm hết hạn} (khôi phục snapshot), dựng heap một lần"""
+        self.expires.update(expires)
+        self.heap.extend((when, ip) for ip, when in expires.items())
+        heapq.heapify(self.heap)
+
+    def cancel(self, ip):
+        """Bỏ lịch hết hạn (ví dụ khi lệnh chặn thất bại)"""
+        self.expires.pop(ip, None)
+
+    def next_due(self):
+        """Thời điểm hết hạn gần nhất, hoặc None"""
+        heap, expires = self.heap, self.expires
+        while heap and expires.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)  # Phần tử đã bị hủy / gia hạn
+        return heap[0][0] if heap else None
+
+    def pop_due(self, now=None):
+        """Lấy ra các IP đã hết hạn tính đến `now`"""
+        now = time.time() if now is None else now
+        heap, expires = self.heap, self.expires
+        due = []
+        while heap and heap[0][0] <= now:
+            when, ip = heapq.heappop(heap)
+            if expires.get(ip) == when:
+                del expires[ip]
+                due.append(ip)
+        # Heap toàn phần tử cũ (hủy / gia hạn nhiều) -> dựng lại cho gọn
+        if len(heap) > 2 * len(expires) + 1024:
+            self.heap = [(when, ip) for ip, when in expires.items()]
+            heapq.heapify(self.heap)
+        return due
+
+    def _prune_offenses(self, now):
+        cutoff = now - self.offense_window
+        self.offenses = {ip: v for ip, v in self.offenses.items() if v[1] >= cutoff or ip in self.expires}
+
+
+# === BENCHMARK ===
+def _full_scan(banned, now, ban_time):
+    """unban_old_ips cũ: duyệt mọi IP"""
+    due = [ip for ip, t in banned.items() if now - t > ban_time]
+    for ip in due:
+        del banned[ip]
+    return due
+
+
+def benchmark(n=100000, ticks=200, tick=1.0):
+    import random
+    rng = random.Random(1)
+    ips = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(n)]
+
+    # 1) Chi phí mỗi tick với n lệnh chặn đang hoạt động (thời gian mô phỏng)
+    scheduler = BanScheduler()
+    banned = {}
+    for ip in ips:
+        start = rng.uniform(0, 600)
+        scheduler.schedule(ip, 300, now=start, ttl=300)
+        banned[ip] = start
+    heap_cost = scan_cost = 0.0
+    popped = scanned = 0
+    for i in range(ticks):
+        now = 300 + i * tick
+        t = time.perf_counter()
+        popped += len(scheduler.pop_due(now))
+        heap_cost += time.perf_counter() - t
+        t = time.perf_counter()
+        scanned += len(_full_scan(banned, now, 300))
+        scan_cost += time.perf_counter() - t
+    print(f"{n} lệnh chặn, {ticks} tick: heap {heap_cost / ticks * 1e6:8.1f} µs/tick, "
+          f"quét toàn bộ {scan_cost / ticks * 1e6:10.1f} µs/tick ({popped} / {scanned} IP hết hạn)")
+
+    # 2) Độ chính xác thời điểm gỡ chặn (đồng hồ thật, tick ngủ đến hạn gần nhất)
+    scheduler = BanScheduler()
+    now = time.time()
+    for ip in ips[:2000]:
+        scheduler.schedule(ip, 0, now=now, ttl=rng.uniform(0.05, 3.0))
+    wanted = dict(scheduler.expires)
+    lateness = []
+    while scheduler.expires:
+        due_at = scheduler.next_due()
+        time.sleep(max(due_at - time.time(), 0))
+        now = time.time()
+        lateness += [now - wanted[ip] for ip in scheduler.pop_due(now)]
+    lateness.sort()
+    print(f"Độ trễ gỡ chặn (2000 IP): p50={lateness[len(lateness) // 2] * 1000:.2f} ms, "
+          f"p99={lateness[int(len(lateness) * 0.99)] * 1000:.2f} ms, max={lateness[-1] * 1000:.2f} ms")
+
+    # 3) TTL tăng dần với IP tái phạm
+    scheduler = BanScheduler(escalation=2.0, max_ttl=3600)
+    ttls = []
+    for k in range(8):
+        ttls.append(scheduler.schedule('203.0.113.7', 300, now=k * 1000.0))
+    print(f"TTL tái phạm: {ttls}")
+
+
+if __name__ == "__main__":
+    import sys
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Nạp blocklist cục bộ (Spamhaus DROP, IOC nội bộ...) vào một set riêng của kernel.
+
+Trước đây muốn áp dụng một file blocklist chỉ có đường chặn từng IP
+(FirewallManager.block_ip, cửa sổ thêm rule của FirewallTab). BlocklistLoader:
+- đọc các file trong config['blocklist_feeds'] theo từng dòng (không giữ cả
+  file), mỗi dòng một IP / CIDR / dải "a-b", phần sau '#', ';' hoặc ',' bỏ qua;
+  file .gz đọc trực tiếp;
+- gộp dải trong lúc đọc (cidr_merge.merge_ranges mỗi CHUNK dòng, bộ nhớ theo số
+  dải sau khi gộp chứ không theo số dòng), cắt bỏ các dải thuộc whitelist, rồi
+  tách thành tập CIDR tối thiểu;
+- so với nội dung đang nạp trong kernel (ipset fw_blocklist / fw_blocklist6 hoặc
+  table nft fw_blocklist, tách khỏi set chặn động của detector) và chỉ áp dụng phần
+  thêm / bớt trong một lô (`ipset restore` hoặc một transaction `nft -f -`);
+- đọc lại feed mỗi config['blocklist_refresh'] giây trên thread riêng, bỏ qua khi
+  các file không đổi (mtime / kích thước). Một feed đọc lỗi -> giữ nguyên set đang
+  nạp, không gỡ chặn hàng loạt vì một file tạm thời mất.
+
+    python3 blocklist.py [số dòng]        # benchmark: feed 1M dòng, không chạy lệnh
+    python3 blocklist.py --apply          # nạp một lần theo /etc/firewall_auto_block.json
+"""
+import gzip
+import logging
+import os
+import re
+import shutil
+import socket
+import threading
+import time
+
+import ipaddr
+from ipaddr import V4_BASE
+from ban_backend import Ban, IpsetBackend, NftBackend, run_command
+from cidr_merge import merge_ranges, range_to_cidrs, subtract_ranges, to_range
+
+BLOCKLIST_SET = 'fw_blocklist'
+BLOCKLIST_SET6 = 'fw_blocklist6'
+BLOCKLIST_TABLE = 'fw_blocklist'
+BLOCKLIST_MAXELEM = 4194304
+CHUNK = 262144  # Số dải tối thiểu đọc được trước mỗi lần gộp
+REASON = 'blocklist'
+_TOKEN = re.compile(r'\s*([^\s#;,]+)')
+
+
+def blocklist_backend(config):
+    """Set riêng cho blocklist, cùng loại với backend chặn của detector.
+    iptables (mỗi mục một rule) không chứa nổi feed hàng trăm nghìn dải: dùng ipset nếu có."""
+    if config.get('ban_backend') == 'nft':
+        return NftBackend(BLOCKLIST_TABLE)
+    if shutil.which('ipset'):
+        return IpsetBackend(BLOCKLIST_SET, BLOCKLIST_MAXELEM, BLOCKLIST_SET6)
+    raise RuntimeError('blocklist cần ipset hoặc nft (ban_backend = "nft")')
+
+
+# === ĐỌC FEED ===
+def _parse_range(token):
+    """'1.2.3.0/24' / '1.2.3.4' / '1.2.3.4-1.2.3.9' -> (đầu, cuối). ValueError nếu sai."""
+    if '-' in token:
+        first, _, last = token.partition('-')
+        start, end = ipaddr.pack(first), ipaddr.pack(last)
+        if start > end or ipaddr.is_v4(start) != ipaddr.is_v4(end):
+            raise ValueError(f"dải không hợp lệ: {token}")
+        return start, end
+    ip, sep, plen = token.partition('/')
+    if ':' in ip or (sep and not plen.isdigit()):
+        return to_range(*ipaddr.parse_cidr(token))
+    # IPv4 (phần lớn mục của feed): bỏ qua các bước tổng quát của parse_cidr
+    try:
+        key = int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+    except OSError:
+        raise ValueError(f"IP không hợp lệ: {token}")
+    bits = 32 - int(plen) if sep else 0
+    if bits < 0:
+        raise ValueError(f"Prefix không hợp lệ: {token}")
+    host = (1 << bits) - 1
+    start = V4_BASE | (key & ~host)
+    return start, start | host
+
+
+def read_feed(path, stats):
+    """Generator (đầu, cuối) của một file feed; stats['entries'] / stats['invalid'] đếm dần"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            m = _TOKEN.match(line)
+            if m is None:
+                continue  # Dòng trống / chú thích
+            try:
+                r = _parse_range(m.group(1))
+            except ValueError:
+                stats['invalid'] += 1
+                continue
+            stats['entries'] += 1
+            yield r
+
+
+def compile_feeds(paths, whitelist=()):
+    """Các feed -> (đoạn đã gộp và đã trừ whitelist, thống kê từng feed). OSError nếu đọc lỗi."""
+    merged, pending, stats = [], [], []
+    for path in paths:
+        feed = {'feed': path, 'entries': 0, 'invalid': 0}
+        stats.append(feed)
+        for r in read_feed(path, feed):
+            pending.append(r)
+            # Gộp khi phần chưa gộp bằng phần đã gộp: tổng chi phí sắp xếp vẫn O(n log n)
+            if len(pending) >= CHUNK and len(pending) >= len(merged):
+                merged = merge_ranges(merged + pending)
+                pending = []
+    merged = merge_ranges(merged + pending)
+    holes = []
+    for entry in whitelist:
+        try:
+            holes.append(to_range(*ipaddr.parse_cidr(entry)))
+        except ValueError:
+            continue
+    return subtract_ranges(merged, merge_ranges(holes)), stats
+
+
+def to_cidrs(ranges):
+    """Đoạn đã sắp xếp -> danh sách (network, plen), vẫn theo thứ tự địa chỉ"""
+    return [cidr for start, end in ranges for cidr in range_to_cidrs(start, end)]
+
+
+def loaded_set(backend):
+    """Tập {(network, plen)} đang nạp trong set blocklist của kernel"""
+    current = set()
+    for target in backend.list_banned():
+        try:
+            if '-' in target:
+                # nft có thể in phần tử interval dạng dải
+                current.update(range_to_cidrs(*_parse_range(target)))
+            else:
+                current.add(ipaddr.parse_cidr(target))
+        except ValueError:
+            logging.warning(f"Bỏ qua phần tử blocklist không đọc được: {target}")
+    return current
+
+
+def diff(desired, current):
+    """desired: danh sách CIDR đã sắp xếp, current: tập đang nạp -> (thêm, bớt) dạng chuỗi"""
+    wanted = set(desired)
+    additions = [ipaddr.format_cidr(n, p) for n, p in desired if (n, p) not in current]
+    removals = [ipaddr.format_cidr(n, p) for n, p in sorted(current - wanted)]
+    return additions, removals
+
+
+class BlocklistLoader:
+    def __init__(self, backend=None):
+        self.backend = backend  # None = chọn theo config ở lần nạp đầu
+        self.ready = False
+        self.config = {}
+        self.feeds = []
+        self.whitelist = []
+        self.refresh_interval = 0
+        self.signature = None  # Trạng thái các file ở lần áp dụng thành công gần nhất
+        self.last_report = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.running = False
+        self.thread = None
+
+    def configure(self, config):
+        """Áp dụng config (lúc khởi động và mỗi lần config đổi); đổi feed / whitelist -> thread nạp lại ngay"""
+        feeds = list(config.get('blocklist_feeds') or [])
+        whitelist = list(config.get('whitelist') or [])
+        changed = feeds != self.feeds or whitelist != self.whitelist
+        self.config = config
+        self.feeds, self.whitelist = feeds, whitelist
+        self.refresh_interval = float(config.get('blocklist_refresh', 3600))
+        if changed:
+            self.signature = None
+            self.wakeup.set()
+
+    def _signature(self):
+        result = []
+        for path in self.feeds:
+            try:
+                st = os.stat(path)
+                result.append((path, st.st_mtime_ns, st.st_size))
+            except OSError:
+                result.append((path, None, None))
+        return tuple(result), tuple(self.whitelist)
+
+    def _backend(self, setup=True):
+        if self.backend is None:
+            self.backend = blocklist_backend(self.config)
+        if setup and not self.ready:
+            self.backend.setup()
+            self.ready = True
+        return self.backend
+
+    def refresh(self, force=False, current=None, dry_run=False):
+        """Đọc feed, so với kernel (hoặc `current`), áp dụng phần khác. Trả về báo cáo,
+        hoặc None nếu feed không đổi / đọc lỗi (set đang nạp giữ nguyên)."""
+        with self.lock:
+            if not self.feeds and not self.ready:
+                return None  # Chưa dùng blocklist: không tạo set / rule
+            # Danh sách feed rỗng sau khi đã nạp: desired rỗng -> gỡ các dải cũ
+            signature = self._signature()
+            if not force and signature == self.signature:
+                return None
+            start = time.perf_counter()
+            try:
+                ranges, feeds = compile_feeds(self.feeds, self.whitelist)
+            except OSError as e:
+                logging.error(f"Không đọc được feed blocklist, giữ nguyên set đang nạp: {e}")
+                return None
+            desired = to_cidrs(ranges)
+            t_compile = time.perf_counter()
+            backend = self._backend(setup=not dry_run)
+            if current is None:
+                current = loaded_set(backend)
+            additions, removals = diff(desired, current)
+            maxelem = getattr(backend, 'maxelem', None)
+            if maxelem and len(desired) > maxelem:
+                logging.error(f"Blocklist có {len(desired)} dải, vượt maxelem {maxelem} của ipset: không nạp")
+                return None
+            cmds = backend.batch_commands([Ban(t, 0, REASON) for t in additions], removals)
+            t_diff = time.perf_counter()
+            ok = dry_run or all(run_command(c) for c in cmds)
+            done = time.perf_counter()
+            if ok and not dry_run:
+                self.signature = signature
+            report = {
+                'feeds': feeds,
+                'entries': sum(f['entries'] for f in feeds),
+                'invalid': sum(f['invalid'] for f in feeds),
+                'cidrs': len(desired),
+                'added': len(additions),
+                'removed': len(removals),
+                'unchanged': len(desired) - len(additions),
+                'commands': len(cmds),
+                'script_bytes': sum(len(c.input or '') for c in cmds),
+                'success': ok,
+                'compile_ms': round((t_compile - start) * 1000, 1),
+                'diff_ms': round((t_diff - t_compile) * 1000, 1),
+                'apply_ms': round((done - t_diff) * 1000, 1),
+                'total_ms': round((done - start) * 1000, 1),
+            }
+            self.last_report = report
+            if not dry_run:
+                log = logging.info if ok else logging.error
+                log(f"Blocklist {backend.name}: {report['entries']} mục -> {report['cidrs']} dải, "
+                    f"+{report['added']} / -{report['removed']}{'' if ok else ' THẤT BẠI'} "
+                    f"trong {report['total_ms']:.0f} ms")
+            return report
+
+    # --- Đọc lại theo lịch ---
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self._loop, name='blocklist', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def _loop(self):
+        while self.running:
+            self.wakeup.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Lỗi nạp blocklist: {e}")
+            self.wakeup.wait(self.refresh_interval or None)
+
+
+# === BENCHMARK ===
+def _write_feed(path, n, seed=1, churn=0.0):
+    """Feed giả lập kiểu DROP list + IOC: CIDR rải rác, host liền kề, dải a-b.
+    churn: tỉ lệ dòng đổi so với cùng seed (mô phỏng bản feed mới)"""
+    import random
+    rng = random.Random(seed)
+    other = random.Random(seed + 1)
+    with open(path, 'w') as f:
+        f.write('; Spamhaus DROP List (giả lập)\n# IOC nội bộ\n\n')
+        for _ in range(n):
+            r = rng.random()
+            a, b, c, d = rng.randrange(1, 224), rng.randrange(256), rng.randrange(256), rng.randrange(256)
+            if churn and other.random() < churn:
+                a = 224 - a  # Dòng đổi trong bản mới
+            if r < 0.5:
+                f.write(f'45.{b & 0x0f}.{c}.{d}\n')  # Host dày đặc trong vài /16 (botnet, máy quét)
+            elif r < 0.6:
+                f.write(f'{a}.{b}.{c}.{d}\n')
+            elif r < 0.9:
+                f.write(f'{a}.{b}.{c}.0/24 ; SBL{d}\n')
+            elif r < 0.97:
+                f.write(f'{a}.{b}.{c}.{d & 0xf0}-{a}.{b}.{c}.{d | 0x0f}\n')
+            elif r < 0.995:
+                f.write(f'2001:db8:{b:x}{c:02x}::/48 # ioc\n')
+            else:
+                f.write(f'{a}.{b}.{c}.{d}/33\n')  # Dòng lỗi
+
+
+def benchmark(n=1000000):
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        old, new = os.path.join(tmp, 'drop_old.txt'), os.path.join(tmp, 'drop.txt')
+        _write_feed(old, n)
+        _write_feed(new, n, churn=0.01)
+        for name, backend in (('ipset', IpsetBackend(BLOCKLIST_SET, BLOCKLIST_MAXELEM, BLOCKLIST_SET6)),
+                              ('nft', NftBackend(BLOCKLIST_TABLE))):
+            loader = BlocklistLoader(backend)
+            loader.configure({'blocklist_feeds': [old], 'whitelist': ['127.0.0.1', '10.0.0.0/8'],
+                              'blocklist_refresh': 0})
+            first = loader.refresh(force=True, current=set(), dry_run=True)
+            previous = set(to_cidrs(compile_feeds([old], loader.whitelist)[0]))
+            loader.feeds = [new]
+            second = loader.refresh(force=True, current=previous, dry_run=True)
+            for label, r in (('nạp lần đầu', first), ('bản mới (1% dòng đổi)', second)):
+                print(f"{name:5s} {label:22s}: {r['entries']} mục ({r['invalid']} lỗi) -> {r['cidrs']} dải, "
+                      f"+{r['added']} / -{r['removed']}, {r['commands']} lệnh {r['script_bytes'] / 1e6:.1f} MB; "
+                      f"đọc + gộp {r['compile_ms'] / 1000:.2f} s, diff {r['diff_ms'] / 1000:.2f} s")
+        # Đường cũ: mỗi mục một lệnh iptables (block_ip) -> ước lượng từ chi phí fork đo được
+        import subprocess
+        start = time.perf_counter()
+        for _ in range(200):
+            subprocess.run(['true'])
+        fork = (time.perf_counter() - start) / 200
+        print(f"(dry-run, lệnh ipset / nft chưa chạy) chặn từng mục: {first['entries']} lệnh x "
+              f"{fork * 1000:.1f} ms fork = ~{first['entries'] * fork / 60:.0f} phút, chưa tính iptables tự chạy")
+
+
+if __name__ == "__main__":
+    import sys
+    if '--apply' in sys.argv:
+        from config_manager import CONFIG_FILE, read_config
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+        loader = BlocklistLoader()
+        loader.configure(read_config(CONFIG_FILE))
+        print(loader.refresh(force=True))
+    else:
+        benchmark(*(int(a) for a in sys.argv[1:2]))
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Chặn / gỡ chặn hàng loạt (POST /api/bulk của Web dashboard).
+
+/api/action chỉ nhận một IP mỗi request và chạy một lệnh iptables: nạp danh sách
+IOC 20k địa chỉ là 20k request và 20k lần fork. BulkJob nhận cả danh sách dạng
+luồng, mỗi dòng một mục:
+
+    1.2.3.4
+    10.0.0.0/8 3600                  # ttl (giây) sau khoảng trắng hoặc dấu phẩy
+    {"ip": "2001:db8::/32", "ttl": 600}
+    5.6.7.0/24 ; SBL123              # phần sau ';' hoặc '#' là chú thích
+
+- feed(): kiểm tra và khử trùng lặp ngay khi đọc từng dòng (không giữ cả body);
+- plan(): gộp các dải liền kề / chồng lấn thành CIDR tối thiểu (cidr_merge) theo
+  từng mức ttl, bỏ mục đã bị chặn sẵn trong kernel, gỡ trong cùng lô các dải hẹp
+  sống ngắn hơn nằm trong dải mới và tách dải mới quanh các dải sống lâu hơn nằm
+  trong nó (set interval của nft không nhận phần tử chồng lấn);
+- apply(): một lô duy nhất qua backend.batch_commands (ipset restore / nft -f /
+  iptables-restore), trả về kết quả từng dòng và thời gian áp dụng.
+
+    python3 bulk_actions.py [số mục]          # benchmark lập kế hoạch, không chạy lệnh
+    python3 bulk_actions.py file.txt [block|unblock] [--apply]
+"""
+import bisect
+import json
+import re
+import time
+
+import ipaddr
+from ban_backend import Ban, run_command
+from cidr_merge import collapse, merge_ranges, range_to_cidrs, subtract_ranges, to_range
+from prefix_table import PrefixTable
+
+MAX_ITEMS = 1000000
+REASON = 'Chặn hàng loạt (web)'
+_SPLIT = re.compile(r'[\s,]+')
+FOREVER = float('inf')
+
+
+def _life(ttl):
+    """Thời gian sống để so sánh: 0 / None = vĩnh viễn"""
+    return FOREVER if not ttl else ttl
+
+
+def parse_line(line):
+    """Một dòng -> (ip / cidr, ttl hoặc None); None nếu là dòng trống / chú thích.
+    ValueError nếu dòng không đọc được."""
+    line = line.strip()
+    if not line or line[0] in '#;':
+        return None
+    if line[0] == '{':
+        obj = json.loads(line)
+        ip = obj.get('ip') or obj.get('cidr')
+        if not isinstance(ip, str):
+            raise ValueError('thiếu trường ip')
+        return ip.strip(), obj.get('ttl')
+    if line[0] == '"':
+        return json.loads(line).strip(), None
+    line = line.split('#', 1)[0].split(';', 1)[0]
+    parts = _SPLIT.split(line.strip())
+    return parts[0], parts[1] if len(parts) > 1 else None
+
+
+class BulkJob:
+    def __init__(self, action, backend, whitelist=None, default_ttl=0, max_items=MAX_ITEMS,
+                 reason=REASON):
+        if action not in ('block', 'unblock'):
+            raise ValueError(f"hành động không rõ: {action}")
+        self.action = action
+        self.backend = backend
+        self.whitelist = whitelist
+        self.default_ttl = default_ttl
+        self.max_items = max_items
+        self.reason = reason
+        self.results = []   # mỗi dòng một dict: line, input, status [, target, message]
+        self.accepted = {}  # (network, plen) -> [ttl, [chỉ số trong results]]
+        self.bans, self.unbans = [], []
+        self.superseded = []
+        self.timings = {}
+        self.started = time.perf_counter()
+
+    # --- Đọc ---
+    def _result(self, line_no, text, status, message=None):
+        result = {'line': line_no, 'input': text, 'status': status}
+        if message:
+            result['message'] = message
+        self.results.append(result)
+        return result
+
+    def feed_line(self, line_no, raw):
+        try:
+            parsed = parse_line(raw)
+        except ValueError as e:
+            self._result(line_no, raw.strip()[:200], 'invalid', str(e))
+            return
+        if parsed is None:
+            return
+        text, ttl = parsed
+        if len(self.results) >= self.max_items:
+            self._result(line_no, text, 'invalid', f'quá giới hạn {self.max_items} mục mỗi lô')
+            return
+        try:
+            ttl = self.default_ttl if ttl in (None, '') else int(ttl)
+            if ttl < 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            self._result(line_no, text, 'invalid', f'ttl không hợp lệ: {ttl}')
+            return
+        try:
+            network, plen = ipaddr.parse_cidr(text)
+        except ValueError as e:
+            self._result(line_no, text, 'invalid', str(e))
+            return
+        if self.action == 'block' and self.whitelist is not None and self.whitelist.overlaps(network, plen):
+            self._result(line_no, text, 'whitelisted', 'giao với whitelist')
+            return
+        key = (network, plen)
+        entry = self.accepted.get(key)
+        if entry is not None:
+            # Trùng lặp: giữ ttl dài hơn
+            if _life(ttl) > _life(entry[0]):
+                entry[0] = ttl
+            self._result(line_no, text, 'duplicate', f"trùng dòng {self.results[entry[1][0]]['line']}")
+            return
+        self.accepted[key] = [ttl, [len(self.results)]]
+        self._result(line_no, text, 'queued')
+
+    def feed(self, lines):
+        """lines: iterable bytes / str (vd. request.stream), đọc từng dòng"""
+        start = time.perf_counter()
+        for line_no, raw in enumerate(lines, 1):
+            if isinstance(raw, bytes):
+                raw = raw.decode('utf-8', 'replace')
+            self.feed_line(line_no, raw)
+        self.timings['parse_ms'] = (time.perf_counter() - start) * 1000
+        return self
+
+    # --- Lập kế hoạch ---
+    def plan(self, existing=None):
+        """Sinh self.bans / self.unbans. existing: {mục: timeout còn lại} đang chặn
+        (mặc định đọc từ backend.list_banned(), một lệnh)"""
+        start = time.perf_counter()
+        if existing is None:
+            existing = self.backend.list_banned()
+        if self.action == 'block':
+            self._plan_block(existing)
+        else:
+            self._plan_unblock(existing)
+        self.timings['plan_ms'] = (time.perf_counter() - start) * 1000
+        return self
+
+    def _plan_block(self, existing):
+        current = PrefixTable(128)
+        current_nets = []
+        for target, timeout in existing.items():
+            try:
+                network, plen = ipaddr.parse_cidr(target)
+            except ValueError:
+                continue
+            current.add(network, plen, (target, _life(timeout)))
+            if '/' in target:
+                current_nets.append((network, plen, target, _life(timeout)))
+        planned = PrefixTable(128)  # dải của lô này, ttl dài trước: (mục, trạng thái, thời gian sống)
+        held_nets = []              # dải (của lô hoặc kernel) mà dải ttl ngắn hơn phải chừa ra
+        split = {}                  # dải bị tách -> số CIDR thực sự chặn
+        by_ttl = {}
+        for key, (ttl, _) in self.accepted.items():
+            by_ttl.setdefault(ttl, []).append(key)
+        for ttl in sorted(by_ttl, key=_life, reverse=True):
+            life = _life(ttl)
+            # Set interval của nft không nhận dải chồng lấn: dải rộng hơn, sống ngắn hơn được
+            # tách quanh các dải sống lâu hơn nằm trong nó (dải của lô, dải kernel không bị gỡ)
+            holes = merge_ranges(held_nets + [to_range(n, p) for n, p, _, l in current_nets if l > life])
+            starts = [start for start, _ in holes]
+            added = []
+            for network, plen in collapse(by_ttl[ttl]):
+                target = ipaddr.format_cidr(network, plen)
+                if planned.covers(network, plen):
+                    # Nằm trong dải có ttl dài hơn của cùng lô: các mục gắn vào dải đó
+                    continue
+                held = current.covering(network, plen)
+                if held is not None and held[1] >= life:
+                    planned.add(network, plen, (held[0], 'exists', held[1]))
+                    continue
+                planned.add(network, plen, (target, 'blocked', life))
+                start, end = to_range(network, plen)
+                i = bisect.bisect_left(starts, start)
+                if i < len(holes) and holes[i][0] <= end:
+                    pieces = [c for r in subtract_ranges([(start, end)], holes[i:]) for c in range_to_cidrs(*r)]
+                    split[target] = len(pieces)
+                else:
+                    pieces = [(network, plen)]
+                for piece in pieces:
+                    self.bans.append(Ban(ipaddr.format_cidr(*piece), ttl, self.reason))
+                if plen < 128:
+                    added.append((start, end))
+            held_nets += added
+        # Dải hẹp đang chặn nằm trong dải mới và sống ngắn hơn: gỡ trong cùng lô
+        for network, plen, target, life in current_nets:
+            found = planned.covering(network, plen)
+            if found is not None and found[1] == 'blocked' and found[0] != target and found[2] >= life:
+                self.unbans.append(target)
+                self.superseded.append(target)
+        for (network, plen), (_, indexes) in self.accepted.items():
+            found = planned.covering(network, plen)
+            for i in indexes:
+                result = self.results[i]
+                result['target'], result['status'] = found[:2]
+                if found[1] == 'exists' and found[0] != result['input']:
+                    result['message'] = f"đã nằm trong {found[0]}"
+                elif found[0] in split:
+                    result['message'] = f"tách thành {split[found[0]]} dải quanh dải có ttl dài hơn"
+
+    def _plan_unblock(self, existing):
+        current = PrefixTable(128)
+        for target in existing:
+            try:
+                current.add(*ipaddr.parse_cidr(target), target)
+            except ValueError:
+                continue
+        for (network, plen), (_, indexes) in self.accepted.items():
+            target = ipaddr.format_cidr(network, plen)
+            if target in existing:
+                self.unbans.append(target)
+                status, message = 'unblocked', None
+            else:
+                held = current.covering(network, plen)
+                status = 'not_banned'
+                message = f"nằm trong dải đang chặn {held}, cần gỡ cả dải" if held else 'không bị chặn'
+            for i in indexes:
+                result = self.results[i]
+                result['target'], result['status'] = target, status
+                if message:
+                    result['message'] = message
+
+    # --- Áp dụng ---
+    def commands(self):
+        return self.backend.batch_commands(self.bans, self.unbans) if self.bans or self.unbans else []
+
+    def apply(self, dry_run=False):
+        start = time.perf_counter()
+        cmds = self.commands()
+        ok = True
+        if not dry_run:
+            for cmd in cmds:
+                if not run_command(cmd) and cmd.argv[0] != 'conntrack':
+                    ok = False
+        self.timings['apply_ms'] = (time.perf_counter() - start) * 1000
+        self.commands_run = len(cmds)
+        if not ok:
+            done = 'blocked' if self.action == 'block' else 'unblocked'
+            for result in self.results:
+                if result['status'] == done:
+                    result['status'] = 'failed'
+                    result['message'] = 'lệnh áp dụng lô thất bại (xem log)'
+        return ok
+
+    def report(self, details='all'):
+        """details: 'all' | 'errors' (chỉ các dòng không thành công) | 'none'"""
+        counts = {}
+        for result in self.results:
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+        report = {
+            'action': self.action,
+            'backend': self.backend.name,
+            'items': len(self.results),
+            'counts': counts,
+            'targets': len(self.bans) if self.action == 'block' else len(self.unbans),
+            'superseded': self.superseded,
+            'commands': getattr(self, 'commands_run', 0),
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 1),
+        }
+        report.update((k, round(v, 1)) for k, v in self.timings.items())
+        if self.action == 'block' and self.backend.name == 'iptables' and any(b.timeout for b in self.bans):
+            report['warnings'] = ['backend iptables không hỗ trợ timeout: các mục có ttl bị chặn vĩnh viễn']
+        if details == 'errors':
+            ok = ('blocked', 'unblocked', 'exists')
+            report['results'] = [r for r in self.results if r['status'] not in ok]
+        elif details != 'none':
+            report['results'] = self.results
+        return report
+
+
+# === BENCHMARK ===
+def _synthetic_ioc(n, seed=1):
+    import random
+    rng = random.Random(seed)
+    lines = ['# IOC list', '']
+    for i in range(n):
+        r = rng.random()
+        if r < 0.7:
+            lines.append(f'185.{rng.randrange(4)}.{rng.randrange(64)}.{rng.randrange(256)}')
+        elif r < 0.85:
+            lines.append(f'{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.0/24, 3600')
+        elif r < 0.95:
+            lines.append(json.dumps({'ip': f'2001:db8:{rng.randrange(4096):x}::{rng.randrange(65536):x}',
+                                     'ttl': 600}))
+        elif r < 0.99:
+            lines.append(f'185.0.{rng.randrange(4)}.{rng.randrange(256)}')  # dễ trùng
+        else:
+            lines.append(f'999.{i}.0.1')
+    return [line + '\n' for line in lines]
+
+
+def benchmark(n=20000):
+    from ban_backend import IpsetBackend, IptablesBackend, NftBackend
+    from whitelist import WhitelistMatcher
+    lines = _synthetic_ioc(n)
+    whitelist = WhitelistMatcher(['127.0.0.1', '::1', '185.3.63.0/24'])
+    existing = {'185.0.0.7': None, '185.1.0.0/26': 60}
+    for backend in (IptablesBackend(), IpsetBackend(), NftBackend()):
+        job = BulkJob('block', backend, whitelist).feed(lines).plan(existing)
+        job.apply(dry_run=True)
+        report = job.report('none')
+        size = sum(len(c.input or '') for c in job.commands())
+        print(f"{backend.name:8s}: {report['items']} mục -> {report['targets']} CIDR, "
+              f"{report['commands']} lệnh ({size / 1024:.0f} KB stdin) thay cho {report['counts'].get('blocked', 0)} "
+              f"request / lệnh; đọc {report['parse_ms']:.0f} ms, lập kế hoạch {report['plan_ms']:.0f} ms")
+    print(f"  trạng thái: {report['counts']}, gỡ trong cùng lô: {report['superseded']}")
+    job = BulkJob('unblock', IpsetBackend()).feed(['185.0.0.7\n', '185.1.0.5\n', '8.8.8.8\n']).plan(existing)
+    print('  gỡ chặn:', [(r['input'], r['status'], r.get('message')) for r in job.results])
+
+
+if __name__ == "__main__":
+    import sys
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    if args and not args[0].isdigit():
+        from ban_backend import load_backend
+        from whitelist import load_matcher
+        action = args[1] if len(args) > 1 else 'block'
+        job = BulkJob(action, load_backend(), load_matcher('/etc/firewall_auto_block.json'))
+        with open(args[0], 'rb') as f:
+            job.feed(f).plan()
+        job.apply(dry_run='--apply' not in sys.argv)
+        print(json.dumps(job.report('errors'), ensure_ascii=False, indent=2))
+    else:
+        benchmark(*(int(a) for a in args[:1]))
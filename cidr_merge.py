@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Gộp danh sách IP / CIDR thành tập CIDR tối thiểu phủ đúng cùng các địa chỉ.
+
+Làm trên khóa 128 bit của ipaddr: mỗi (network, plen) là một đoạn [đầu, cuối];
+sắp xếp rồi nối các đoạn chồng lấn hoặc liền kề (merge_ranges), sau đó tách mỗi
+đoạn thành ít CIDR nhất (range_to_cidrs: mỗi bước lấy khối 2^k lớn nhất căn
+đúng biên bắt đầu tại `đầu` và không vượt `cuối`). IPv4 và IPv6 được gộp riêng
+để không sinh dải IPv6 chứa cả vùng ::ffff:0:0/96.
+
+    1.2.3.0/25 + 1.2.3.128/25        -> 1.2.3.0/24
+    10.0.0.1 + 10.0.0.0/8            -> 10.0.0.0/8
+    1.2.3.4 .. 1.2.3.7 (4 host)      -> 1.2.3.4/30
+
+    python3 cidr_merge.py [số mục]   # benchmark
+"""
+import time
+from operator import itemgetter
+
+import ipaddr
+
+_V4_FIRST = ipaddr.V4_BASE
+_V4_LAST = ipaddr.V4_BASE | 0xffffffff
+
+
+def to_range(network, plen):
+    return network, network | ((1 << (128 - plen)) - 1)
+
+
+def merge_ranges(ranges):
+    """[(đầu, cuối)] -> các đoạn rời nhau, đã sắp xếp, nối cả đoạn liền kề.
+    Đoạn trong vùng IPv4 và đoạn IPv6 được nối riêng."""
+    v4, v6 = [], []
+    for r in ranges:
+        (v4 if _V4_FIRST <= r[0] <= _V4_LAST else v6).append(r)
+    merged = []
+    for part in (v4, v6):
+        if not part:
+            continue
+        # Chỉ so đầu đoạn (nhanh gấp đôi so tuple); cùng đầu thì vòng dưới tự lấy cuối lớn nhất
+        part.sort(key=itemgetter(0))
+        cur_start, cur_end = part[0]
+        for start, end in part:
+            if start <= cur_end + 1:
+                if end > cur_end:
+                    cur_end = end
+            else:
+                merged.append((cur_start, cur_end))
+                cur_start, cur_end = start, end
+        merged.append((cur_start, cur_end))
+    merged.sort(key=itemgetter(0))
+    return merged
+
+
+def subtract_ranges(ranges, holes):
+    """Các đoạn của `ranges` trừ đi `holes` (cả hai là kết quả của merge_ranges)"""
+    result = []
+    i, n = 0, len(holes)
+    for start, end in ranges:
+        # Bỏ các lỗ nằm hẳn trước đoạn này (các đoạn đã sắp xếp, không chồng lấn)
+        while i < n and holes[i][1] < start:
+            i += 1
+        j = i
+        while j < n and holes[j][0] <= end:
+            hole_start, hole_end = holes[j]
+            if hole_start > start:
+                result.append((start, hole_start - 1))
+            start = max(start, hole_end + 1)
+            if start > end:
+                break
+            j += 1
+        if start <= end:
+            result.append((start, end))
+    return result
+
+
+def range_to_cidrs(start, end):
+    """Đoạn [đầu, cuối] -> [(network, plen)] tối thiểu"""
+    cidrs = []
+    while start <= end:
+        # Khối lớn nhất: căn biên tại start (số bit 0 cuối) và không dài hơn phần còn lại
+        size = min((start & -start).bit_length() - 1 if start else 128, (end - start + 1).bit_length() - 1)
+        cidrs.append((start, 128 - size))
+        start += 1 << size
+    return cidrs
+
+
+def collapse(networks):
+    """[(network, plen)] -> [(network, plen)] tối thiểu, sắp xếp theo địa chỉ"""
+    result = []
+    for start, end in merge_ranges(to_range(n, p) for n, p in networks):
+        # merge_ranges không nối qua biên vùng IPv4 (::ffff:0:0/96, căn biên /96)
+        # nên CIDR tách ra cũng không vượt biên đó
+        result += range_to_cidrs(start, end)
+    return result
+
+
+def collapse_text(entries):
+    """['1.2.3.0/25', '1.2.3.128/25'] -> ['1.2.3.0/24'] (bỏ qua mục không hợp lệ)"""
+    networks = []
+    for entry in entries:
+        try:
+            networks.append(ipaddr.parse_cidr(entry))
+        except ValueError:
+            continue
+    return [ipaddr.format_cidr(n, p) for n, p in collapse(networks)]
+
+
+# === BENCHMARK ===
+def _check(entries, merged):
+    """Tập địa chỉ trước và sau khi gộp phải trùng nhau (đo trên các đoạn)"""
+    before = merge_ranges(to_range(*ipaddr.parse_cidr(e)) for e in entries)
+    after = merge_ranges(to_range(*ipaddr.parse_cidr(e)) for e in merged)
+    return before == after
+
+
+def benchmark(n=1000000):
+    import random
+    rng = random.Random(1)
+    entries = []
+    for _ in range(n):
+        r = rng.random()
+        if r < 0.6:
+            # Host rải trong vài /16 (dải bị quét / botnet): nhiều host liền kề
+            entries.append(f'45.{rng.randrange(8)}.{rng.randrange(256)}.{rng.randrange(256)}')
+        elif r < 0.9:
+            entries.append(f'{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.0/24')
+        elif r < 0.98:
+            entries.append(f'{rng.randrange(1, 224)}.{rng.randrange(256)}.0.0/{rng.choice((16, 20, 22))}')
+        else:
+            entries.append(f'2001:db8:{rng.randrange(65536):x}::/48')
+    start = time.perf_counter()
+    networks = [ipaddr.parse_cidr(e) for e in entries]
+    t_parse = time.perf_counter() - start
+    start = time.perf_counter()
+    merged = collapse(networks)
+    t_merge = time.perf_counter() - start
+    print(f"{n} mục -> {len(merged)} CIDR: parse {t_parse:.2f} s, gộp {t_merge:.2f} s")
+    sample = entries[:20000]
+    merged_sample = collapse_text(sample)
+    print(f"kiểm tra trên {len(sample)} mục: {len(merged_sample)} CIDR, phủ đúng cùng tập địa chỉ: "
+          f"{_check(sample, merged_sample)}")
+    print(collapse_text(['1.2.3.0/25', '1.2.3.128/25', '10.0.0.1', '10.0.0.0/8',
+                         '1.2.3.4', '5.5.5.4', '5.5.5.5', '5.5.5.6', '5.5.5.7', '::1', '::']))
+
+
+if __name__ == "__main__":
+    import sys
+    benchmark(*(int(a) for a in sys.argv[1:2]))
@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+"""
+Quản lý file cấu hình /etc/firewall_auto_block.json.
+
+Trước đây DosDetector mở và parse lại JSON ở đầu mỗi chu kỳ, và có thể đọc
+phải file đang ghi dở từ GUI / web. ConfigManager:
+
+- Theo dõi thư mục chứa file bằng inotify (gọi libc qua ctypes, không cần thư
+  viện ngoài); chỉ đọc lại khi file thực sự đổi. Không có inotify thì so
+  (mtime, inode, size) bằng một lệnh stat mỗi chu kỳ.
+- Kiểm tra config mới theo SCHEMA; config lỗi (JSON hỏng / giá trị sai) bị bỏ
+  qua, detector giữ nguyên config cũ.
+- Dựng sẵn các cấu trúc suy ra (whitelist matcher, ngưỡng theo từng loại tấn
+  công) một lần cho mỗi thay đổi, gói trong một ConfigSnapshot bất biến; detector
+  đổi sang snapshot mới bằng một phép gán.
+
+save_config_atomic() dùng cho GUI / web: ghi file tạm cùng thư mục, fsync rồi
+os.replace, nên bên đọc chỉ thấy file cũ hoặc file mới hoàn chỉnh.
+
+Dùng:
+    python3 config_manager.py check [file]   # kiểm tra file config theo schema
+    python3 config_manager.py watch [file]   # in mỗi lần config đổi (thử inotify)
+"""
+import ctypes
+import json
+import logging
+import os
+import select
+import struct
+import tempfile
+import time
+from whitelist import WhitelistMatcher
+
+CONFIG_FILE = '/etc/firewall_auto_block.json'
+
+DEFAULTS = {
+    'check_interval': 5,
+    'syn_threshold': 50,
+    'conn_threshold': 100,
+    'udp_threshold': 100,
+    'ban_time': 300,
+    'ban_escalation': 2,
+    'ban_max_time': 86400,
+    'ban_offense_window': 86400,
+    'state_interval': 60,
+    'subnet_levels': [24, 16, 'asn'],
+    'subnet_min_sources': 8,
+    'subnet_multipliers': {'24': 4, '16': 16, 'asn': 32},
+    'subnet_levels_v6': [64, 48],
+    'subnet_multipliers_v6': {'64': 4, '48': 16},
+    'ban_backend': 'auto',
+    'tcp_collector': 'auto',
+    'udp_collector': 'events',
+    'history_max_ips': 200000,
+    'history_idle_ttl': 900,
+    'daemon_mode': 'sync',
+    'counting_mode': 'exact',
+    'sketch_width': 262144,
+    'sketch_depth': 4,
+    'sketch_topk': 1024,
+    'metrics_window': 60,
+    'metrics_bucket': 5,
+    'metrics_retention': 604800,
+    'events_retention': 2592000,    # 30 ngày, 0 = không xóa theo tuổi
+    'events_max_rows': 2000000,     # 0 = không giới hạn số dòng
+    'packet_collector': 'off',
+    'packet_interface': '',
+    'packet_sample_rate': 16,
+    'packet_snaplen': 128,
+    'pps_threshold': 2000,
+    'pipeline_workers': 0,
+    'instrumentation': True,
+    'metrics_port': 0,
+    'cycle_log': '',
+    'stream_interval': 2,
+    'cache_ttls': {'blocked': 2, 'alerts': 2, 'service': 5, 'rules': 5},
+    'bulk_max_items': 100000,
+    'blocklist_feeds': [],
+    'blocklist_refresh': 3600,
+    'whitelist': ['127.0.0.1', '::1']
+}
+
+
+# === SCHEMA ===
+def _number(minimum=0, integer=True, above=False):
+    """Kiểm tra số (bool không tính là số), >= minimum hoặc > minimum nếu above"""
+    def check(value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return 'phải là số'
+        if integer and not float(value).is_integer():
+            return 'phải là số nguyên'
+        if value < minimum or (above and value == minimum):
+            return f"phải {'>' if above else '>='} {minimum}"
+        return None
+    return check
+
+
+def _choice(*values):
+    def check(value):
+        return None if value in values else f"phải là một trong {', '.join(map(str, values))}"
+    return check
+
+
+def _levels(bits, allow_asn):
+    def check(value):
+        if not isinstance(value, list):
+            return 'phải là list'
+        for level in value:
+            if allow_asn and level == 'asn':
+                continue
+            try:
+                ok = not isinstance(level, bool) and 1 <= int(level) <= bits
+            except (TypeError, ValueError):
+                ok = False
+            if not ok:
+                return f"mức {level!r} không hợp lệ (1..{bits}{' hoặc asn' if allow_asn else ''})"
+        return None
+    return check
+
+
+def _multipliers(value):
+    if not isinstance(value, dict):
+        return 'phải là object {mức: hệ số}'
+    for level, factor in value.items():
+        if isinstance(factor, bool) or not isinstance(factor, (int, float)) or factor <= 0:
+            return f"hệ số của {level} phải là số > 0"
+    return None
+
+
+def _ttls(value):
+    if not isinstance(value, dict):
+        return 'phải là object {khóa: giây}'
+    for key, ttl in value.items():
+        if isinstance(ttl, bool) or not isinstance(ttl, (int, float)) or ttl < 0:
+            return f"TTL của {key} phải là số >= 0 (0 = không cache)"
+    return None
+
+
+def _paths(value):
+    if not isinstance(value, list) or not all(isinstance(p, str) and p for p in value):
+        return 'phải là list đường dẫn file'
+    return None
+
+
+def _whitelist(value):
+    if not isinstance(value, list):
+        return 'phải là list IP / CIDR'
+    invalid = WhitelistMatcher(value).invalid
+    return f"mục không hợp lệ: {', '.join(map(str, invalid))}" if invalid else None
+
+
+# Khóa không có trong SCHEMA được giữ nguyên, không kiểm tra
+SCHEMA = {
+    'check_interval': _number(0, integer=False, above=True),
+    'tcp_interval': _number(0, integer=False, above=True),
+    'udp_interval': _number(0, integer=False, above=True),
+    'expiry_interval': _number(0, integer=False, above=True),
+    'syn_threshold': _number(1),
+    'conn_threshold': _number(1),
+    'udp_threshold': _number(1),
+    'ban_time': _number(0),                 # 0 = chặn vĩnh viễn
+    'ban_escalation': _number(1, integer=False),
+    'ban_max_time': _number(0),
+    'ban_offense_window': _number(0),
+    'state_interval': _number(0),           # 0 = không lưu trạng thái
+    'subnet_levels': _levels(32, True),
+    'subnet_min_sources': _number(1),
+    'subnet_multipliers': _multipliers,
+    'subnet_levels_v6': _levels(128, False),
+    'subnet_multipliers_v6': _multipliers,
+    'ban_backend': _choice('auto', 'iptables', 'ipset', 'nft'),
+    'tcp_collector': _choice('auto', 'netlink', 'proc', 'ss'),
+    'udp_collector': _choice('events', 'dump'),
+    'udp_resync_interval': _number(0),
+    'history_max_ips': _number(1),
+    'history_idle_ttl': _number(0),
+    'max_subprocs': _number(1),
+    'daemon_mode': _choice('sync', 'async'),
+    'counting_mode': _choice('exact', 'sketch'),
+    'sketch_width': _number(64),
+    'sketch_depth': _number(1),
+    'sketch_topk': _number(1),
+    'metrics_window': _number(0, integer=False, above=True),
+    'metrics_bucket': _number(0, integer=False, above=True),
+    'metrics_retention': _number(0),
+    'events_retention': _number(0),
+    'events_max_rows': _number(0),
+    'packet_collector': _choice('off', 'ring'),
+    'packet_sample_rate': _number(1),
+    'packet_snaplen': _number(64),
+    'pps_threshold': _number(1),
+    'pipeline_workers': _number(0),
+    'instrumentation': _choice(True, False),
+    'metrics_port': _number(0),
+    'stream_interval': _number(0, integer=False, above=True),
+    'cache_ttls': _ttls,
+    'bulk_max_items': _number(1),
+    'blocklist_feeds': _paths,
+    'blocklist_refresh': _number(0),       # 0 = chỉ đọc feed khi khởi động / đổi config
+    'whitelist': _whitelist,
+}
+
+
+def validate(config):
+    """Danh sách lỗi (rỗng nếu hợp lệ). Chỉ kiểm tra các khóa có mặt, nên dùng
+    được cho cả config đầy đủ lẫn phần cập nhật từ GUI / web."""
+    if not isinstance(config, dict):
+        return ['config phải là một object JSON']
+    errors = []
+    for key, check in SCHEMA.items():
+        if key in config:
+            problem = check(config[key])
+            if problem:
+                errors.append(f"{key}: {problem}")
+    return errors
+
+
+class ConfigError(ValueError):
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+class ConfigSnapshot:
+    """Config đã kiểm tra + các cấu trúc dựng sẵn. Không sửa sau khi tạo:
+    bên đọc giữ một tham chiếu là thấy một phiên bản nhất quán."""
+    __slots__ = ('config', 'whitelist', 'thresholds', 'check_interval', 'version', 'loaded_at')
+
+    def __init__(self, config, version=0):
+        self.config = config
+        self.whitelist = WhitelistMatcher(config['whitelist'])
+        self.thresholds = {
+            'syn': int(config['syn_threshold']),
+            'conn': int(config['conn_threshold']),
+            'udp': int(config['udp_threshold']),
+            'pps': int(config['pps_threshold']),
+        }
+        self.check_interval = float(config['check_interval'])
+        self.version = version
+        self.loaded_at = time.time()
+
+
+def compile_config(data, version=0):
+    """dict đọc từ file -> ConfigSnapshot (gộp DEFAULTS). ConfigError nếu sai schema."""
+    errors = validate(data)
+    if errors:
+        raise ConfigError(errors)
+    return ConfigSnapshot(dict(DEFAULTS, **data), version)
+
+
+# === ĐỌC / GHI FILE ===
+def read_config(path=CONFIG_FILE):
+    """Nội dung file config (chưa gộp DEFAULTS), {} nếu chưa có file"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_config_atomic(path, config):
+    """Ghi config ra file tạm cùng thư mục rồi os.replace (đổi tên nguyên tử)"""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(config, f, indent=4)
+            f.flush()
+            os.fchmod(f.fileno(), 0o644)
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+# === INOTIFY ===
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len (+ name[len])
+
+
+class InotifyWatcher:
+    """Theo dõi một file qua inotify trên thư mục cha: ghi nguyên tử bằng rename
+    thay inode của file, nên watch trên chính file sẽ mất sau lần lưu đầu tiên."""
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(None, use_errno=True)
+        init1, add_watch = libc.inotify_init1, libc.inotify_add_watch  # AttributeError nếu không có
+        add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.name = os.fsencode(os.path.basename(path))
+        self.fd = init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        directory = os.path.dirname(os.path.abspath(path))
+        if add_watch(self.fd, os.fsencode(directory), self.MASK) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f'inotify_add_watch {directory}')
+        self.alive = True
+
+    def changed(self):
+        """Đọc hết sự kiện đang chờ (không chặn); True nếu có sự kiện của file"""
+        changed = False
+        while True:
+            try:
+                buf = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(buf):
+                wd, mask, cookie, length = _EVENT.unpack_from(buf, offset)
+                name = buf[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b'\0')
+                offset += _EVENT.size + length
+                if mask & IN_IGNORED:
+                    # Thư mục bị xóa / unmount: watch không còn, chuyển sang stat
+                    self.alive = False
+                    changed = True
+                elif mask & IN_Q_OVERFLOW or name == self.name:
+                    changed = True
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class ConfigManager:
+    """Snapshot config hiện hành + phát hiện thay đổi. path=None: config tĩnh
+    (overrides) không đọc file, dùng cho giả lập / benchmark."""
+
+    def __init__(self, path=CONFIG_FILE, overrides=None, use_inotify=True):
+        self.path = path
+        self.overrides = dict(overrides or {})
+        self.watcher = None
+        self.stamp = None
+        self.version = 0
+        self.snapshot = compile_config(self.overrides)
+        if path is None:
+            return
+        if use_inotify:
+            try:
+                self.watcher = InotifyWatcher(path)
+            except (OSError, AttributeError) as e:
+                logging.warning(f"Không dùng được inotify ({e}), theo dõi config bằng stat mỗi chu kỳ")
+        if not self.reload():
+            logging.error("Config không hợp lệ, tạm dùng giá trị mặc định")
+
+    @property
+    def fd(self):
+        """fd inotify để đăng ký với event loop (None nếu đang dùng stat)"""
+        return self.watcher.fd if self.watcher else None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_ino, st.st_size
+        except OSError:
+            return None
+
+    def poll(self):
+        """Snapshot mới nếu file đổi và config hợp lệ, ngược lại None. Rẻ khi file không đổi:
+        một lệnh read không chặn trên fd inotify (hoặc một lệnh stat)."""
+        if self.path is None:
+            return None
+        if self.watcher:
+            changed = self.watcher.changed()
+            if not self.watcher.alive:
+                self.watcher.close()
+                self.watcher = None
+            if not changed:
+                return None
+        elif self._stat() == self.stamp:
+            return None
+        return self.snapshot if self.reload() else None
+
+    def reload(self):
+        """Đọc, kiểm tra và dựng snapshot mới; lỗi thì giữ snapshot cũ. True nếu đã đổi."""
+        self.stamp = self._stat()
+        try:
+            data = read_config(self.path)
+            data.update(self.overrides)
+            snapshot = compile_config(data, self.version + 1)
+        except ConfigError as e:
+            for problem in e.errors:
+                logging.error(f"Config {self.path} bị bỏ qua: {problem}")
+            return False
+        except Exception as e:
+            logging.error(f"Lỗi đọc config {self.path}, giữ config cũ: {e}")
+            return False
+        self.version = snapshot.version
+        self.snapshot = snapshot
+        return True
+
+    def close(self):
+        if self.watcher:
+            self.watcher.close()
+            self.watcher = None
+
+
+# === KIỂM TRA ===
+def watch(path):
+    manager = ConfigManager(path)
+    mode = 'inotify' if manager.fd is not None else 'stat'
+    print(f"Theo dõi {path} ({mode}), phiên bản {manager.version}. Ctrl+C để dừng.")
+    try:
+        while True:
+            if manager.fd is not None:
+                select.select([manager.fd], [], [], None)
+            else:
+                time.sleep(1)
+            snapshot = manager.poll()
+            if snapshot:
+                print(f"v{snapshot.version}: ngưỡng {snapshot.thresholds}, whitelist {len(snapshot.whitelist)} mục")
+    except KeyboardInterrupt:
+        manager.close()
+
+
+def self_check():
+    """Ghi config bằng save_config_atomic và kiểm tra ConfigManager nhận đúng thay đổi"""
+    logging.disable(logging.ERROR)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'firewall_auto_block.json')
+        for use_inotify in (True, False):
+            save_config_atomic(path, {'syn_threshold': 80})
+            manager = ConfigManager(path, use_inotify=use_inotify)
+            mode = 'inotify' if manager.fd is not None else 'stat'
+            assert manager.snapshot.thresholds['syn'] == 80
+            assert manager.poll() is None
+            save_config_atomic(path, {'syn_threshold': 120, 'whitelist': ['10.0.0.0/8']})
+            if mode == 'stat':
+                os.utime(path, ns=(0, time.time_ns() + 1))  # mtime có thể trùng trên fs độ phân giải thô
+            snapshot = manager.poll()
+            assert snapshot and snapshot.thresholds['syn'] == 120 and '10.1.2.3' in snapshot.whitelist
+            # JSON ghi dở và giá trị sai schema đều bị bỏ qua, giữ snapshot cũ
+            with open(path, 'w') as f:
+                f.write('{"syn_threshold": 1')
+            assert manager.poll() is None and manager.snapshot is snapshot
+            save_config_atomic(path, {'syn_threshold': -5, 'ban_backend': 'pf', 'whitelist': ['1.2.3.999']})
+            assert manager.poll() is None and manager.snapshot is snapshot
+            save_config_atomic(path, {'syn_threshold': 60, 'custom_key': 1})
+            snapshot = manager.poll()
+            assert snapshot.thresholds['syn'] == 60 and snapshot.config['custom_key'] == 1
+            start = time.perf_counter()
+            for _ in range(10000):
+                manager.poll()
+            idle = (time.perf_counter() - start) / 10000
+            start = time.perf_counter()
+            for _ in range(1000):
+                manager.reload()
+            full = (time.perf_counter() - start) / 1000
+            print(f"{mode:7s}: OK, poll khi không đổi {idle * 1e6:.1f} µs, đọc + dựng lại {full * 1e6:.0f} µs")
+            manager.close()
+        assert not [n for n in os.listdir(tmp) if n.endswith('.tmp')]
+    logging.disable(logging.NOTSET)
+
+
+if __name__ == "__main__":
+    import sys
+    command = sys.argv[1] if len(sys.argv) > 1 else 'selfcheck'
+    target = sys.argv[2] if len(sys.argv) > 2 else CONFIG_FILE
+    if command == 'check':
+        errors = validate(read_config(target))
+        print('\n'.join(errors) if errors else f"{target}: hợp lệ")
+        sys.exit(1 if errors else 0)
+    elif command == 'watch':
+        watch(target)
+    else:
+        self_check()
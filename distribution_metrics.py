@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Entropy và các chỉ số phân bố theo cửa sổ thời gian trượt, cập nhật tăng dần.
+
+calculate_entropy cũ dựng list(values()) và tính lại Shannon entropy từ đầu mỗi
+chu kỳ, chỉ cho UDP. WindowedDistribution giữ số đếm của cửa sổ cùng hai tổng
+
+    N = Σ c_i          S = Σ c_i · log2(c_i)
+
+nên H = log2(N) - S / N. Khi số đếm của một khóa đổi từ c sang c + d chỉ cần
+sửa N và S theo khóa đó: O(1) mỗi cập nhật. Cửa sổ chia thành các bucket
+`bucket` giây; bucket ra khỏi cửa sổ được trừ lại đúng các cập nhật đã cộng
+(mỗi cập nhật bị trừ đúng một lần, vẫn O(1) khấu hao).
+
+DistributionMetrics gom các phân bố mà detector theo dõi:
+    syn_src / conn_src / udp_src   IP nguồn (SYN_RECV, ESTABLISHED, luồng UDP)
+    syn_dport / udp_dport          cổng đích bị nhắm tới
+    proto                          tcp / udp
+và lấy mẫu định kỳ thành chuỗi thời gian (entropy, entropy chuẩn hóa, số khóa,
+tổng) cho detector, kho sự kiện SQLite (bảng metrics) và dashboard.
+
+Entropy nguồn chuẩn hóa H / log2(số nguồn) gần 1 khi lưu lượng rải đều trên
+nhiều nguồn (DDoS / nguồn giả mạo), thấp khi vài nguồn chiếm phần lớn (DoS).
+
+    python3 distribution_metrics.py [số chu kỳ]   # so sánh với tính lại cả cửa sổ
+"""
+import math
+import time
+from collections import defaultdict, deque
+
+DEFAULT_WINDOW = 60
+DEFAULT_BUCKET = 5
+DEFAULT_HISTORY = 720  # Số mẫu giữ trong bộ nhớ (1 giờ với bucket 5 giây)
+SOURCE_METRICS = ('syn_src', 'conn_src', 'udp_src')
+DISTRIBUTIONS = SOURCE_METRICS + ('syn_dport', 'udp_dport', 'proto')
+
+
+def _xlogx(c):
+    return c * math.log2(c) if c > 0 else 0.0
+
+
+class WindowedDistribution:
+    """Phân bố số đếm theo khóa trong cửa sổ trượt `window` giây"""
+
+    def __init__(self, window=DEFAULT_WINDOW, bucket=DEFAULT_BUCKET):
+        self.window = window
+        self.bucket = bucket
+        self.counts = {}
+        self.total = 0
+        self.sum_xlogx = 0.0
+        # Phần không liệt kê từng khóa (chế độ sketch): `keys` khóa chia đều `mass`
+        self.residual_mass = 0
+        self.residual_keys = 0
+        self.residual_xlogx = 0.0
+        self.buckets = deque()  # [thời điểm bắt đầu, {khóa: số đếm}, mass, keys]
+        self.rotations = 0
+
+    def _apply(self, key, n):
+        old = self.counts.get(key, 0)
+        new = old + n
+        self.sum_xlogx += _xlogx(new) - _xlogx(old)
+        self.total += n
+        if new > 0:
+            self.counts[key] = new
+        else:
+            self.counts.pop(key, None)
+
+    def _apply_residual(self, mass, keys, sign):
+        self.residual_mass += sign * mass
+        self.residual_keys += sign * keys
+        self.residual_xlogx += sign * (_xlogx(mass / keys) * keys if keys else 0.0)
+        self.total += sign * mass
+
+    def _current(self, now):
+        start = now - now % self.bucket
+        if not self.buckets or self.buckets[-1][0] != start:
+            self.buckets.append([start, defaultdict(int), 0, 0])
+        return self.buckets[-1]
+
+    def add(self, key, n=1, now=None):
+        """Cộng n (có thể âm) vào số đếm của key, O(1)"""
+        now = time.time() if now is None else now
+        self._current(now)[1][key] += n
+        self._apply(key, n)
+
+    def add_counts(self, counts, now=None, residual=None):
+        """Cộng cả một dict {khóa: số đếm}; residual = (mass, keys): phần còn lại của
+        phân bố chỉ biết tổng và số khóa (top-k của sketch + ước lượng HyperLogLog)"""
+        now = time.time() if now is None else now
+        bucket = self._current(now)
+        pending = bucket[1]
+        apply = self._apply
+        for key, n in counts.items():
+            pending[key] += n
+            apply(key, n)
+        if residual and residual[0] > 0 and residual[1] > 0:
+            mass, keys = residual
+            bucket[2] += mass
+            bucket[3] += keys
+            self._apply_residual(mass, keys, 1)
+
+    def expire(self, now=None):
+        """Trừ các bucket đã ra khỏi cửa sổ"""
+        now = time.time() if now is None else now
+        horizon = now - self.window
+        while self.buckets and self.buckets[0][0] + self.bucket <= horizon:
+            start, pending, mass, keys = self.buckets.popleft()
+            for key, n in pending.items():
+                self._apply(key, -n)
+            if keys:
+                self._apply_residual(mass, keys, -1)
+            self.rotations += 1
+            if self.rotations % 1000 == 0:
+                self._recompute()
+
+    def _recompute(self):
+        # Sai số làm tròn của S tích lũy qua nhiều lần cộng / trừ: tính lại định kỳ
+        self.sum_xlogx = sum(_xlogx(c) for c in self.counts.values())
+        if not self.residual_keys:
+            self.residual_mass, self.residual_xlogx = 0, 0.0
+
+    @property
+    def distinct(self):
+        return len(self.counts) + self.residual_keys
+
+    def entropy(self):
+        """Shannon entropy (bit) của phân bố trong cửa sổ"""
+        n = self.total
+        if n <= 0:
+            return 0.0
+        return max(math.log2(n) - (self.sum_xlogx + self.residual_xlogx) / n, 0.0)
+
+    def normalized(self):
+        """Entropy / log2(số khóa), trong [0, 1]"""
+        distinct = self.distinct
+        return self.entropy() / math.log2(distinct) if distinct > 1 else 0.0
+
+
+class DistributionMetrics:
+    def __init__(self, window=DEFAULT_WINDOW, bucket=DEFAULT_BUCKET, history=DEFAULT_HISTORY):
+        self.window = window
+        self.bucket = bucket
+        self.dists = {name: WindowedDistribution(window, bucket) for name in DISTRIBUTIONS}
+        self.history = deque(maxlen=history)  # [(ts, {'syn_src.entropy': ..., ...})]
+        self.last_sample = 0.0
+        self.samples = 0
+
+    def observe(self, name, counts, now=None, residual=None):
+        self.dists[name].add_counts(counts, now, residual)
+
+    def add(self, name, key, n=1, now=None):
+        self.dists[name].add(key, n, now)
+
+    def current(self, name):
+        return self.dists[name]
+
+    def snapshot(self, now=None):
+        """{'<phân bố>.<chỉ số>': giá trị} của cửa sổ hiện tại"""
+        values = {}
+        for name, dist in self.dists.items():
+            dist.expire(now)
+            values[f'{name}.entropy'] = round(dist.entropy(), 4)
+            values[f'{name}.norm'] = round(dist.normalized(), 4)
+            values[f'{name}.distinct'] = dist.distinct
+            values[f'{name}.total'] = dist.total
+        return values
+
+    def maybe_sample(self, now=None):
+        """Lấy mẫu tối đa một lần mỗi bucket; trả về (ts, values) hoặc None"""
+        now = time.time() if now is None else now
+        if now - self.last_sample < self.bucket:
+            return None
+        self.last_sample = now
+        self.samples += 1
+        sample = (now, self.snapshot(now))
+        self.history.append(sample)
+        return sample
+
+    def series(self, metric, since=0):
+        """[(ts, giá trị)] của một chỉ số, vd series('syn_src.norm')"""
+        return [(ts, values[metric]) for ts, values in self.history if ts >= since and metric in values]
+
+    def shape(self, name, min_total, min_sources=32, ddos_norm=0.8, now=None):
+        """'DDoS' nếu lưu lượng rải đều trên nhiều nguồn, 'DoS' nếu tập trung,
+        None nếu tổng trong cửa sổ dưới min_total"""
+        dist = self.dists[name]
+        dist.expire(now)
+        if dist.total < min_total:
+            return None
+        if dist.distinct >= min_sources and dist.normalized() >= ddos_norm:
+            return 'DDoS'
+        return 'DoS'
+
+
+def sketch_residual(counter, top):
+    """(mass, keys) của phần phân bố nằm ngoài top-k của một HeavyHitterSketch"""
+    return counter.total - sum(top.values()), counter.cardinality() - len(top)
+
+
+def create_metrics(config):
+    return DistributionMetrics(float(config.get('metrics_window', DEFAULT_WINDOW)),
+                               float(config.get('metrics_bucket', DEFAULT_BUCKET)))
+
+
+# === BENCHMARK ===
+def _full_entropy(counts):
+    # Cách cũ: dựng list values rồi tính lại từ đầu
+    values = list(counts.values())
+    total = sum(values)
+    entropy = 0
+    for x in values:
+        if x > 0:
+            p = x / total
+            entropy -= p * math.log2(p)
+    return entropy
+
+
+def benchmark(cycles=120, per_cycle=20000, sources=200000):
+    import random
+    rng = random.Random(1)
+    dist = WindowedDistribution(window=60, bucket=5)
+    window = deque()
+    incremental = full = 0.0
+    max_error = 0.0
+    for cycle in range(cycles):
+        now = cycle * 1.0
+        # DoS ở nửa đầu (vài nguồn), DDoS giả mạo nguồn ở nửa sau
+        if cycle < cycles // 2:
+            stats = defaultdict(int)
+            for _ in range(per_cycle):
+                stats[rng.randrange(20) if rng.random() < 0.9 else rng.randrange(sources)] += 1
+        else:
+            stats = defaultdict(int)
+            for _ in range(per_cycle):
+                stats[rng.randrange(sources)] += 1
+        start = time.perf_counter()
+        dist.add_counts(stats, now)
+        dist.expire(now)
+        h = dist.entropy()
+        incremental += time.perf_counter() - start
+        # Cách cũ trên cùng cửa sổ: gộp các chu kỳ trong cửa sổ rồi tính lại
+        window.append((now, stats))
+        while window and window[0][0] - window[0][0] % 5 + 5 <= now - 60:
+            window.popleft()
+        start = time.perf_counter()
+        merged = defaultdict(int)
+        for _, s in window:
+            for k, v in s.items():
+                merged[k] += v
+        exact = _full_entropy(merged)
+        full += time.perf_counter() - start
+        max_error = max(max_error, abs(exact - h))
+        if cycle in (cycles // 2 - 1, cycles - 1):
+            print(f"  chu kỳ {cycle:3d}: H = {h:6.3f} bit, chuẩn hóa {dist.normalized():.3f}, "
+                  f"{dist.distinct} nguồn trong cửa sổ")
+    print(f"tăng dần: {incremental / cycles * 1000:6.2f} ms/chu kỳ, tính lại cả cửa sổ: "
+          f"{full / cycles * 1000:6.2f} ms/chu kỳ, lệch tối đa {max_error:.2e} bit")
+
+
+if __name__ == "__main__":
+    import sys
+    benchmark(*(int(a) for a in sys.argv[1:2]))
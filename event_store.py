@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Kho sự kiện SQLite (chế độ WAL) cho cảnh báo và lệnh chặn.
+
+Detector ghi sự kiện theo lô (cùng lúc với nhật ký NDJSON), còn Web dashboard,
+Tk dashboard và tab Thống kê truy vấn trực tiếp bằng SQL có index thay vì nạp
+toàn bộ danh sách cảnh báo vào Python rồi lọc / sắp xếp / đếm.
+
+Bảng metrics chứa chuỗi thời gian của distribution_metrics (entropy nguồn / cổng /
+giao thức theo cửa sổ trượt), mỗi dòng một (ts, tên chỉ số, giá trị).
+
+Detector dọn định kỳ cả hai bảng (prune_metrics / prune_events): chỉ số theo
+metrics_retention, sự kiện theo events_retention (giây) và events_max_rows.
+
+Dùng:
+    python3 event_store.py import [/var/log/firewall_alerts.json]   # chuyển dữ liệu cũ
+    python3 event_store.py bench [10000000]                         # benchmark
+"""
+import os
+import logging
+import sqlite3
+import threading
+import time
+
+DB_FILE = '/var/lib/firewall_auto_block/events.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    ip TEXT,
+    action TEXT,
+    attack_type TEXT,
+    reason TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_events_ts ON events(ts);
+CREATE INDEX IF NOT EXISTS idx_events_ip_ts ON events(ip, ts);
+CREATE INDEX IF NOT EXISTS idx_events_action_ts ON events(action, ts);
+CREATE INDEX IF NOT EXISTS idx_events_type_ts ON events(attack_type, ts);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS metrics (
+    ts REAL NOT NULL,
+    name TEXT NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS idx_metrics_name_ts ON metrics(name, ts);
+CREATE INDEX IF NOT EXISTS idx_metrics_ts ON metrics(ts);
+"""
+
+
+def attack_type_of(reason):
+    """'SYN Flood (Z-Score: ...)' -> 'SYN Flood'"""
+    if not reason or reason == 'Expired' or reason.startswith('Superseded by '):
+        return None
+    return reason.split(' (')[0].split(':')[0].strip()
+
+
+def open_store(path=DB_FILE, migrate_from=None):
+    """Mở kho sự kiện, trả về None nếu không mở được (thiếu quyền, đĩa lỗi...).
+    migrate_from: file cảnh báo cũ cần nhập vào (chỉ nhập lần đầu)."""
+    try:
+        store = EventStore(path)
+        if migrate_from:
+            store.import_json(migrate_from)
+        return store
+    except Exception as e:
+        logging.error(f"Không mở được kho sự kiện {path}: {e}")
+        return None
+
+
+class EventStore:
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    # --- Ghi ---
+    def add_events(self, records):
+        rows = []
+        for r in records:
+            if not isinstance(r, dict):
+                continue
+            try:
+                ts = float(r.get('timestamp') or time.time())
+            except (TypeError, ValueError):
+                ts = time.time()
+            reason = r.get('reason', '')
+            rows.append((ts, r.get('ip') or r.get('src_ip') or r.get('source'),
+                         (r.get('action') or '').upper(), r.get('attack_type') or attack_type_of(reason), reason))
+        if not rows:
+            return 0
+        with self.lock, self.db:
+            self.db.executemany('INSERT INTO events (ts, ip, action, attack_type, reason) VALUES (?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def add_metrics(self, ts, values):
+        """Một mẫu chỉ số {tên: giá trị} tại thời điểm ts"""
+        rows = [(ts, name, value) for name, value in values.items()]
+        with self.lock, self.db:
+            self.db.executemany('INSERT INTO metrics (ts, name, value) VALUES (?, ?, ?)', rows)
+        return len(rows)
+
+    def prune_metrics(self, before):
+        with self.lock, self.db:
+            return self.db.execute('DELETE FROM metrics WHERE ts < ?', (before,)).rowcount
+
+    def prune_events(self, before=None, max_rows=None):
+        """Xóa sự kiện cũ hơn `before` và chỉ giữ tối đa `max_rows` sự kiện mới nhất (theo id).
+        Flood kéo dài ghi một dòng cho mỗi lệnh chặn / gỡ chặn: không giới hạn thì bảng lớn mãi."""
+        deleted = 0
+        with self.lock, self.db:
+            if before is not None:
+                deleted += self.db.execute('DELETE FROM events WHERE ts < ?', (before,)).rowcount
+            if max_rows:
+                deleted += self.db.execute('DELETE FROM events WHERE id <= (SELECT MAX(id) FROM events) - ?',
+                                           (max_rows,)).rowcount
+        return deleted
+
+    # --- Truy vấn ---
+    def _query(self, sql, params=()):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    def recent(self, limit=20):
+        """Các sự kiện mới nhất, mới nhất trước (định dạng giống bản ghi cảnh báo)"""
+        rows = self._query('SELECT ts, ip, action, attack_type, reason FROM events ORDER BY ts DESC LIMIT ?', (limit,))
+        return [{'timestamp': r['ts'], 'ip': r['ip'], 'action': r['action'],
+                 'attack_type': r['attack_type'], 'reason': r['reason']} for r in rows]
+
+    def last_id(self):
+        return self._query('SELECT COALESCE(MAX(id), 0) FROM events')[0][0]
+
+    def events_after(self, last_id, limit=20):
+        """Sự kiện có id > last_id (mới nhất trước) và id lớn nhất, cho luồng SSE"""
+        rows = self._query('SELECT id, ts, ip, action, attack_type, reason FROM events WHERE id > ? '
+                           'ORDER BY id DESC LIMIT ?', (last_id, limit))
+        events = [{'timestamp': r['ts'], 'ip': r['ip'], 'action': r['action'],
+                   'attack_type': r['attack_type'], 'reason': r['reason']} for r in rows]
+        return events, rows[0]['id'] if rows else last_id
+
+    def count(self, action=None, since=None):
+        sql, params = 'SELECT COUNT(*) FROM events WHERE ts >= ?', [since or 0]
+        if action:
+            sql += ' AND action = ?'
+            params.append(action)
+        return self._query(sql, params)[0][0]
+
+    def distinct_ips(self, action='BLOCKED', since=None):
+        return self._query('SELECT COUNT(DISTINCT ip) FROM events WHERE action = ? AND ts >= ?',
+                           (action, since or 0))[0][0]
+
+    def top_offenders(self, since=None, limit=10):
+        """[(ip, số lần bị chặn)] nhiều nhất"""
+        rows = self._query('SELECT ip, COUNT(*) AS n FROM events WHERE action = ? AND ts >= ? '
+                           'GROUP BY ip ORDER BY n DESC LIMIT ?', ('BLOCKED', since or 0, limit))
+        return [(r['ip'], r['n']) for r in rows]
+
+    def per_hour(self, since=None, action=None):
+        """[(timestamp đầu giờ, số sự kiện)] theo từng giờ"""
+        sql = 'SELECT CAST(ts / 3600 AS INTEGER) * 3600 AS hour, COUNT(*) AS n FROM events WHERE ts >= ?'
+        params = [since or 0]
+        if action:
+            sql += ' AND action = ?'
+            params.append(action)
+        rows = self._query(sql + ' GROUP BY hour ORDER BY hour', params)
+        return [(r['hour'], r['n']) for r in rows]
+
+    def by_attack_type(self, since=None):
+        rows = self._query('SELECT attack_type, COUNT(*) AS n FROM events WHERE action = ? AND ts >= ? '
+                           'GROUP BY attack_type ORDER BY n DESC', ('BLOCKED', since or 0))
+        return [(r['attack_type'], r['n']) for r in rows]
+
+    def metric_series(self, names, since=None, limit=2000):
+        """{tên: [(ts, giá trị)]} theo thời gian tăng dần, tối đa limit điểm mới nhất mỗi chỉ số"""
+        series = {}
+        for name in names:
+            rows = self._query('SELECT ts, value FROM metrics WHERE name = ? AND ts >= ? ORDER BY ts DESC LIMIT ?',
+                               (name, since or 0, limit))
+            series[name] = [(r['ts'], r['value']) for r in reversed(rows)]
+        return series
+
+    def metric_names(self):
+        return [r['name'] for r in self._query('SELECT DISTINCT name FROM metrics ORDER BY name')]
+
+    def has_action(self, action):
+        return bool(self._query('SELECT 1 FROM events WHERE action = ? LIMIT 1', (action,)))
+
+    def bans_last_24h(self):
+        return self.count('BLOCKED', time.time() - 86400)
+
+    # --- Chuyển dữ liệu cũ ---
+    def import_json(self, path):
+        """Nhập file cảnh báo cũ (mảng JSON hoặc NDJSON, kể cả file đã xoay vòng), chỉ một lần"""
+        import alert_journal
+        key = f"imported:{path}"
+        if self._query('SELECT 1 FROM meta WHERE key = ?', (key,)):
+            return 0
+        imported = 0
+        for candidate in [f"{path}.{i}" for i in range(9, 0, -1)] + [path]:
+            if os.path.exists(candidate):
+                records, _ = alert_journal.read_from(candidate, 0)
+                imported += self.add_events(records)
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(time.time())))
+        return imported
+
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM events')
+
+
+def benchmark(n=10000000, batch=100000):
+    import random
+    import shutil
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), 'events.db')
+    store = EventStore(path)
+    rng = random.Random(1)
+    now = time.time()
+    types = ['SYN Flood', 'Conn Flood', 'UDP Flood']
+    start = time.perf_counter()
+    for done in range(0, n, batch):
+        records = []
+        for i in range(min(batch, n - done)):
+            attack = rng.choice(types)
+            # Sự kiện đến theo thứ tự thời gian, trải đều trong 30 ngày
+            records.append({'timestamp': now - 30 * 86400 * (1 - (done + i) / n),
+                            'ip': f"10.{rng.randrange(64)}.{rng.randrange(256)}.{rng.randrange(256)}",
+                            'action': 'BLOCKED' if rng.random() < 0.7 else 'UNBANNED',
+                            'reason': f"{attack} (HARD LIMIT: 500 > 150)"})
+        store.add_events(records)
+    elapsed = time.perf_counter() - start
+    print(f"Ghi {n:,} sự kiện: {elapsed:.1f}s ({n / elapsed:,.0f} sự kiện/s)")
+    queries = [
+        ('20 sự kiện mới nhất', lambda: store.recent(20)),
+        ('bans trong 24h', store.bans_last_24h),
+        ('top offenders 24h', lambda: store.top_offenders(now - 86400)),
+        ('cảnh báo theo giờ 24h', lambda: store.per_hour(now - 86400)),
+        ('cảnh báo hôm nay', lambda: store.count(since=now - now % 86400)),
+    ]
+    for name, query in queries:
+        start = time.perf_counter()
+        query()
+        print(f"  {name:24s}: {(time.perf_counter() - start) * 1000:8.1f} ms")
+    store.close()
+    shutil.rmtree(os.path.dirname(path))
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:2] == ['import']:
+        source = sys.argv[2] if len(sys.argv) > 2 else '/var/log/firewall_alerts.json'
+        print(f"Đã nhập {EventStore().import_json(source)} sự kiện từ {source}")
+    elif sys.argv[1:2] == ['bench']:
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 10000000)
+    else:
+        print(__doc__)
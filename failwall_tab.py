@@ -1,10 +1,14 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import subprocess
+from ban_backend import load_backend
+from rules_model import load_ruleset
 
 class FirewallTab:
     def __init__(self, parent):
         self.parent = parent
+        # Backend theo config: 'nft' -> quản lý rule trong table riêng, còn lại dùng iptables
+        self.backend = load_backend()
         
         # --- Khung chứa chính ---
         self.frame = ttk.Frame(parent)
@@ -19,7 +23,7 @@ class FirewallTab:
         ttk.Button(self.toolbar, text="Xóa Rule Đã Chọn", command=self.delete_rule).pack(side=tk.LEFT, padx=5)
         
         # --- Bảng hiển thị (Treeview) ---
-        columns = ("chain", "num", "target", "prot", "opt", "source", "destination", "options")
+        columns = ("chain", "num", "target", "prot", "packets", "source", "destination", "options")
         self.tree = ttk.Treeview(self.frame, columns=columns, show='headings', height=20)
         
         # Định nghĩa tiêu đề cột
@@ -27,7 +31,7 @@ class FirewallTab:
         self.tree.heading("num", text="No.")
         self.tree.heading("target", text="Hành Động") # ACCEPT/DROP
         self.tree.heading("prot", text="Giao Thức")
-        self.tree.heading("opt", text="Opt")
+        self.tree.heading("packets", text="Số gói")
         self.tree.heading("source", text="Nguồn (Source)")
         self.tree.heading("destination", text="Đích (Dest)")
         self.tree.heading("options", text="Thông tin thêm (Ports...)")
@@ -37,7 +41,7 @@ class FirewallTab:
         self.tree.column("num", width=50, anchor=tk.CENTER)
         self.tree.column("target", width=80, anchor=tk.CENTER)
         self.tree.column("prot", width=60, anchor=tk.CENTER)
-        self.tree.column("opt", width=50, anchor=tk.CENTER)
+        self.tree.column("packets", width=70, anchor=tk.E)
         self.tree.column("source", width=120)
         self.tree.column("destination", width=120)
         self.tree.column("options", width=200)
@@ -53,46 +57,23 @@ class FirewallTab:
         self.load_rules()
 
     def load_rules(self):
-        """Đọc quy tắc từ iptables và hiển thị lên bảng"""
+        """Đọc quy tắc (rules_model, cùng mô hình với /api/rules của web) và hiển thị lên bảng"""
         # Xóa dữ liệu cũ
         for item in self.tree.get_children():
             self.tree.delete(item)
 
+        # Config đổi ban_backend (nạp lại khi đang chạy): dùng backend mới, còn lại giữ nguyên instance
+        backend = load_backend()
+        if backend.name != self.backend.name:
+            self.backend = backend
         try:
-            # Lệnh: iptables -L -n --line-numbers (Liệt kê số dòng để dễ xóa)
-            result = subprocess.run(['iptables', '-L', '-n', '--line-numbers'], capture_output=True, text=True)
-            output = result.stdout.splitlines()
-
-            current_chain = ""
-            for line in output:
-                line = line.strip()
-                if not line: continue
-                
-                # Phát hiện Chain (Ví dụ: Chain INPUT (policy ACCEPT))
-                if line.startswith("Chain"):
-                    current_chain = line.split()[1]
-                    continue
-                
-                # Bỏ qua dòng tiêu đề của iptables (num target prot...)
-                if line.startswith("num"):
-                    continue
-
-                # Xử lý dòng rule
-                # Cấu trúc: num target prot opt source destination options
-                parts = line.split(maxsplit=6) # Tách tối đa 6 khoảng trắng đầu
-                if len(parts) >= 6:
-                    num = parts[0]
-                    target = parts[1]
-                    prot = parts[2]
-                    opt = parts[3]
-                    source = parts[4]
-                    dest = parts[5]
-                    options = parts[6] if len(parts) > 6 else ""
-                    
-                    self.tree.insert("", tk.END, values=(current_chain, num, target, prot, opt, source, dest, options))
-
+            for rule in load_ruleset(self.backend):
+                # Cột No. là số thứ tự trong chain (iptables) hoặc handle (nft)
+                self.tree.insert("", tk.END, tags=(f"v{rule.family}",),
+                                 values=(rule.chain, rule.num, rule.target, rule.proto, rule.packets,
+                                         rule.source, rule.destination, rule.options))
         except Exception as e:
-            messagebox.showerror("Lỗi", f"Không thể lấy danh sách iptables: {e}")
+            messagebox.showerror("Lỗi", f"Không thể lấy danh sách rule ({self.backend.name}): {e}")
 
     def delete_rule(self):
         """Xóa rule đang được chọn"""
@@ -109,8 +90,13 @@ class FirewallTab:
         confirm = messagebox.askyesno("Xác nhận", f"Bạn có chắc muốn xóa Rule #{num} trong Chain {chain}?")
         if confirm:
             try:
-                # Lệnh xóa: iptables -D CHAIN NUM
-                subprocess.run(['iptables', '-D', chain, str(num)], check=True)
+                if self.backend.name == 'nft':
+                    # nft delete rule inet fw_auto_block CHAIN handle NUM
+                    self.backend.delete_rule(chain, num)
+                else:
+                    # Lệnh xóa: iptables -D CHAIN NUM (ip6tables cho rule IPv6)
+                    tool = 'ip6tables' if 'v6' in item_data['tags'] else 'iptables'
+                    subprocess.run([tool, '-D', chain, str(num)], check=True)
                 messagebox.showinfo("Thành công", "Đã xóa quy tắc!")
                 self.load_rules() # Reload lại bảng
             except subprocess.CalledProcessError as e:
@@ -177,7 +163,10 @@ class FirewallTab:
             cmd.extend(['-j', action])
 
             try:
-                subprocess.run(cmd, check=True)
+                if self.backend.name == 'nft':
+                    self.backend.add_rule(chain, action, prot, src_ip, port)
+                else:
+                    subprocess.run(cmd, check=True)
                 messagebox.showinfo("Thành công", f"Đã thêm quy tắc vào {chain}")
                 self.load_rules() # Reload bảng chính
                 win.destroy() # Đóng popup
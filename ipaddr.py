@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Biểu diễn địa chỉ IP dạng số nguyên 128 bit dùng chung cho IPv4 và IPv6.
+
+Mọi bảng theo IP (số đếm của collector, lịch sử Z-Score, gộp subnet, whitelist,
+dải bị chặn) dùng khóa int thay cho chuỗi: IPv6 là giá trị 128 bit của địa chỉ,
+IPv4 a.b.c.d là ::ffff:a.b.c.d (V4_BASE | số 32 bit). Nhờ vậy một bảng prefix
+128 bit phục vụ cả hai họ địa chỉ; prefix IPv4 /n tương ứng prefix /(96 + n).
+
+Chỉ chuyển về chuỗi ở biên: khi ghi log / cảnh báo và khi gọi iptables / ipset.
+"""
+import socket
+
+V4_BASE = 0xffff << 32
+V4_PREFIX = 96          # ::ffff:0:0/96
+_V4_MASK = 0xffffffff
+
+
+def from_v4_bytes(packed):
+    return V4_BASE | int.from_bytes(packed, 'big')
+
+
+def from_v6_bytes(packed):
+    return int.from_bytes(packed, 'big')
+
+
+def pack(ip):
+    """'1.2.3.4' / '::ffff:1.2.3.4' / '2001:db8::1' -> khóa int. ValueError nếu không hợp lệ."""
+    try:
+        if ':' not in ip:
+            return V4_BASE | int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+        return int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big')
+    except (OSError, TypeError):
+        raise ValueError(f"IP không hợp lệ: {ip}")
+
+
+def try_pack(ip):
+    """Như pack() nhưng trả về None thay vì lỗi"""
+    try:
+        return pack(ip)
+    except ValueError:
+        return None
+
+
+def is_v4(key):
+    return key >> 32 == 0xffff
+
+
+def unpack(key):
+    """Khóa int -> chuỗi (IPv4 ở dạng chấm, không có tiền tố ::ffff:)"""
+    if key >> 32 == 0xffff:
+        return socket.inet_ntop(socket.AF_INET, (key & _V4_MASK).to_bytes(4, 'big'))
+    return socket.inet_ntop(socket.AF_INET6, key.to_bytes(16, 'big'))
+
+
+def is_valid(ip):
+    return try_pack(ip) is not None
+
+
+def parse_cidr(text):
+    """'1.2.3.0/24' -> (network, 120); '2001:db8::/32' -> (network, 32). Bit host bị xóa."""
+    ip, sep, plen = str(text).strip().partition('/')
+    key = pack(ip)
+    bits = 32 if is_v4(key) and ':' not in ip else 128
+    if sep:
+        if not plen.isdigit() or not 0 <= int(plen) <= bits:
+            raise ValueError(f"Prefix không hợp lệ: {text}")
+        plen = int(plen)
+    else:
+        plen = bits
+    if bits == 32:
+        plen += V4_PREFIX
+    return key >> (128 - plen) << (128 - plen), plen
+
+
+def format_cidr(network, plen):
+    """(network, plen 128 bit) -> '1.2.3.0/24' / '2001:db8::/32' (bỏ '/32' và '/128' của một host)"""
+    if plen >= V4_PREFIX and is_v4(network):
+        ip, plen = unpack(network), plen - V4_PREFIX
+        return ip if plen == 32 else f"{ip}/{plen}"
+    ip = socket.inet_ntop(socket.AF_INET6, network.to_bytes(16, 'big'))
+    return ip if plen == 128 else f"{ip}/{plen}"
+
+
+def v4_net(network32, plen32):
+    """Dải IPv4 (số 32 bit, độ dài /n) -> (network, plen) 128 bit"""
+    return V4_BASE | network32, plen32 + V4_PREFIX
+
+
+def family_of(target):
+    """Họ địa chỉ của IP / CIDR dạng chuỗi: 4 hoặc 6"""
+    ip = target.partition('/')[0]
+    return 6 if ':' in ip and not ip.startswith('::ffff:') else 4
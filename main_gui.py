@@ -4,8 +4,10 @@ from tkinter import ttk, messagebox
 import subprocess
 import os
 import sys
-import json
+import time
 from datetime import datetime, timezone
+import alert_journal
+from event_store import open_store
 
 # Import các tab nếu có
 try:
@@ -40,6 +42,9 @@ class FirewallGUI:
         self.today_alerts_var = tk.StringVar(value="0")
         self.auto_block_status_var = tk.StringVar(value="TẮT")
 
+        # Kho sự kiện SQLite do detector ghi (truy vấn có index, không nạp cả file)
+        self.event_store = open_store()
+
         # Tạo giao diện
         self.setup_gui()
 
@@ -183,10 +188,11 @@ class FirewallGUI:
         
         if confirm:
             try:
-                # 1. Reset file JSON về mảng rỗng []
+                # 1. Xóa trắng nhật ký cảnh báo (NDJSON)
                 if os.path.exists(LOG_JSON):
-                    with open(LOG_JSON, 'w') as f:
-                        f.write('[]') 
+                    alert_journal.clear(LOG_JSON)
+                if self.event_store:
+                    self.event_store.clear()
                 
                 # 2. Xóa trắng file log thường
                 if os.path.exists(LOG_PLAIN):
@@ -201,39 +207,12 @@ class FirewallGUI:
                 messagebox.showerror("Lỗi Quyền", "Không thể ghi file log.\nHãy chắc chắn bạn chạy app bằng sudo!")
             except Exception as e:
                 messagebox.showerror("Lỗi", f"Có lỗi xảy ra: {e}")
-    def load_alerts(self):
-        if not os.path.exists(LOG_JSON):
-            return []
-        try:
-            with open(LOG_JSON, 'r') as f:
-                data = f.read().strip()
-                if not data:
-                    return []
-                try:
-                    alerts = json.loads(data)
-                    if isinstance(alerts, dict):
-                        return [alerts]
-                    if isinstance(alerts, list):
-                        return alerts
-                    return []
-                except json.JSONDecodeError:
-                    alerts = []
-                    for line in data.splitlines():
-                        line = line.strip()
-                        if line:
-                            try:
-                                alerts.append(json.loads(line))
-                            except:
-                                continue
-                    return alerts
-        except Exception as e:
-            print("Lỗi đọc log JSON:", e)
-            return []
-
     def update_dashboard_from_logs(self):
-        alerts = self.load_alerts()
+        store = self.event_store
+        # Không mở được kho SQLite: đọc phần cuối nhật ký NDJSON như web_dashboard
+        recent = store.recent(50) if store else alert_journal.tail(LOG_JSON, 50)
         # Logic cập nhật Dashboard
-        if not alerts:
+        if not recent:
             self.blocked_count_var.set("0")
             self.today_alerts_var.set("0")
             self.auto_block_status_var.set("TẮT")
@@ -243,40 +222,35 @@ class FirewallGUI:
             self.alerts_text.config(state=tk.DISABLED)
             return
 
-        blocked_ips = set()
-        today_count = 0
-        recent_lines = []
-
         now = datetime.now(timezone.utc)
         midnight = datetime(now.year, now.month, now.day, tzinfo=timezone.utc)
 
-        for entry in alerts:
+        recent_lines = []
+        for entry in recent:
             ts = entry.get('timestamp')
-            ip = entry.get('ip') or entry.get('src_ip') or entry.get('source')
-            action = entry.get('action', '').upper() if entry.get('action') else ''
-            reason = entry.get('reason', '')
-
-            if action == 'BLOCKED' and ip:
-                blocked_ips.add(ip)
-
-            try:
-                entry_dt = datetime.fromtimestamp(float(ts), tz=timezone.utc)
-                if entry_dt >= midnight:
-                    today_count += 1
-            except Exception:
-                today_count += 1
-
             try:
                 time_str = datetime.fromtimestamp(float(ts), tz=timezone.utc).astimezone().strftime('%Y-%m-%d %H:%M:%S')
             except:
                 time_str = str(ts)
-            recent_lines.append(f"{time_str} - {ip or 'unknown'} - {action} - {reason}")
+            recent_lines.append(f"{time_str} - {entry.get('ip') or 'unknown'} - {entry.get('action')} - {entry.get('reason')}")
 
-        recent_lines = list(reversed(recent_lines[-50:]))
-
-        self.blocked_count_var.set(str(len(blocked_ips)))
-        self.today_alerts_var.set(str(today_count))
-        self.auto_block_status_var.set("BẬT" if any((entry.get('action','').upper()=='BLOCKED') for entry in alerts) else "TẮT")
+        if store:
+            # Số IP bị chặn trong 24h, số cảnh báo từ nửa đêm: đếm bằng SQL
+            self.blocked_count_var.set(str(store.distinct_ips('BLOCKED', time.time() - 86400)))
+            self.today_alerts_var.set(str(store.count(since=midnight.timestamp())))
+            self.auto_block_status_var.set("BẬT" if store.has_action('BLOCKED') else "TẮT")
+        else:
+            # Không có kho: chỉ đếm được trên các bản ghi vừa đọc từ nhật ký
+            def entry_time(entry):
+                try:
+                    return float(entry.get('timestamp'))
+                except (TypeError, ValueError):
+                    return 0.0
+            blocked = [e for e in recent if e.get('action') == 'BLOCKED']
+            day_ago = time.time() - 86400
+            self.blocked_count_var.set(str(len({e.get('ip') for e in blocked if entry_time(e) >= day_ago})))
+            self.today_alerts_var.set(str(sum(1 for e in recent if entry_time(e) >= midnight.timestamp())))
+            self.auto_block_status_var.set("BẬT" if blocked else "TẮT")
 
         self.alerts_text.config(state=tk.NORMAL)
         self.alerts_text.delete(1.0, tk.END)
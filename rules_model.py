@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+"""
+Mô hình rule tường lửa có kiểu, dùng chung cho Web dashboard (/api/rules) và
+tab Tường lửa của GUI.
+
+Trước đây /api/rules trả nguyên văn `iptables -L INPUT -n --line-numbers`, còn
+FirewallTab tự tách từng dòng text; với 50k rule chặn, phản hồi nặng vài MB.
+Ở đây:
+- dump một lần (`iptables-save -c` / `ip6tables-save -c`, hoặc `nft -j list`
+  với backend nft) rồi parse thành Rule (chain, num, target, proto, source,
+  destination, options, packets, bytes);
+- generation = hash của ruleset KHÔNG tính bộ đếm: cùng generation thì dùng lại
+  bản đã parse (mạng nguồn / đích đã đổi sẵn sang số nguyên 128 bit), chỉ gắn
+  bộ đếm mới;
+- query(): lọc theo IP / CIDR (chồng lấn với nguồn hoặc đích), target, chain,
+  họ địa chỉ; phân trang bằng cursor (vị trí + khóa rule, vẫn dùng được khi
+  ruleset đổi giữa hai trang);
+- etag(counters): ETag cho phản hồi có điều kiện (304).
+
+    python3 rules_model.py [số rule]   # parse / lọc / phân trang trên dump giả lập
+"""
+import base64
+import bisect
+import hashlib
+import json
+import shlex
+import subprocess
+import time
+from collections import namedtuple
+
+import ipaddr
+from ban_backend import describe_rule
+
+Rule = namedtuple('Rule', 'family chain num target proto source destination options packets bytes')
+
+DEFAULT_LIMIT = 200
+MAX_LIMIT = 1000
+ANY = {4: '0.0.0.0/0', 6: '::/0'}
+
+
+class CursorError(ValueError):
+    pass
+
+
+def _network(text):
+    """'1.2.3.0/24' -> (network, plen) 128 bit; None nếu không phải địa chỉ hoặc là 'mọi địa chỉ'"""
+    if not text or text.startswith('!'):
+        return None
+    try:
+        net = ipaddr.parse_cidr(text)
+    except ValueError:
+        return None
+    return net if net[1] not in (0, ipaddr.V4_PREFIX) else None
+
+
+def _short(text):
+    """Bỏ /32, /128 của một host như `iptables -L -n`"""
+    if text.endswith('/32') and ':' not in text:
+        return text[:-3]
+    if text.endswith('/128'):
+        return text[:-4]
+    return text
+
+
+# === PARSE ===
+def split_save(text, family=4):
+    """Output `iptables-save -c` -> (dòng rule bảng filter đã bỏ bộ đếm, [(packets, bytes)]).
+    Chỉ tách chuỗi: đủ để tính generation mà chưa phải parse từng rule."""
+    lines, counters = [], []
+    table = None
+    for line in text.splitlines():
+        if line.startswith('*'):
+            table = line[1:].strip()
+            continue
+        if table != 'filter':
+            continue
+        packets = nbytes = 0
+        if line.startswith('['):
+            values, _, line = line.partition('] ')
+            p, _, b = values[1:].partition(':')
+            packets, nbytes = int(p or 0), int(b or 0)
+        if line.startswith('-A '):
+            lines.append(line)
+            counters.append((packets, nbytes))
+    return lines, counters
+
+
+def parse_save(lines, family=4):
+    """Dòng `-A CHAIN ...` của iptables-save -> [Rule] (num đánh theo thứ tự trong chain)"""
+    rules = []
+    nums = {}
+    for line in lines:
+        args = shlex.split(line) if '"' in line or "'" in line else line.split()
+        chain = args[1]
+        target, proto, source, destination = '', 'all', ANY[family], ANY[family]
+        options = []
+        negate = ''
+        i = 2
+        while i < len(args):
+            arg = args[i]
+            value = args[i + 1] if i + 1 < len(args) else ''
+            if arg == '!':
+                negate = '!'
+                i += 1
+                continue
+            if arg in ('-j', '-g'):
+                target = value
+                rest = args[i + 2:]
+                # Tham số của target (--reject-with ..., --log-prefix ...)
+                if rest:
+                    options.append(' '.join(rest))
+                break
+            if arg in ('-s', '--source'):
+                source = negate + _short(value)
+            elif arg in ('-d', '--destination'):
+                destination = negate + _short(value)
+            elif arg in ('-p', '--protocol'):
+                proto = negate + value
+            elif arg == '-m':
+                options.append(f'{negate}-m {value}')
+            elif value.startswith('-') or not value:
+                # Cờ không có giá trị
+                options.append(negate + arg)
+                i += 1
+                negate = ''
+                continue
+            else:
+                # --dport 80, --ctstate RELATED,ESTABLISHED, -i lo ...
+                options.append(f'{negate}{arg} {shlex.quote(value)}')
+            negate = ''
+            i += 2
+        nums[chain] = nums.get(chain, 0) + 1
+        rules.append(Rule(family, chain, nums[chain], target, proto, source, destination,
+                          ' '.join(options), 0, 0))
+    return rules
+
+
+def split_nft(rules):
+    """Rule JSON của nft -> (rule đã bỏ biểu thức counter, [(packets, bytes)])"""
+    structure, counters = [], []
+    for rule in rules:
+        packets = nbytes = 0
+        exprs = []
+        for expr in rule.get('expr', []):
+            if 'counter' in expr:
+                if isinstance(expr['counter'], dict):
+                    packets = expr['counter'].get('packets', 0)
+                    nbytes = expr['counter'].get('bytes', 0)
+                continue
+            exprs.append(expr)
+        structure.append(dict(rule, expr=exprs))
+        counters.append((packets, nbytes))
+    return structure, counters
+
+
+def parse_nft(rules):
+    """Rule nft (đã qua split_nft) -> [Rule]; num = handle để xóa được bằng handle"""
+    parsed = []
+    for rule in rules:
+        info = describe_rule(rule)
+        family = 6 if ':' in (info['source'] + info['destination']) else 4
+        parsed.append(Rule(family, rule.get('chain', ''), rule.get('handle', 0), info['target'], info['prot'],
+                           info['source'] or ANY[family], info['destination'] or ANY[family],
+                           info['options'], 0, 0))
+    return parsed
+
+
+# === RULESET ===
+class RuleSet:
+    """Các rule của một generation, theo thứ tự dump (họ địa chỉ, chain, num)"""
+
+    def __init__(self, generation, base, counters):
+        self.generation = generation
+        self.base = base
+        # Mạng nguồn / đích dạng số cho bộ lọc IP / CIDR
+        self.networks = [(_network(r.source), _network(r.destination)) for r in base]
+        self.blocks = {}  # (họ, chain) -> (đầu, cuối) trong danh sách
+        for pos, r in enumerate(base):
+            start, _ = self.blocks.get((r.family, r.chain), (pos, pos))
+            self.blocks[(r.family, r.chain)] = (start, pos + 1)
+        self.positions = None  # dấu vân tay rule -> vị trí, dựng khi cần
+        self.set_counters(counters)
+
+    def set_counters(self, counters):
+        self.counters = counters
+        self.counter_hash = hashlib.sha1(repr(counters).encode()).hexdigest()[:16]
+        self.loaded_at = time.time()
+
+    def __len__(self):
+        return len(self.base)
+
+    def rule(self, pos):
+        packets, nbytes = self.counters[pos]
+        return self.base[pos]._replace(packets=packets, bytes=nbytes)
+
+    def __iter__(self):
+        for pos in range(len(self.base)):
+            yield self.rule(pos)
+
+    def etag(self, counters=False):
+        """Không lấy bộ đếm thì ETag chỉ đổi khi rule đổi"""
+        return f'{self.generation}-{self.counter_hash}' if counters else self.generation
+
+    def _cursor(self, pos):
+        r = self.base[pos - 1]
+        raw = json.dumps([self.generation, pos, r.family, r.chain, r.num, _fingerprint(r)], separators=(',', ':'))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def _resume(self, cursor):
+        """Vị trí bắt đầu của trang sau cursor"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            generation, pos, family, chain, num, fingerprint = json.loads(raw)
+        except (ValueError, TypeError):
+            raise CursorError('cursor không hợp lệ')
+        if generation == self.generation:
+            return pos
+        # Ruleset đã đổi (vd. ban hết hạn làm num dịch lên): tìm lại đúng rule cuối của
+        # trang trước theo nội dung, không còn thì theo num trong chain của nó
+        if self.positions is None:
+            self.positions = {_fingerprint(r): i for i, r in enumerate(self.base)}
+        if fingerprint in self.positions:
+            return self.positions[fingerprint] + 1
+        block = self.blocks.get((family, chain))
+        if block is None:
+            raise CursorError('chain của cursor không còn, tải lại từ đầu')
+        start, end = block
+        nums = [r.num for r in self.base[start:end]]
+        return start + bisect.bisect_right(nums, num)
+
+    def query(self, q=None, target=None, chain=None, family=None, cursor=None, limit=DEFAULT_LIMIT,
+              counters=True):
+        """(danh sách rule dạng dict, cursor trang sau hoặc None)
+        q: IP hoặc CIDR, khớp rule có nguồn / đích chồng lấn (bỏ qua 0.0.0.0/0, ::/0)"""
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        net = ipaddr.parse_cidr(q) if q else None
+        target = target.upper() if target else None
+        pos = self._resume(cursor) if cursor else 0
+        base, networks = self.base, self.networks
+        page = []
+        n = len(base)
+        while pos < n and len(page) < limit:
+            r = base[pos]
+            pos += 1
+            if target and r.target.upper() != target:
+                continue
+            if (chain and r.chain != chain) or (family and r.family != family):
+                continue
+            if net and not (_overlaps(net, networks[pos - 1][0]) or _overlaps(net, networks[pos - 1][1])):
+                continue
+            page.append(pos - 1)
+        items = []
+        for i in page:
+            item = base[i]._asdict()
+            if counters:
+                item['packets'], item['bytes'] = self.counters[i]
+            else:
+                del item['packets'], item['bytes']
+            items.append(item)
+        return items, self._cursor(pos) if pos < n and page else None
+
+
+def _fingerprint(rule):
+    return hashlib.sha1(repr(rule._replace(num=0)).encode()).hexdigest()[:12]
+
+
+def _overlaps(a, b):
+    if b is None:
+        return False
+    shift = 128 - min(a[1], b[1])
+    return a[0] >> shift == b[0] >> shift
+
+
+# === NẠP ===
+_last = None
+
+
+def dump(backend):
+    """(generation, [(packets, bytes)], hàm parse) cho ruleset hiện tại của backend:
+    iptables / ipset đọc iptables-save, nft đọc JSON"""
+    if backend.name == 'nft':
+        structure, counters = split_nft(backend.rules())
+        generation = hashlib.sha1(json.dumps(structure, sort_keys=True).encode()).hexdigest()[:16]
+        return generation, counters, lambda: parse_nft(structure)
+    families, counters = [], []
+    for tool, family in (('iptables-save', 4), ('ip6tables-save', 6)):
+        try:
+            result = subprocess.run([tool, '-c', '-t', 'filter'], capture_output=True, text=True)
+        except FileNotFoundError:
+            continue
+        lines, values = split_save(result.stdout, family)
+        families.append((lines, family))
+        counters += values
+    digest = hashlib.sha1()
+    for lines, family in families:
+        digest.update(f'{family}\n'.encode())
+        digest.update('\n'.join(lines).encode())
+    return digest.hexdigest()[:16], counters, lambda: [r for lines, family in families
+                                                        for r in parse_save(lines, family)]
+
+
+def build(generation, counters, parse):
+    """RuleSet của generation; cùng generation với lần trước thì chỉ gắn bộ đếm mới"""
+    global _last
+    if _last is not None and _last.generation == generation:
+        _last.set_counters(counters)
+        return _last
+    _last = RuleSet(generation, parse(), counters)
+    return _last
+
+
+def load_ruleset(backend):
+    return build(*dump(backend))
+
+
+# === BENCHMARK ===
+def _synthetic_save(n, seed=1):
+    import random
+    rng = random.Random(seed)
+    lines = ['*filter', ':INPUT ACCEPT [0:0]', ':FORWARD ACCEPT [0:0]', ':OUTPUT ACCEPT [0:0]',
+             '[120:9000] -A INPUT -i lo -j ACCEPT',
+             '[5000:300000] -A INPUT -m conntrack --ctstate RELATED,ESTABLISHED -j ACCEPT',
+             '[7:420] -A INPUT -p tcp -m tcp --dport 22 -j ACCEPT',
+             '[0:0] -A INPUT -s 10.0.0.0/8 -p tcp -m tcp --dport 80 -m comment --comment "mang noi bo" -j ACCEPT']
+    for _ in range(n):
+        ip = f'{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}/32'
+        lines.append(f'[{rng.randrange(1000)}:{rng.randrange(100000)}] -A INPUT -s {ip} -j DROP')
+    lines += ['[3:180] -A INPUT -p icmp -j REJECT --reject-with icmp-port-unreachable', 'COMMIT']
+    return '\n'.join(lines) + '\n'
+
+
+def _synthetic_dump(text):
+    lines, counters = split_save(text)
+    return hashlib.sha1(('4\n' + '\n'.join(lines)).encode()).hexdigest()[:16], counters, lambda: parse_save(lines)
+
+
+def benchmark(n=50000):
+    global _last
+    text = _synthetic_save(n)
+    _last = None
+    start = time.perf_counter()
+    ruleset = build(*_synthetic_dump(text))
+    t_build = time.perf_counter() - start
+    # Cùng rule, bộ đếm mới: chỉ tách dòng + gắn bộ đếm, không parse lại
+    start = time.perf_counter()
+    again = build(*_synthetic_dump(text.replace('[0:0] -A INPUT -s 10', '[1:60] -A INPUT -s 10')))
+    t_same = time.perf_counter() - start
+    print(f"{len(ruleset)} rule: parse + dựng RuleSet {t_build * 1000:.0f} ms, "
+          f"dump lại cùng generation {t_same * 1000:.0f} ms (dùng lại: {again is ruleset})")
+    print(f"  etag {ruleset.etag()} / có bộ đếm {ruleset.etag(True)}")
+
+    start = time.perf_counter()
+    pages, cursor, rows = 0, None, 0
+    while True:
+        items, cursor = ruleset.query(cursor=cursor, limit=500, counters=False)
+        pages += 1
+        rows += len(items)
+        if not cursor:
+            break
+    t_pages = time.perf_counter() - start
+    size = len(json.dumps(ruleset.query(limit=DEFAULT_LIMIT)[0]))
+    print(f"  phân trang 500/trang: {pages} trang, {rows} rule, {t_pages * 1000:.0f} ms; "
+          f"trang đầu {DEFAULT_LIMIT} rule = {size / 1024:.0f} KB JSON "
+          f"(cả bảng: {len(json.dumps([r._asdict() for r in ruleset])) / 1024 / 1024:.1f} MB)")
+
+    for label, kwargs in (('IP 10.1.2.3', {'q': '10.1.2.3'}), ('CIDR 100.0.0.0/8', {'q': '100.0.0.0/8'}),
+                          ('target ACCEPT', {'target': 'accept'}), ('target REJECT', {'target': 'REJECT'})):
+        start = time.perf_counter()
+        items, cursor = ruleset.query(limit=MAX_LIMIT, **kwargs)
+        elapsed = time.perf_counter() - start
+        print(f"  lọc {label:18s}: {len(items):4d} rule{' (còn trang sau)' if cursor else ''}, "
+              f"{elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    import sys
+    benchmark(*(int(a) for a in sys.argv[1:2]))
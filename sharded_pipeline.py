@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Chia lịch sử Z-Score theo IP nguồn cho nhiều tiến trình worker (nhiều core).
+
+Trong DosDetector, cập nhật lịch sử + tính Z-Score của mọi IP chạy trên một
+thread Python, nên khi flood lớn chỉ dùng được một core. ShardedPipeline băm khóa
+ipaddr của IP nguồn vào N worker; mỗi worker giữ riêng lịch sử (zscore_engine) của
+các IP thuộc shard của nó, nhận số đếm và trả về IP vượt ngưỡng kèm Z-Score.
+
+- Collector vẫn chạy ở tiến trình chính; số đếm mỗi chu kỳ được chia shard bằng
+  NumPy (splitmix64 như sketch) rồi chép theo lô vào bộ nhớ chia sẻ của từng worker
+  (RawArray: khóa tách thành hai nửa 64 bit + số đếm), qua Pipe chỉ gửi lệnh nhỏ.
+- Cả N worker cập nhật lịch sử song song; tiến trình chính (coordinator) gộp danh
+  sách IP vượt ngưỡng rồi ra quyết định chặn như cũ (decide / block_ip).
+- ShardedHistory có cùng giao diện với lịch sử một tiến trình (update, tracked_keys,
+  evictions, export_state, import_state) nên detector và state_store dùng thẳng.
+
+Bật bằng config pipeline_workers (0 hoặc 1 = chạy trong tiến trình chính).
+
+    python3 sharded_pipeline.py [số worker tối đa] [số socket] [số IP]   # đo khả năng mở rộng
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from array import array
+
+from zscore_engine import create_history, HISTORY_LEN, MIN_SAMPLES, MAX_KEYS, IDLE_TTL
+from sketch import M64, _mix
+
+try:
+    import numpy as np
+    from sketch import _mix_np
+except ImportError:
+    np = None
+
+DEFAULT_CAPACITY = 1 << 18  # Số bản ghi mỗi lô trong bộ nhớ chia sẻ của một worker
+
+
+def _shard_of(keys, workers):
+    """Shard của từng khóa (mảng NumPy hoặc list) và hai nửa 64 bit của khóa"""
+    if np is not None:
+        try:
+            lo = np.array(keys, dtype=np.uint64)  # Chỉ IPv4 (< 2^64): chuyển thẳng trong C
+            hi = None
+        except OverflowError:
+            lo = np.fromiter((k & M64 for k in keys), dtype=np.uint64, count=len(keys))
+            hi = np.fromiter((k >> 64 for k in keys), dtype=np.uint64, count=len(keys))
+        mixed = _mix_np(lo if hi is None else lo ^ hi)
+        return (mixed % np.uint64(workers)).astype(np.intp), lo, hi
+    shards = [_mix((k ^ (k >> 64)) & M64) % workers for k in keys]
+    return shards, [k & M64 for k in keys], [k >> 64 for k in keys]
+
+
+def _decode(lo, hi, n, any_hi):
+    """Ghép lại khóa ipaddr từ hai nửa 64 bit trong bộ nhớ chia sẻ"""
+    if np is not None:
+        keys = np.frombuffer(lo, dtype=np.uint64, count=n).tolist()
+        if any_hi:
+            highs = np.frombuffer(hi, dtype=np.uint64, count=n).tolist()
+            keys = [h << 64 | l for h, l in zip(highs, keys)]
+        return keys
+    if any_hi:
+        return [hi[i] << 64 | lo[i] for i in range(n)]
+    return list(lo[:n])
+
+
+def _counts(buf, n):
+    if np is not None:
+        return np.frombuffer(buf, dtype=np.int64, count=n).copy()
+    return array('q', buf[:n])
+
+
+# === WORKER ===
+def _worker_main(conn, lo, hi, counts, history_args):
+    """Vòng lặp của một worker: nhận lệnh qua Pipe, số đếm qua bộ nhớ chia sẻ"""
+    histories = {}
+    pending_keys, pending_counts = [], []
+
+    def history(name):
+        if name not in histories:
+            histories[name] = create_history(*history_args)
+        return histories[name]
+
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        op = msg[0]
+        try:
+            if op == 'put':
+                # Một lô bản ghi của chu kỳ hiện tại (các lô không trùng khóa)
+                _, n, any_hi = msg
+                pending_keys += _decode(lo, hi, n, any_hi)
+                pending_counts.append(_counts(counts, n))
+                conn.send(None)
+            elif op == 'update':
+                _, name, min_count, now = msg
+                h = history(name)
+                if np is not None:
+                    values = np.concatenate(pending_counts) if pending_counts else np.zeros(0, dtype=np.int64)
+                else:
+                    values = [c for part in pending_counts for c in part]
+                result = h.update_batch(pending_keys, values, min_count, now)
+                pending_keys, pending_counts = [], []
+                conn.send((result, h.tracked_keys, h.evictions))
+            elif op == 'export':
+                conn.send(history(msg[1]).export_state())
+            elif op == 'import':
+                conn.send(history(msg[1]).import_state(msg[2]))
+            elif op == 'stop':
+                conn.send(None)
+                return
+        except Exception as e:
+            pending_keys, pending_counts = [], []
+            conn.send(e)
+
+
+class ShardedPipeline:
+    def __init__(self, workers, history_len=HISTORY_LEN, min_samples=MIN_SAMPLES,
+                 max_keys=MAX_KEYS, idle_ttl=IDLE_TTL, capacity=DEFAULT_CAPACITY):
+        self.workers = max(int(workers), 1)
+        self.history_len = history_len
+        # Mỗi worker giữ tối đa max_keys / N IP (tổng số IP theo dõi không đổi)
+        self.history_args = (history_len, min_samples, max(max_keys // self.workers, 1), idle_ttl)
+        self.capacity = capacity
+        self.shards = []   # [(conn, process, lo, hi, counts)]
+        self.lock = threading.Lock()
+        self.tracked = {}
+        self.evicted = {}
+
+    def start(self):
+        ctx = multiprocessing.get_context('fork')
+        for _ in range(self.workers):
+            lo, hi = ctx.RawArray('Q', self.capacity), ctx.RawArray('Q', self.capacity)
+            counts = ctx.RawArray('q', self.capacity)
+            parent, child = ctx.Pipe()
+            process = ctx.Process(target=_worker_main, args=(child, lo, hi, counts, self.history_args),
+                                  name='shard-worker', daemon=True)
+            process.start()
+            child.close()
+            self.shards.append((parent, process, lo, hi, counts))
+        return self
+
+    def stop(self):
+        with self.lock:
+            for conn, process, *_ in self.shards:
+                try:
+                    conn.send(('stop',))
+                    conn.recv()
+                except (OSError, EOFError):
+                    pass
+                process.join(1)
+            self.shards = []
+
+    def _reply(self, conn):
+        reply = conn.recv()
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def _put(self, stats):
+        """Chia shard và chép số đếm vào bộ nhớ chia sẻ theo lô"""
+        keys = list(stats)
+        n = len(keys)
+        if not n:
+            return
+        shard, lo, hi = _shard_of(keys, self.workers)
+        if np is not None:
+            counts = np.fromiter(stats.values(), dtype=np.int64, count=n)
+            order = np.argsort(shard, kind='stable')
+            bounds = np.searchsorted(shard[order], np.arange(self.workers + 1)).tolist()
+            parts = [order[bounds[w]:bounds[w + 1]] for w in range(self.workers)]
+        else:
+            counts = list(stats.values())
+            parts = [[] for _ in range(self.workers)]
+            for i, w in enumerate(shard):
+                parts[w].append(i)
+        cap = self.capacity
+        for start in range(0, max(len(p) for p in parts), cap):
+            sent = []
+            for (conn, _, shm_lo, shm_hi, shm_counts), idx in zip(self.shards, parts):
+                sel = idx[start:start + cap]
+                m = len(sel)
+                if not m:
+                    continue
+                if np is not None:
+                    np.frombuffer(shm_lo, dtype=np.uint64, count=m)[:] = lo[sel]
+                    np.frombuffer(shm_counts, dtype=np.int64, count=m)[:] = counts[sel]
+                    any_hi = hi is not None and bool(hi[sel].any())
+                    if any_hi:
+                        np.frombuffer(shm_hi, dtype=np.uint64, count=m)[:] = hi[sel]
+                else:
+                    shm_lo[:m] = [lo[i] for i in sel]
+                    shm_counts[:m] = [counts[i] for i in sel]
+                    any_hi = any(hi[i] for i in sel)
+                    if any_hi:
+                        shm_hi[:m] = [hi[i] for i in sel]
+                conn.send(('put', m, any_hi))
+                sent.append(conn)
+            for conn in sent:
+                self._reply(conn)
+
+    def update(self, name, stats, min_count=None, now=None):
+        """Như history.update nhưng chia cho N worker: [(khóa, count, z)] của IP có count > min_count"""
+        now = time.time() if now is None else now
+        with self.lock:
+            self._put(stats)
+            for conn, *_ in self.shards:
+                conn.send(('update', name, min_count, now))
+            result, tracked, evicted = [], 0, 0
+            for conn, *_ in self.shards:
+                part, keys, evictions = self._reply(conn)
+                result += part
+                tracked += keys
+                evicted += evictions
+            self.tracked[name], self.evicted[name] = tracked, evicted
+        return result
+
+    def export_state(self, name):
+        """Gộp lịch sử của mọi shard thành dạng trao đổi chung của zscore_engine"""
+        with self.lock:
+            for conn, *_ in self.shards:
+                conn.send(('export', name))
+            states = [self._reply(conn) for conn, *_ in self.shards]
+        merged = {'history_len': self.history_len, 'keys': []}
+        for field in ('data', 'n', 'pos', 'last_seen'):
+            merged[field] = b''.join(state[field] for state in states)
+        for state in states:
+            merged['keys'] += list(state['keys'])
+        return merged
+
+    def import_state(self, name, state):
+        """Chia một lịch sử đã lưu về các shard theo cùng hàm băm"""
+        if state['history_len'] != self.history_len:
+            return False
+        keys = list(state['keys'])
+        L = self.history_len
+        data, n, pos, last_seen = (array(code) for code in 'iiid')
+        data.frombytes(state['data']); n.frombytes(state['n'])
+        pos.frombytes(state['pos']); last_seen.frombytes(state['last_seen'])
+        shard = _shard_of(keys, self.workers)[0] if keys else []
+        parts = [[] for _ in range(self.workers)]
+        for i, w in enumerate(shard.tolist() if np is not None and len(keys) else shard):
+            parts[w].append(i)
+        with self.lock:
+            for (conn, *_), idx in zip(self.shards, parts):
+                sub = {'history_len': L, 'keys': [keys[i] for i in idx],
+                       'data': array('i', (v for i in idx for v in data[i * L:(i + 1) * L])).tobytes(),
+                       'n': array('i', (n[i] for i in idx)).tobytes(),
+                       'pos': array('i', (pos[i] for i in idx)).tobytes(),
+                       'last_seen': array('d', (last_seen[i] for i in idx)).tobytes()}
+                conn.send(('import', name, sub))
+            ok = all(self._reply(conn) for conn, *_ in self.shards)
+            if ok:
+                self.tracked[name] = len(keys)
+        return ok
+
+    def history(self, name):
+        return ShardedHistory(self, name)
+
+
+class ShardedHistory:
+    """Lịch sử của một loại số liệu (syn / conn / udp / pkt) nằm rải trên các worker"""
+
+    def __init__(self, pipeline, name):
+        self.pipeline = pipeline
+        self.name = name
+        self.history_len = pipeline.history_len
+
+    def __len__(self):
+        return self.tracked_keys
+
+    @property
+    def tracked_keys(self):
+        return self.pipeline.tracked.get(self.name, 0)
+
+    @property
+    def evictions(self):
+        return self.pipeline.evicted.get(self.name, 0)
+
+    def update(self, stats, min_count=None, now=None):
+        return self.pipeline.update(self.name, stats, min_count, now)
+
+    def export_state(self):
+        return self.pipeline.export_state(self.name)
+
+    def import_state(self, state):
+        return self.pipeline.import_state(self.name, state)
+
+
+def create_pipeline(config, history_len=HISTORY_LEN, min_samples=MIN_SAMPLES):
+    """ShardedPipeline đã khởi động theo pipeline_workers, hoặc None nếu chạy một tiến trình"""
+    workers = int(config.get('pipeline_workers', 0))
+    if workers <= 1:
+        return None
+    pipeline = ShardedPipeline(workers, history_len, min_samples,
+                               int(config.get('history_max_ips', MAX_KEYS)),
+                               int(config.get('history_idle_ttl', IDLE_TTL)))
+    logging.info(f"Lịch sử Z-Score chia cho {workers} worker")
+    return pipeline.start()
+
+
+# === BENCHMARK ===
+def benchmark(max_workers=None, n_sockets=2_000_000, n_peers=400_000, cycles=6):
+    """Cùng chuỗi dump socket giả lập, đo thời gian cập nhật lịch sử với 1..N worker"""
+    import tempfile
+    from tcp_collector import ProcNetCollector, write_proc_fixture
+    max_workers = max_workers or os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'tcp')
+        write_proc_fixture(path, n_sockets, n_peers)
+        start = time.perf_counter()
+        syn, conn = ProcNetCollector(paths=(path,)).collect(())
+        parse = time.perf_counter() - start
+    print(f"dump {n_sockets} socket / {n_peers} IP, parse (collector, 1 core): {parse * 1000:.0f} ms, "
+          f"{len(syn) + len(conn)} khóa mỗi chu kỳ, {os.cpu_count()} CPU")
+    # Mỗi chu kỳ đổi số đếm một chút để lịch sử có phương sai; 100 IP tấn công ở chu kỳ cuối
+    frames = [({k: v + (i + k) % 3 for k, v in syn.items()}, {k: v + (i * k) % 5 for k, v in conn.items()})
+              for i in range(cycles)]
+    attackers = list(syn)[:100]
+    frames[-1][0].update((k, 500) for k in attackers)
+    counts = [1]
+    while counts[-1] * 2 <= max_workers:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != max_workers:
+        counts.append(max_workers)
+    baseline = None
+    for workers in [0] + counts:
+        if workers == 0:
+            histories = (create_history(), create_history())
+            label = 'một tiến trình'
+        else:
+            pipeline = ShardedPipeline(workers).start()
+            histories = (pipeline.history('syn'), pipeline.history('conn'))
+            label = f'{workers} worker'
+        best = None
+        flagged = 0
+        for i, (s, c) in enumerate(frames):
+            now = 1000.0 + i * 5
+            t = time.perf_counter()
+            flagged = len(histories[0].update(s, 50, now)) + len(histories[1].update(c, 50, now))
+            elapsed = time.perf_counter() - t
+            if i >= 1:  # Bỏ chu kỳ đầu (cấp phát hàng cho IP mới)
+                best = elapsed if best is None else min(best, elapsed)
+        if workers:
+            pipeline.stop()
+        baseline = baseline or best
+        print(f"  {label:14s}: {best * 1000:8.1f} ms/chu kỳ (x{baseline / best:4.2f}), "
+              f"{flagged} IP vượt ngưỡng, {histories[0].tracked_keys + histories[1].tracked_keys} IP theo dõi")
+
+
+if __name__ == "__main__":
+    import sys
+    benchmark(*(int(a) for a in sys.argv[1:4]))
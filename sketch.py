@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Đếm theo IP nguồn với bộ nhớ cố định (counting_mode = "sketch").
+
+Khi bị SYN / UDP flood giả mạo nguồn ngẫu nhiên, dict {IP: số đếm} của mỗi chu
+kỳ có hàng triệu khóa, mỗi khóa chỉ đếm 1-2. HeavyHitterSketch thay dict đó bằng:
+
+- CountMinSketch (depth x width bộ đếm int32): ước lượng số đếm của một IP.
+  Không bao giờ đếm thiếu (khi số đếm thật không âm); với width = w, depth = d:
+      ước lượng <= thật + (e / w) * N   với xác suất >= 1 - e^-d
+  (N = tổng số đếm của chu kỳ). Mặc định w = 2^18, d = 4: sai số <= 1.04e-5 * N
+  với xác suất 98%, ví dụ 2 triệu socket -> lệch tối đa ~21. Chọn w sao cho
+  e * N / w nhỏ hơn nhiều so với ngưỡng chặn. Bộ nhớ 4 * w * d byte (4 MiB).
+- SpaceSaving (k khóa): tập ứng viên top-k. Mọi IP có số đếm > N / k luôn nằm
+  trong tập. Chỉ IP có ước lượng CMS vượt bộ đếm nhỏ nhất của tập mới được đưa
+  vào, nên nguồn giả mạo (đếm 1-2) phần lớn bị loại bằng phép toán vector.
+  Số đếm trả về cho detector là ước lượng CMS của các ứng viên.
+- HyperLogLog (2^p thanh ghi): ước lượng số IP nguồn khác nhau, sai số chuẩn
+  1.04 / sqrt(2^p) (p = 14: 0.81%, 16 KiB).
+
+Các lô đưa vào update() là dict {khóa ipaddr: số đếm} đã gộp trong lô (collector
+gộp theo từng buffer netlink / từng khối dòng), nên bộ nhớ tạm cũng bị chặn.
+Số đếm âm (luồng UDP kết thúc) được CMS hỗ trợ; HyperLogLog chỉ đếm khóa đã thấy.
+
+Dùng NumPy nếu có (băm / cập nhật theo vector); không có thì chạy bản thuần Python
+(đúng nhưng chậm hơn nhiều, chỉ nên dùng để thử).
+
+    python3 sketch.py [số socket] [số nguồn giả mạo]   # so sánh với chế độ đếm chính xác
+"""
+import heapq
+import math
+import random
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+M64 = (1 << 64) - 1
+DEFAULT_WIDTH = 1 << 18
+DEFAULT_DEPTH = 4
+DEFAULT_TOPK = 1024
+DEFAULT_PRECISION = 14
+
+
+# === BĂM ===
+def _mix(x):
+    """splitmix64: trộn khóa 64 bit (IPv4 liên tiếp vẫn rải đều)"""
+    x = (x + 0x9E3779B97F4A7C15) & M64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & M64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & M64
+    return x ^ (x >> 31)
+
+
+if np is not None:
+    _C = [np.uint64(c) for c in (0x9E3779B97F4A7C15, 0xBF58476D1CE4E5B9, 0x94D049BB133111EB)]
+    _S = [np.uint64(s) for s in (30, 27, 31)]
+
+    def _mix_np(x):
+        with np.errstate(over='ignore'):
+            x = x + _C[0]
+            x = (x ^ (x >> _S[0])) * _C[1]
+            x = (x ^ (x >> _S[1])) * _C[2]
+        return x ^ (x >> _S[2])
+
+
+def hash_keys(keys):
+    """Khóa ipaddr (int 128 bit) -> băm 64 bit (mảng uint64 nếu có NumPy, ngược lại list)"""
+    if np is not None:
+        try:
+            folded = np.array(keys, dtype=np.uint64)  # Lô chỉ có IPv4 (< 2^64): chuyển thẳng trong C
+        except OverflowError:
+            folded = np.fromiter(((k ^ (k >> 64)) & M64 for k in keys), dtype=np.uint64, count=len(keys))
+        return _mix_np(folded)
+    return [_mix((k ^ (k >> 64)) & M64) for k in keys]
+
+
+# === COUNT-MIN ===
+class CountMinSketch:
+    def __init__(self, width=DEFAULT_WIDTH, depth=DEFAULT_DEPTH, seed=1):
+        bits = max(int(width) - 1, 1).bit_length()  # làm tròn lên lũy thừa của 2
+        self.width = 1 << bits
+        self.depth = int(depth)
+        self.shift = 64 - bits
+        rng = random.Random(seed)
+        # Băm multiply-shift với hệ số lẻ ngẫu nhiên cho mỗi hàng
+        self.multipliers = [rng.getrandbits(64) | 1 for _ in range(self.depth)]
+        if np is not None:
+            self.table = np.zeros((self.depth, self.width), dtype=np.int32)
+            self._mult = [np.uint64(m) for m in self.multipliers]
+            self._shift = np.uint64(self.shift)
+        else:
+            self.table = [array('i', bytes(4 * self.width)) for _ in range(self.depth)]
+
+    @property
+    def nbytes(self):
+        return 4 * self.width * self.depth
+
+    def clear(self):
+        if np is not None:
+            self.table.fill(0)
+        else:
+            self.table = [array('i', bytes(4 * self.width)) for _ in range(self.depth)]
+
+    def _rows(self, hashes):
+        if np is not None:
+            with np.errstate(over='ignore'):
+                return [((hashes * m) >> self._shift).astype(np.intp) for m in self._mult]
+        return [[(h * m & M64) >> self.shift for h in hashes] for m in self.multipliers]
+
+    def update(self, hashes, counts):
+        if np is not None:
+            counts = np.asarray(counts, dtype=np.int32)
+            for row, idx in zip(self.table, self._rows(hashes)):
+                np.add.at(row, idx, counts)
+            return
+        for row, idx in zip(self.table, self._rows(hashes)):
+            for i, c in zip(idx, counts):
+                row[i] += c
+
+    def estimate(self, hashes):
+        """Ước lượng (cận trên) số đếm của từng khóa đã băm"""
+        rows = self._rows(hashes)
+        if np is not None:
+            return np.minimum.reduce([row[idx] for row, idx in zip(self.table, rows)])
+        return [min(row[i] for row, i in zip(self.table, col)) for col in zip(*rows)]
+
+
+# === SPACE-SAVING ===
+class SpaceSaving:
+    """Top-k theo thuật toán Space-Saving: k bộ đếm, khóa mới thay khóa có bộ đếm
+    nhỏ nhất và nhận count = min + tăng thêm (heap với mục cũ bị bỏ qua khi pop)"""
+
+    def __init__(self, k=DEFAULT_TOPK):
+        self.k = int(k)
+        self.counts = {}
+        self.heap = []
+
+    def __len__(self):
+        return len(self.counts)
+
+    def clear(self):
+        self.counts.clear()
+        self.heap.clear()
+
+    def floor(self):
+        """Bộ đếm nhỏ nhất khi tập đã đầy (khóa ngoài tập không thể có số đếm lớn hơn), 0 nếu chưa đầy"""
+        if len(self.counts) < self.k:
+            return 0
+        heap, counts = self.heap, self.counts
+        while counts.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0]
+
+    def offer(self, key, count=1):
+        counts = self.counts
+        if key in counts:
+            counts[key] += count
+        elif count <= 0:
+            return
+        elif len(counts) < self.k:
+            counts[key] = count
+        else:
+            floor = self.floor()
+            del counts[heapq.heappop(self.heap)[1]]
+            counts[key] = floor + count
+        heapq.heappush(self.heap, (counts[key], key))
+        if len(self.heap) > 4 * self.k:
+            self.heap = [(c, k) for k, c in counts.items()]
+            heapq.heapify(self.heap)
+
+    def top(self):
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+
+
+# === HYPERLOGLOG ===
+class HyperLogLog:
+    def __init__(self, precision=DEFAULT_PRECISION):
+        self.p = int(precision)
+        self.m = 1 << self.p
+        self.cap = 65 - self.p  # rank tối đa khi phần còn lại toàn 0
+        self.registers = np.zeros(self.m, dtype=np.uint8) if np is not None else bytearray(self.m)
+        if np is not None:
+            self._idx_shift = np.uint64(64 - self.p)
+            self._p = np.uint64(self.p)
+
+    def clear(self):
+        if np is not None:
+            self.registers.fill(0)
+        else:
+            self.registers = bytearray(self.m)
+
+    def add(self, hashes):
+        if np is not None:
+            idx = (hashes >> self._idx_shift).astype(np.intp)
+            rest = hashes << self._p
+            # bit_length qua số mũ của float64 (frexp), rank = số bit 0 đầu + 1
+            rank = np.minimum(65 - np.frexp(rest.astype(np.float64))[1], self.cap).astype(np.uint8)
+            np.maximum.at(self.registers, idx, rank)
+            return
+        regs, shift = self.registers, 64 - self.p
+        for h in hashes:
+            i = h >> shift
+            rank = min(65 - ((h << self.p) & M64).bit_length(), self.cap)
+            if rank > regs[i]:
+                regs[i] = rank
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        if np is not None:
+            z = float(np.ldexp(1.0, -self.registers.astype(np.int32)).sum())
+            zeros = int(np.count_nonzero(self.registers == 0))
+        else:
+            z = sum(2.0 ** -r for r in self.registers)
+            zeros = self.registers.count(0)
+        estimate = alpha * m * m / z
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # linear counting cho tập nhỏ
+        return int(round(estimate))
+
+
+# === KẾT HỢP ===
+class HeavyHitterSketch:
+    """Thay dict {IP: số đếm} của một loại số liệu: update() theo lô, top() trả về
+    dict {IP: ước lượng} cho các ứng viên top-k (đưa thẳng vào analyze_and_block)"""
+
+    def __init__(self, width=DEFAULT_WIDTH, depth=DEFAULT_DEPTH, topk=DEFAULT_TOPK,
+                 precision=DEFAULT_PRECISION, seed=1):
+        self.cms = CountMinSketch(width, depth, seed)
+        self.topk = SpaceSaving(topk)
+        self.hll = HyperLogLog(precision)
+        self.total = 0
+
+    def clear(self):
+        self.cms.clear()
+        self.topk.clear()
+        self.hll.clear()
+        self.total = 0
+
+    @property
+    def nbytes(self):
+        # Heap của SpaceSaving tối đa 4k mục (tuple + int), ước lượng thô ~150 byte / mục
+        return self.cms.nbytes + self.hll.m + 4 * self.topk.k * 150
+
+    def update(self, counts):
+        """counts: dict {khóa ipaddr: số đếm trong lô} (số âm = bớt luồng)"""
+        if not counts:
+            return
+        keys = list(counts)
+        values = list(counts.values())
+        hashes = hash_keys(keys)
+        self.cms.update(hashes, values)
+        self.hll.add(hashes)
+        self.total += sum(values)
+        estimates = self.cms.estimate(hashes)
+        floor = self.topk.floor()
+        offer = self.topk.offer
+        # Khóa đang được theo dõi luôn nhận cập nhật (kể cả số âm); khóa mới chỉ được
+        # xét khi ước lượng CMS vượt bộ đếm nhỏ nhất của tập top-k
+        tracked = counts.keys() & self.topk.counts.keys()
+        for key in tracked:
+            offer(key, counts[key])
+        if np is not None:
+            candidates = np.flatnonzero(estimates > floor).tolist()  # lọc bằng phép toán vector
+        else:
+            candidates = [i for i, estimate in enumerate(estimates) if estimate > floor]
+        for i in candidates:
+            if keys[i] not in tracked:
+                offer(keys[i], values[i])
+
+    def top(self, whitelist=()):
+        """dict {khóa: ước lượng CMS} của các ứng viên top-k, bỏ whitelist và khóa đã về 0"""
+        keys = [key for key in self.topk.counts if key not in whitelist]
+        if not keys:
+            return {}
+        estimates = self.cms.estimate(hash_keys(keys))
+        if np is not None:
+            estimates = estimates.tolist()
+        return {key: est for key, est in zip(keys, estimates) if est > 0}
+
+    def cardinality(self):
+        """Ước lượng số IP nguồn khác nhau từ lần clear() gần nhất"""
+        return self.hll.count()
+
+
+def create_sketch(config):
+    """HeavyHitterSketch theo config (sketch_width, sketch_depth, sketch_topk)"""
+    return HeavyHitterSketch(int(config.get('sketch_width', DEFAULT_WIDTH)),
+                             int(config.get('sketch_depth', DEFAULT_DEPTH)),
+                             int(config.get('sketch_topk', DEFAULT_TOPK)))
+
+
+# === BENCHMARK ===
+def _flood(n_sockets, n_spoofed, attackers=50, per_attacker=400, chunk=8192, seed=1):
+    """Các lô {khóa: số đếm} (mỗi lô gộp `chunk` socket) của một SYN flood giả mạo nguồn
+    + `attackers` IP thật mỗi IP `per_attacker` socket"""
+    from collections import Counter
+    from ipaddr import V4_BASE
+    rng = random.Random(seed)
+    heavy = [V4_BASE | 0xC6336400 | i for i in range(attackers)]  # 198.51.100.x
+    spoofed = n_sockets - attackers * per_attacker
+    stream = [V4_BASE | rng.getrandbits(32) % n_spoofed for _ in range(spoofed)]
+    stream += heavy * per_attacker
+    rng.shuffle(stream)
+    return [Counter(stream[i:i + chunk]) for i in range(0, len(stream), chunk)], heavy, stream
+
+
+def benchmark(n_sockets=2000000, n_spoofed=1 << 30, threshold=50):
+    import time
+    import tracemalloc
+    from collections import defaultdict
+    chunks, heavy, stream = _flood(n_sockets, n_spoofed)
+    truth = defaultdict(int)
+    for key in stream:
+        truth[key] += 1
+    distinct = len(truth)
+    del stream
+    print(f"{n_sockets} socket, {distinct} nguồn khác nhau, {len(heavy)} IP tấn công thật; "
+          f"NumPy: {'có' if np is not None else 'không'}")
+
+    def exact():
+        stats = defaultdict(int)
+        for batch in chunks:
+            for key, count in batch.items():
+                stats[key] += count
+        return stats
+
+    sketch = HeavyHitterSketch()
+
+    def sketched():
+        sketch.clear()
+        for batch in chunks:
+            sketch.update(batch)
+        return sketch.top()
+
+    from zscore_engine import create_history
+    for label, run in (('chính xác (dict)', exact), ('sketch', sketched)):
+        start = time.perf_counter()
+        stats = run()
+        elapsed = time.perf_counter() - start
+        # Chi phí phía sau: cập nhật lịch sử Z-Score cho mọi khóa được đưa vào analyze_and_block
+        start = time.perf_counter()
+        create_history().update(stats, threshold)
+        history = time.perf_counter() - start
+        tracemalloc.start()  # Đo bộ nhớ ở lần chạy riêng (tracemalloc làm chậm cấp phát)
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        flagged = {key for key, count in stats.items() if count > threshold}
+        found = len(flagged & set(heavy))
+        extra = len(flagged - set(heavy))
+        print(f"  {label:17s}: đếm {elapsed * 1000:6.0f} ms + lịch sử Z-Score {history * 1000:6.0f} ms, "
+              f"bộ nhớ đỉnh {peak / 2**20:6.1f} MiB, {len(stats)} khóa, "
+              f"{found}/{len(heavy)} IP tấn công > ngưỡng, {extra} IP sai")
+    errors = [sketch.cms.estimate(hash_keys([k]))[0] - truth[k] for k in heavy]
+    print(f"  sai số CMS trên IP tấn công: tối đa +{max(errors)}, cận lý thuyết e*N/w = "
+          f"{math.e * n_sockets / sketch.cms.width:.1f}")
+    print(f"  HyperLogLog: {sketch.cardinality()} nguồn (thật {distinct}, "
+          f"lệch {abs(sketch.cardinality() - distinct) / distinct * 100:.2f}%)")
+    print(f"  bộ nhớ cố định của sketch: {sketch.nbytes / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    import sys
+    benchmark(*(int(a) for a in sys.argv[1:3]))
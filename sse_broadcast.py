@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Đẩy trạng thái dashboard tới trình duyệt bằng Server-Sent Events.
+
+Trước đây mỗi trình duyệt gọi /api/status 5 giây một lần, mỗi lần gọi lại fork
+iptables / systemctl và đọc lại nhật ký cảnh báo: 10 người xem = 10 lần probe.
+StatusBroadcaster chỉ có MỘT thread producer:
+- mỗi `interval` giây gọi probe() một lần -> (bộ đếm, cảnh báo mới), so với
+  trạng thái trước và chỉ phát phần thay đổi (event 'delta');
+- sự kiện được mã hóa thành bytes một lần rồi dùng chung cho mọi subscriber
+  (log vòng `backlog` sự kiện + Condition), subscriber chỉ đọc phần sau seq của mình;
+- subscriber mới (hoặc tụt quá xa sau log) nhận một event 'snapshot' đầy đủ;
+  reconnect kèm Last-Event-ID còn trong log thì chỉ nhận phần còn thiếu;
+- không có subscriber nào thì producer ngủ, không probe;
+- 'ping' mỗi `keepalive` giây để giữ kết nối và phát hiện client đã đóng.
+
+    python3 sse_broadcast.py [giây mỗi lượt]   # load test: CPU / số probe theo số subscriber
+"""
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+DEFAULT_INTERVAL = 2.0
+DEFAULT_BACKLOG = 256
+DEFAULT_KEEPALIVE = 15.0
+ALERT_LIMIT = 20  # Số cảnh báo giữ trong snapshot (bảng trên dashboard)
+
+
+def encode(event, seq, payload):
+    """Một sự kiện SSE dạng bytes: id / event / data"""
+    data = json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+    return f'id: {seq}\nevent: {event}\ndata: {data}\n\n'.encode('utf-8')
+
+
+class StatusBroadcaster:
+    def __init__(self, probe, interval=DEFAULT_INTERVAL, backlog=DEFAULT_BACKLOG,
+                 keepalive=DEFAULT_KEEPALIVE):
+        self.probe = probe  # () -> ({tên: giá trị}, [cảnh báo mới, mới nhất trước])
+        self.interval = interval
+        self.keepalive = keepalive
+        self.cond = threading.Condition()
+        self.events = deque(maxlen=backlog)  # [(seq, bytes)]
+        self.seq = 0
+        self.counters = {}
+        self.alerts = deque(maxlen=ALERT_LIMIT)
+        self.updated_at = 0.0
+        self.subscribers = 0
+        self.probes = 0
+        self.running = False
+        self.thread = None
+        self.wakeup = threading.Event()
+
+    # --- Producer ---
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self._loop, name='sse-producer', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        with self.cond:
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def poke(self):
+        """Probe ngay (sau khi chặn / gỡ chặn / đổi config) thay vì chờ hết interval"""
+        self.wakeup.set()
+
+    def _loop(self):
+        last_publish = 0.0
+        while self.running:
+            with self.cond:
+                # Không ai xem thì không probe
+                self.cond.wait_for(lambda: self.subscribers or not self.running)
+            if not self.running:
+                break
+            try:
+                changed = self.tick()
+            except Exception as e:
+                logging.error(f"Lỗi probe trạng thái dashboard: {e}")
+                changed = False
+            now = time.time()
+            if changed:
+                last_publish = now
+            elif now - last_publish >= self.keepalive:
+                self.publish('ping', {'updated_at': self.updated_at})
+                last_publish = now
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def tick(self):
+        """Một lần probe; phát event 'delta' nếu có thay đổi. True nếu đã phát."""
+        counters, new_alerts = self.probe()
+        self.probes += 1
+        self.updated_at = time.time()
+        delta = {k: v for k, v in counters.items() if self.counters.get(k) != v}
+        if not delta and not new_alerts:
+            return False
+        with self.cond:
+            # Cập nhật trạng thái và ghi delta trong cùng một lần giữ khóa: subscriber mới
+            # nhận snapshot hoặc trước cả hai (rồi nhận delta) hoặc sau cả hai, không trùng cảnh báo
+            self.counters.update(delta)
+            # new_alerts: mới nhất trước, giống /api/status
+            self.alerts.extendleft(reversed(new_alerts[:ALERT_LIMIT]))
+            self._append('delta', {'counters': delta, 'alerts': new_alerts[:ALERT_LIMIT],
+                                   'updated_at': self.updated_at})
+        return True
+
+    def publish(self, event, payload):
+        with self.cond:
+            self._append(event, payload)
+
+    def _append(self, event, payload):
+        # Gọi khi đang giữ cond
+        self.seq += 1
+        self.events.append((self.seq, encode(event, self.seq, payload)))
+        self.cond.notify_all()
+
+    # --- Subscriber ---
+    def _snapshot(self):
+        # Gọi khi đang giữ cond
+        return encode('snapshot', self.seq, {'counters': self.counters, 'alerts': list(self.alerts),
+                                             'updated_at': self.updated_at})
+
+    def _pending(self, seq):
+        """Các bytes cần gửi cho subscriber đang ở `seq` (gọi khi giữ cond)"""
+        if seq is None or not self.events or seq + 1 < self.events[0][0] or seq > self.seq:
+            return [self._snapshot()]
+        return [data for s, data in self.events if s > seq]
+
+    def stream(self, last_event_id=None):
+        """Generator bytes cho một kết nối SSE (Flask Response / HTTP handler)"""
+        try:
+            seq = int(last_event_id)
+        except (TypeError, ValueError):
+            seq = None
+        with self.cond:
+            self.subscribers += 1
+            self.cond.notify_all()
+        self.start()
+        try:
+            if seq is None and not self.probes:
+                # Subscriber đầu tiên: chờ lượt probe đầu để snapshot có dữ liệu
+                with self.cond:
+                    self.cond.wait_for(lambda: self.seq or not self.running, timeout=self.interval + 5)
+            yield b'retry: 3000\n\n'
+            while self.running:
+                with self.cond:
+                    if seq == self.seq:
+                        self.cond.wait_for(lambda: self.seq != seq or not self.running, timeout=self.keepalive)
+                    if seq == self.seq:
+                        continue
+                    chunks = self._pending(seq)
+                    seq = self.seq
+                yield b''.join(chunks)
+        finally:
+            with self.cond:
+                self.subscribers -= 1
+
+
+# === LOAD TEST ===
+def _fake_probe(state):
+    """Probe giả lập chi phí thật: một tiến trình con mỗi lần gọi (như iptables / systemctl)"""
+    import subprocess
+
+    def probe():
+        subprocess.run(['true'])
+        state['n'] += 1
+        alerts = []
+        if state['n'] % 2 == 0:
+            alerts.append({'timestamp': time.time(), 'ip': f"203.0.113.{state['n'] % 250}",
+                           'action': 'BLOCKED', 'reason': 'SYN Flood (Z-Score: 9.1)'})
+        return {'blocked_count': state['n'] // 2, 'service_status': 'ACTIVE'}, alerts
+    return probe
+
+
+def _clients(port, count, seconds, path, poll):
+    """Tiến trình con: `count` client SSE (hoặc polling) đọc trong `seconds` giây"""
+    import selectors
+    import socket
+    sel = selectors.DefaultSelector()
+    request = f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n'.encode()
+    received = 0
+    deadline = time.time() + seconds
+    next_poll = {}
+
+    def connect(i):
+        s = socket.create_connection(('127.0.0.1', port))
+        s.sendall(request)
+        s.setblocking(False)
+        sel.register(s, selectors.EVENT_READ, i)
+
+    for i in range(count):
+        connect(i)
+        next_poll[i] = time.time() + poll if poll else None
+    while time.time() < deadline:
+        for key, _ in sel.select(timeout=0.1):
+            try:
+                data = key.fileobj.recv(65536)
+            except OSError:
+                data = b''
+            received += len(data)
+            if not data:
+                sel.unregister(key.fileobj)
+                key.fileobj.close()
+                if poll:
+                    next_poll[key.data] = time.time() + poll
+        if poll:
+            now = time.time()
+            for i, due in list(next_poll.items()):
+                if due and now >= due:
+                    next_poll[i] = None
+                    connect(i)
+    return received
+
+
+def benchmark(seconds=5.0, interval=0.5, counts=(1, 10, 50, 200)):
+    """So sánh CPU phía server và số lần probe: SSE (producer chung) vs polling mỗi client"""
+    import multiprocessing
+    import resource
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    state = {'n': 0}
+    probe = _fake_probe(state)
+    broadcaster = StatusBroadcaster(probe, interval=interval, keepalive=5.0)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.0'
+
+        def do_GET(self):
+            self.send_response(200)
+            if self.path == '/stream':
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                try:
+                    for chunk in broadcaster.stream():
+                        self.wfile.write(chunk)
+                        self.wfile.flush()
+                except OSError:
+                    pass
+            else:
+                counters, alerts = probe()
+                body = json.dumps({**counters, 'alerts': alerts}).encode()
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except OSError:
+                    pass
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        request_queue_size = 1024  # 200 client kết nối cùng lúc
+
+    server = Server(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    ctx = multiprocessing.get_context('fork')
+
+    def cpu():
+        # CPU của tiến trình server + các tiến trình con của probe (fork)
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        kids = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return own.ru_utime + own.ru_stime + kids.ru_utime + kids.ru_stime
+
+    print(f"{'chế độ':8s} {'client':>6s} {'probe':>7s} {'CPU server':>11s} {'CPU/s':>7s} {'bytes nhận':>11s}")
+    for mode, path, poll in (('sse', '/stream', 0), ('polling', '/status', interval)):
+        for count in counts:
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=lambda: child.send(_clients(port, count, seconds, path, poll)))
+            before_probes, before_cpu = state['n'], cpu()
+            proc.start()
+            received = parent.recv()
+            # Đo trước join(): CPU của chính tiến trình client không tính vào server
+            probes, used = state['n'] - before_probes, cpu() - before_cpu
+            proc.join()
+            # Chờ server thấy các kết nối đã đóng (producer ngủ lại khi hết subscriber)
+            deadline = time.time() + broadcaster.keepalive * 2
+            while broadcaster.subscribers and time.time() < deadline:
+                time.sleep(0.1)
+            print(f"{mode:8s} {count:6d} {probes:7d} {used:10.3f}s {used / seconds * 100:6.1f}% {received:11d}")
+    broadcaster.stop()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    import sys
+    benchmark(*(float(a) for a in sys.argv[1:2]))
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Lưu / khôi phục trạng thái DosDetector để khởi động lại nhanh ("warm restart").
+
+Trước đây khi khởi động, detector đọc lại danh sách IP bị chặn từ kernel và đặt
+lại thời điểm chặn = bây giờ (mọi lệnh chặn bị kéo dài, mất lý do chặn), còn lịch
+sử Z-Score mất hết nên detector "mù" trong MIN_SAMPLES chu kỳ đầu.
+
+Snapshot gồm: thời điểm hết hạn + lý do của từng lệnh chặn, bảng tái phạm của
+BanScheduler và lịch sử số đếm của 4 bộ Z-Score (SYN, kết nối, UDP, gói tin).
+Snapshot cũ chưa có pkt_history vẫn nạp được, bộ đó bắt đầu trống. File nhị phân gọn:
+
+    MAGIC | độ dài header (uint32) | header JSON | các blob liền nhau
+
+Mỗi blob là một mảng (int32 / float64), danh sách chuỗi nối bằng '\\n' hoặc danh
+sách khóa IP 16 byte (khóa int của ipaddr, dùng cho lịch sử Z-Score), kèm CRC32
+trong header. File định dạng cũ (MAGIC ...\\x01, khóa lịch sử dạng chuỗi IPv4)
+vẫn đọc được. File được ghi ra file tạm, fsync rồi os.replace nên không bao
+giờ có snapshot ghi dở.
+
+Khi khởi động, snapshot được đối chiếu với kernel (backend.list_banned()):
+- còn hạn, kernel vẫn chặn   -> giữ nguyên hạn và lý do
+- còn hạn, kernel đã mất     -> chặn lại với thời gian còn lại (ví dụ sau reboot)
+- đã hết hạn, kernel vẫn chặn -> gỡ chặn ở lần flush đầu tiên
+- kernel chặn, snapshot không có -> nhận lại như sync_blocked_ips_from_system
+
+Dùng:
+    python3 state_store.py bench [200000]     # đo thời gian lưu / nạp
+    python3 state_store.py show [file]        # xem tóm tắt một snapshot
+"""
+import json
+import os
+import struct
+import time
+import zlib
+import logging
+from array import array
+
+import ipaddr
+from ban_backend import Ban
+
+STATE_FILE = '/var/lib/firewall_auto_block/state.bin'
+MAGIC = b'FWSTATE\x02'
+MAGIC_V1 = b'FWSTATE\x01'
+HISTORIES = ('syn_history', 'conn_history', 'udp_history', 'pkt_history')
+
+
+def _strings(items):
+    return ''.join(f"{item}\n" for item in items).encode('utf-8')
+
+
+def _split(blob):
+    return blob.decode('utf-8').split('\n')[:-1]
+
+
+def _keys(keys):
+    return b''.join(key.to_bytes(16, 'big') for key in keys)
+
+
+def _unkeys(blob):
+    from_bytes = int.from_bytes
+    return [from_bytes(blob[i:i + 16], 'big') for i in range(0, len(blob), 16)]
+
+
+def _floats(values):
+    return array('d', values).tobytes()
+
+
+def _array(code, blob):
+    a = array(code)
+    a.frombytes(blob)
+    return a
+
+
+# --- Định dạng file ---
+def pack(meta, blobs):
+    header = dict(meta, blobs=[[name, len(b), zlib.crc32(b)] for name, b in blobs])
+    header = json.dumps(header).encode('utf-8')
+    return b''.join([MAGIC, struct.pack('<I', len(header)), header] + [b for _, b in blobs])
+
+
+def unpack(data):
+    """Trả về (meta, {tên blob: bytes}), ValueError nếu file hỏng"""
+    if data.startswith(MAGIC):
+        version = 2
+    elif data.startswith(MAGIC_V1):
+        version = 1
+    else:
+        raise ValueError("không phải file trạng thái")
+    start = len(MAGIC) + 4
+    (size,) = struct.unpack_from('<I', data, len(MAGIC))
+    meta = json.loads(data[start:start + size].decode('utf-8'))
+    meta['version'] = version
+    offset = start + size
+    blobs = {}
+    for name, length, crc in meta.pop('blobs'):
+        blob = data[offset:offset + length]
+        if len(blob) != length or zlib.crc32(blob) != crc:
+            raise ValueError(f"blob {name} hỏng")
+        blobs[name] = blob
+        offset += length
+    return meta, blobs
+
+
+def write_atomic(path, data):
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# --- Snapshot ---
+def snapshot(detector, now=None):
+    """Đóng gói trạng thái detector thành bytes (chạy trên thread của detector)"""
+    now = time.time() if now is None else now
+    scheduler = detector.ban_scheduler
+    bans = list(detector.banned_ips)
+    blobs = [
+        ('bans.keys', _strings(bans)),
+        ('bans.banned_at', _floats(detector.banned_ips[ip] for ip in bans)),
+        # 0 = chặn vĩnh viễn
+        ('bans.expires', _floats(scheduler.expires.get(ip, 0.0) for ip in bans)),
+        ('bans.reasons', _strings(detector.ban_reasons.get(ip, '').replace('\n', ' ') for ip in bans)),
+    ]
+    offenders = list(scheduler.offenses)
+    blobs += [
+        ('offenses.keys', _strings(offenders)),
+        ('offenses.count', array('i', (scheduler.offenses[ip][0] for ip in offenders)).tobytes()),
+        ('offenses.last', _floats(scheduler.offenses[ip][1] for ip in offenders)),
+    ]
+    meta = {'saved_at': now, 'history_len': {}}
+    for name in HISTORIES:
+        state = getattr(detector, name).export_state()
+        meta['history_len'][name] = state['history_len']
+        blobs.append((f'{name}.keys', _keys(state['keys'])))
+        blobs += [(f'{name}.{field}', state[field]) for field in ('data', 'n', 'pos', 'last_seen')]
+    return pack(meta, blobs)
+
+
+def save(detector, path=STATE_FILE):
+    write_atomic(path, snapshot(detector))
+
+
+def load(path=STATE_FILE):
+    """Đọc snapshot, trả về (meta, blobs) hoặc None nếu chưa có / hỏng"""
+    try:
+        with open(path, 'rb') as f:
+            return unpack(f.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.error(f"Bỏ qua file trạng thái {path}: {e}")
+        return None
+
+
+def restore(detector, state, live, now=None):
+    """Nạp snapshot vào detector và đối chiếu với kernel.
+    live: {ip: timeout còn lại hoặc None} từ backend.list_banned().
+    Trả về dict thống kê số IP theo từng trường hợp."""
+    now = time.time() if now is None else now
+    meta, blobs = state
+    scheduler = detector.ban_scheduler
+    ban_time = int(detector.config.get('ban_time', 300))
+    stats = {'kept': 0, 'reapplied': 0, 'expired': 0, 'adopted': 0, 'history': 0}
+
+    counts = _array('i', blobs['offenses.count'])
+    last = _array('d', blobs['offenses.last'])
+    for ip, count, at in zip(_split(blobs['offenses.keys']), counts, last):
+        if now - at <= scheduler.offense_window:
+            scheduler.offenses[ip] = (count, at)
+
+    banned_at = _array('d', blobs['bans.banned_at'])
+    expires = _array('d', blobs['bans.expires'])
+    saved = set()
+    scheduled = {}
+    for ip, at, until, reason in zip(_split(blobs['bans.keys']), banned_at, expires,
+                                     _split(blobs['bans.reasons'])):
+        saved.add(ip)
+        if until and until <= now:
+            if ip in live:
+                detector.pending_unbans.append(ip)
+            stats['expired'] += 1
+            continue
+        detector.banned_ips[ip] = at
+        detector.ban_reasons[ip] = reason
+        remaining = max(int(until - now), 1) if until else 0
+        if until:
+            scheduled[ip] = until
+        if ip in live:
+            stats['kept'] += 1
+        else:
+            detector.pending_bans.append(Ban(ip, remaining, reason))
+            stats['reapplied'] += 1
+
+    scheduler.load(scheduled)
+
+    for ip, remaining in live.items():
+        if ip in saved or not detector.is_valid_target(ip):
+            continue
+        detector.banned_ips[ip] = now
+        scheduler.schedule(ip, ban_time, now, ttl=ban_time if remaining is None else remaining)
+        stats['adopted'] += 1
+
+    for name in HISTORIES:
+        if name not in meta['history_len']:
+            continue  # Snapshot ghi trước khi có bộ lịch sử này
+        history = getattr(detector, name)
+        state = {'history_len': meta['history_len'][name], 'keys': _history_keys(meta, blobs[f'{name}.keys'])}
+        state.update((field, blobs[f'{name}.{field}']) for field in ('data', 'n', 'pos', 'last_seen'))
+        if history.import_state(state):
+            stats['history'] += history.tracked_keys
+    return stats
+
+
+def _history_keys(meta, blob):
+    if meta.get('version', 1) == 1:
+        # Định dạng cũ: chuỗi IPv4 (collector luôn lọc IP hợp lệ trước khi đếm)
+        return [ipaddr.pack(ip) for ip in _split(blob)]
+    return _unkeys(blob)
+
+
+# === BENCHMARK ===
+def benchmark(n=200000):
+    import shutil
+    import tempfile
+    from types import SimpleNamespace
+    from ban_scheduler import BanScheduler
+    from zscore_engine import create_history
+
+    def fresh():
+        return SimpleNamespace(banned_ips={}, ban_reasons={}, ban_scheduler=BanScheduler(),
+                               pending_bans=[], pending_unbans=[], config={'ban_time': 300},
+                               is_valid_target=lambda ip: True,
+                               **{name: create_history(max_keys=n) for name in HISTORIES})
+
+    now = time.time()
+    detector = fresh()
+    ips = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(n)]
+    keys = [ipaddr.pack(ip) for ip in ips]
+    for cycle in range(20):
+        stats = {key: (i + cycle) % 30 for i, key in enumerate(keys)}
+        for name in HISTORIES:
+            getattr(detector, name).update(stats, now=now - 20 + cycle)
+    for ip in ips[:n // 2]:
+        detector.banned_ips[ip] = now
+        detector.ban_reasons[ip] = 'SYN Flood (HARD LIMIT: 500 > 150)'
+        detector.ban_scheduler.schedule(ip, 300, now)
+
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'state.bin')
+    start = time.perf_counter()
+    save(detector, path)
+    saved = time.perf_counter() - start
+    start = time.perf_counter()
+    restored = fresh()
+    result = restore(restored, load(path), live={ip: 300 for ip in ips[:n // 2]}, now=now)
+    loaded = time.perf_counter() - start
+    print(f"{n // 2} lệnh chặn + {len(HISTORIES)} x {n} IP lịch sử: file {os.path.getsize(path) / 2 ** 20:.1f} MB, "
+          f"lưu {saved * 1000:.0f} ms, nạp + đối chiếu {loaded * 1000:.0f} ms")
+    print(f"  {result}")
+    shutil.rmtree(tmp)
+
+
+def show(path=STATE_FILE):
+    state = load(path)
+    if state is None:
+        print(f"Không đọc được {path}")
+        return
+    meta, blobs = state
+    print(f"Lưu lúc {time.ctime(meta['saved_at'])}")
+    print(f"  {len(_split(blobs['bans.keys']))} lệnh chặn, {len(_split(blobs['offenses.keys']))} IP tái phạm")
+    for name in HISTORIES:
+        if name not in meta['history_len']:
+            continue
+        print(f"  {name}: {len(_history_keys(meta, blobs[f'{name}.keys']))} IP")
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:2] == ['bench']:
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 200000)
+    elif sys.argv[1:2] == ['show']:
+        show(sys.argv[2] if len(sys.argv) > 2 else STATE_FILE)
+    else:
+        print(__doc__)
@@ -5,12 +5,17 @@ import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import matplotlib.dates as mdates
 from datetime import datetime, timedelta
-import json
 import subprocess
 from collections import defaultdict, deque
 import threading
 import time
 import os
+import alert_journal
+from event_store import open_store
+import ipaddr
+
+ALERT_FILE = '/var/log/firewall_alerts.json'
+JOURNAL_SCAN = 2000  # Số bản ghi cuối nhật ký đọc khi không có kho sự kiện
 
 class StatisticsTab:
     def __init__(self, parent):
@@ -18,6 +23,8 @@ class StatisticsTab:
         self.connection_data = deque(maxlen=100)  # Lưu 100 điểm dữ liệu
         self.alert_data = deque(maxlen=50)       # Lưu 50 cảnh báo
         self.ip_connections = defaultdict(int)
+        self.event_store = open_store()
+        self.alerts_per_hour = []
         
         self.setup_matplotlib()
         self.create_widgets()
@@ -113,7 +120,10 @@ class StatisticsTab:
                     # phần địa chỉ thường ở cột 4 hoặc 5 tùy output, cố gắng lấy cột cuối
                     if len(parts) >= 1:
                         ipport = parts[-1]
-                        ip = ipport.split(':')[0]
+                        # 1.2.3.4:80, [2001:db8::1]:443, [::ffff:1.2.3.4]:80
+                        ip = ipport.rpartition(':')[0].strip('[]').partition('%')[0]
+                        if ip.startswith('::ffff:'):
+                            ip = ip[len('::ffff:'):]
                         if self.is_valid_ip(ip):
                             current_ips[ip] += 1
             
@@ -128,31 +138,44 @@ class StatisticsTab:
     def collect_alerts(self):
         """Thu thập cảnh báo từ file log"""
         try:
-            alert_file = '/var/log/firewall_alerts.json'
-            if os.path.exists(alert_file):
-                with open(alert_file, 'r') as f:
-                    try:
-                        alerts = json.load(f)
-                    except json.JSONDecodeError:
-                        alerts = []
+            if self.event_store:
+                # 10 cảnh báo gần nhất và số cảnh báo theo giờ (24h) lấy bằng SQL
+                alerts = list(reversed(self.event_store.recent(10)))
+                self.alerts_per_hour = self.event_store.per_hour(time.time() - 86400)
+            else:
+                # Không mở được kho SQLite: đọc phần cuối nhật ký NDJSON như web_dashboard
+                recent = alert_journal.tail(ALERT_FILE, JOURNAL_SCAN)
+                alerts = list(reversed(recent[:10]))
+                self.alerts_per_hour = self.per_hour_from(recent, time.time() - 86400)
+            for alert in alerts:
+                # chấp nhận alert có 'timestamp','ip','reason' hoặc ko
+                ts = alert.get('timestamp') if isinstance(alert, dict) else None
+                ip = alert.get('ip') if isinstance(alert, dict) else str(alert)
+                reason = alert.get('reason', '') if isinstance(alert, dict) else ''
+                try:
+                    alert_time = datetime.fromtimestamp(int(ts)) if ts else datetime.now()
+                except Exception:
+                    alert_time = datetime.now()
+                alert_text = f"{alert_time.strftime('%Y-%m-%d %H:%M:%S')} - {ip} - {reason}\n"
                 
-                # Chỉ lấy alerts mới (10 gần nhất)
-                for alert in alerts[-10:]:
-                    # chấp nhận alert có 'timestamp','ip','reason' hoặc ko
-                    ts = alert.get('timestamp') if isinstance(alert, dict) else None
-                    ip = alert.get('ip') if isinstance(alert, dict) else str(alert)
-                    reason = alert.get('reason', '') if isinstance(alert, dict) else ''
-                    try:
-                        alert_time = datetime.fromtimestamp(int(ts)) if ts else datetime.now()
-                    except Exception:
-                        alert_time = datetime.now()
-                    alert_text = f"{alert_time.strftime('%Y-%m-%d %H:%M:%S')} - {ip} - {reason}\n"
-                    
-                    if alert_text not in self.alert_data:
-                        self.alert_data.append(alert_text)
+                if alert_text not in self.alert_data:
+                    self.alert_data.append(alert_text)
         except Exception as e:
             print(f"Lỗi thu thập cảnh báo: {e}")
     
+    @staticmethod
+    def per_hour_from(alerts, since):
+        """[(timestamp đầu giờ, số cảnh báo)] như event_store.per_hour, đếm trên danh sách cảnh báo"""
+        counts = defaultdict(int)
+        for alert in alerts:
+            try:
+                ts = float(alert.get('timestamp'))
+            except (AttributeError, TypeError, ValueError):
+                continue
+            if ts >= since:
+                counts[int(ts) // 3600 * 3600] += 1
+        return sorted(counts.items())
+    
     def update_displays(self):
         """Cập nhật hiển thị"""
         self.update_charts()
@@ -195,9 +218,12 @@ class StatisticsTab:
             self.ax3.set_xticklabels(ips, rotation=45)
             self.ax3.set_title('Top 5 IP Nhiều Kết Nối Nhất')
         
-        # Biểu đồ 4: Số lượng cảnh báo (giả lập)
-        hours = [f'{i:02d}:00' for i in range(24)]
-        alert_counts = [max(0, len(self.alert_data) // 24 + (i % 3)) for i in range(24)]
+        # Biểu đồ 4: Số lượng cảnh báo theo giờ trong 24h qua
+        per_hour = dict(self.alerts_per_hour)
+        current_hour = int(time.time()) // 3600 * 3600
+        slots = [current_hour - 3600 * i for i in range(23, -1, -1)]
+        hours = [datetime.fromtimestamp(h).strftime('%H:00') for h in slots]
+        alert_counts = [per_hour.get(h, 0) for h in slots]
         self.ax4.bar(hours, alert_counts, alpha=0.7)
         self.ax4.set_title('Cảnh Báo Theo Giờ')
         self.ax4.tick_params(axis='x', rotation=45)
@@ -266,11 +292,5 @@ class StatisticsTab:
             messagebox.showerror("Lỗi", f"Không thể xuất báo cáo: {e}")
     
     def is_valid_ip(self, ip):
-        """Kiểm tra IP hợp lệ"""
-        parts = ip.split('.')
-        if len(parts) != 4:
-            return False
-        try:
-            return all(0 <= int(part) <= 255 for part in parts)
-        except ValueError:
-            return False
+        """Kiểm tra IP hợp lệ (IPv4 hoặc IPv6)"""
+        return bool(ip) and ipaddr.is_valid(ip)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Gộp số đếm theo subnet để phát hiện flood phân tán và chặn cả dải CIDR.
+
+Botnet trải trên vài /24 có thể giữ mỗi IP dưới syn_threshold nên không bao giờ
+bị chặn theo từng IP; khi bị chặn thì mỗi host tốn một rule. SubnetAggregator
+cộng dồn số đếm từng IP lên /24, rồi từ bảng /24 lên các mức rộng hơn (mặc định
+/16) và lên nhóm ASN (theo file prefix -> ASN). Mỗi mức có lịch sử Z-Score riêng
+và ngưỡng = ngưỡng theo IP x hệ số của mức đó.
+
+IPv6 đi theo cùng cách với bảng gốc là /64 (một máy / một mạng LAN thường có cả
+một /64 nên chặn từng địa chỉ vô nghĩa) và các mức rộng hơn theo
+subnet_levels_v6 (mặc định /48). Khóa và prefix đều ở dạng 128 bit của ipaddr.
+
+Thứ tự xét: /24, ASN (chỉ chặn đúng các prefix của ASN), rồi các mức rộng hơn;
+/24 đã bị chặn ở bước trước được trừ ra khỏi các bước sau nên một /24 ồn ào không
+kéo theo cả /16. Một bucket chỉ được xét khi có ít nhất
+min_sources IP nguồn (tấn công từ một IP đã có lệnh chặn theo IP).
+
+File ASN (mặc định /etc/firewall_asn_prefixes.txt), mỗi dòng: "CIDR ASN", ví dụ
+    203.0.113.0/24 AS64500
+    2001:db8::/32 AS64500
+
+Dùng:
+    python3 subnet_aggregator.py bench      # replay trace botnet giả lập
+"""
+import logging
+import os
+from collections import defaultdict
+
+from ipaddr import V4_PREFIX, pack, parse_cidr, format_cidr
+from prefix_table import PrefixTable
+from zscore_engine import create_history
+
+ASN_FILE = '/etc/firewall_asn_prefixes.txt'
+DEFAULT_LEVELS = [24, 16, 'asn']
+DEFAULT_LEVELS_V6 = [64, 48]
+DEFAULT_MULTIPLIERS = {'24': 4, '16': 16, 'asn': 32}
+DEFAULT_MULTIPLIERS_V6 = {'64': 4, '48': 16}
+
+
+def load_asn_table(path=ASN_FILE):
+    """Đọc file 'CIDR ASN' -> (PrefixTable 128 bit network -> ASN, {ASN: [(network, plen)]})"""
+    table = PrefixTable(128)
+    prefixes = defaultdict(list)
+    with open(path, 'r') as f:
+        for line in f:
+            parts = line.split('#')[0].split()
+            if len(parts) < 2:
+                continue
+            try:
+                network, plen = parse_cidr(parts[0])
+            except ValueError:
+                continue
+            table.add(network, plen, parts[1])
+            prefixes[parts[1]].append((network, plen))
+    return table, dict(prefixes)
+
+
+def rollup(stats):
+    """{khóa ipaddr: count} -> ({/24: [tổng count, số IP nguồn]}, {/64: [...]}).
+    Khóa bucket là địa chỉ dịch phải (khóa >> 8 với IPv4, >> 64 với IPv6)."""
+    v4, v6 = {}, {}
+    for key, count in stats.items():
+        if key >> 32 == 0xffff:
+            buckets, key = v4, key >> 8
+        else:
+            buckets, key = v6, key >> 64
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = [count, 1]
+        else:
+            bucket[0] += count
+            bucket[1] += 1
+    return v4, v6
+
+
+class SubnetAggregator:
+    def __init__(self, levels=None, multipliers=None, min_sources=8, asn_table=None,
+                 asn_prefixes=None, history_len=20, min_samples=5, max_keys=50000,
+                 levels_v6=None, multipliers_v6=None):
+        levels = DEFAULT_LEVELS if levels is None else levels
+        levels_v6 = DEFAULT_LEVELS_V6 if levels_v6 is None else levels_v6
+        # Các mức số từ hẹp đến rộng (độ dài prefix của từng họ), luôn bắt đầu từ bảng gốc
+        self.levels = self._numeric(levels, 24)
+        self.levels_v6 = self._numeric(levels_v6, 64)
+        self.use_asn = 'asn' in levels and asn_table is not None
+        self.multipliers = dict(DEFAULT_MULTIPLIERS, **(multipliers or {}))
+        self.multipliers_v6 = dict(DEFAULT_MULTIPLIERS_V6, **(multipliers_v6 or {}))
+        self.min_sources = min_sources
+        self.asn_table = asn_table
+        self.asn_prefixes = asn_prefixes or {}
+        self.asn_cache = ({}, {})  # bucket gốc -> ASN, theo họ (prefix ASN hiếm khi dài hơn /24, /64)
+        self.history_args = (history_len, min_samples, max_keys)
+        self.histories = {}
+
+    @staticmethod
+    def _numeric(levels, base):
+        levels = sorted((int(l) for l in levels if l != 'asn' and int(l) <= base), reverse=True)
+        if base not in levels and levels:
+            levels.insert(0, base)
+        return levels
+
+    def history(self, attack_name, level):
+        key = (attack_name, level)
+        if key not in self.histories:
+            self.histories[key] = create_history(*self.history_args)
+        return self.histories[key]
+
+    def asn_of(self, key, shift, v6=False):
+        cache = self.asn_cache[v6]
+        asn = cache.get(key, False)
+        if asn is False:
+            if len(cache) > 1000000:
+                cache.clear()
+            asn = cache[key] = self.asn_table.lookup(key << shift)
+        return asn
+
+    def order(self, v6=False):
+        """Thứ tự xét: /24 (/64), ASN (chỉ chặn đúng prefix của ASN), rồi các mức rộng hơn"""
+        numeric = self.levels_v6 if v6 else self.levels
+        levels = list(numeric[:1])
+        if self.use_asn:
+            levels.append('asn')
+        return levels + numeric[1:]
+
+    def analyze(self, stats, threshold, attack_name, decide, skip=None, now=None):
+        """Trả về [(danh sách (network, plen) 128 bit, nhãn, lý do)] cần chặn.
+        decide(count, z, ngưỡng của mức, tên) -> lý do hoặc None (cùng luật với chặn theo IP).
+        skip(network, plen) -> True nếu prefix phải bỏ qua (đã bị chặn / thuộc whitelist)."""
+        v4, v6 = rollup(stats)
+        bans = []
+        if v4 and (self.levels or self.use_asn):
+            bans += self._analyze_family(v4, False, threshold, attack_name, decide, skip, now)
+        if v6 and self.levels_v6:
+            bans += self._analyze_family(v6, True, threshold, attack_name, decide, skip, now)
+        return bans
+
+    def _analyze_family(self, base, v6, threshold, attack_name, decide, skip, now):
+        # Độ dài prefix 128 bit của bảng gốc và độ lệch giữa độ dài của họ và 128 bit
+        offset = 0 if v6 else V4_PREFIX
+        base_plen = offset + (64 if v6 else 24)
+        shift = 128 - base_plen
+        bans = []
+        # Bucket gốc đã bị chặn từ trước / thuộc whitelist, hoặc vừa bị chặn ở mức hẹp hơn
+        banned = {key for key in base if skip(key << shift, base_plen)} if skip else set()
+        for level in self.order(v6):
+            if level == 'asn':
+                key_of = lambda key: self.asn_of(key, shift, v6)
+                targets_of = lambda asn: [t for t in self.asn_prefixes.get(asn, [])
+                                          if (t[1] >= V4_PREFIX and t[0] >> 32 == 0xffff) != v6]
+            else:
+                plen = offset + level
+                key_of = lambda key, d=base_plen - plen: key >> d
+                targets_of = lambda key, plen=plen: [(key << (128 - plen), plen)]
+            buckets = {}
+            for base_key, (count, sources) in base.items():
+                if base_key in banned:
+                    continue
+                key = key_of(base_key)
+                if key is None:
+                    continue
+                bucket = buckets.get(key)
+                if bucket is None:
+                    buckets[key] = [count, sources]
+                else:
+                    bucket[0] += count
+                    bucket[1] += sources
+            for key, reason in self._evaluate(buckets, level, v6, threshold, attack_name, decide, now):
+                # Bỏ các prefix thuộc whitelist / đã bị chặn, chặn phần còn lại
+                targets = [t for t in targets_of(key) if not (skip and skip(*t))]
+                if not targets:
+                    continue
+                bans.append((targets, key if level == 'asn' else format_cidr(*targets[0]), reason))
+                banned.update(k for k in base if k not in banned and key_of(k) == key)
+        return bans
+
+    def _evaluate(self, buckets, level, v6, threshold, attack_name, decide, now):
+        multipliers = self.multipliers_v6 if v6 and level != 'asn' else self.multipliers
+        level_threshold = threshold * float(multipliers.get(str(level), 1))
+        counts = {key: count for key, (count, sources) in buckets.items() if sources >= self.min_sources}
+        chosen = []
+        # Lịch sử riêng cho từng họ: /16 IPv4 và /16 IPv6 là hai mức khác nhau
+        history_level = ('v6', level) if v6 else level
+        for key, count, z in self.history(attack_name, history_level).update(counts, level_threshold, now=now):
+            name = f"{attack_name} {key}" if level == 'asn' else f"{attack_name} /{level}"
+            reason = decide(count, z, level_threshold, name)
+            if reason:
+                chosen.append((key, f"{reason}, {buckets[key][1]} nguồn"))
+        return chosen
+
+
+def create_aggregator(config):
+    """SubnetAggregator theo config, None nếu tắt (subnet_levels và subnet_levels_v6 rỗng)"""
+    levels = config.get('subnet_levels', DEFAULT_LEVELS)
+    levels_v6 = config.get('subnet_levels_v6', DEFAULT_LEVELS_V6)
+    if not levels and not levels_v6:
+        return None
+    asn_table = asn_prefixes = None
+    path = config.get('asn_prefix_file', ASN_FILE)
+    if 'asn' in levels and path and os.path.exists(path):
+        try:
+            asn_table, asn_prefixes = load_asn_table(path)
+        except Exception as e:
+            logging.error(f"Lỗi đọc file ASN {path}: {e}")
+    return SubnetAggregator(levels, config.get('subnet_multipliers'), int(config.get('subnet_min_sources', 8)),
+                            asn_table, asn_prefixes, max_keys=int(config.get('history_max_ips', 200000)),
+                            levels_v6=levels_v6, multipliers_v6=config.get('subnet_multipliers_v6'))
+
+
+# === REPLAY TRACE BOTNET ===
+def write_botnet_trace(path, cycles=12, background=20000, seed=1):
+    """Trace 'chu_kỳ ip số_SYN': nền ngẫu nhiên, chu kỳ cuối có botnet dưới ngưỡng theo IP:
+    8 /24 x 40 host, một /16 rải 64 /24 x 3 host, ASN 64500 gồm 32 /24 x 2 host
+    (host của ASN có lưu lượng nhẹ từ trước nên mức ASN có lịch sử Z-Score),
+    IPv6: 8 /64 x 20 địa chỉ"""
+    import random
+    rng = random.Random(seed)
+    legit = [f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}"
+             for _ in range(background)]
+    bots = [f"45.{10 + s}.7.{h}" for s in range(8) for h in range(1, 41)]
+    bots += [f"91.200.{s}.{h}" for s in range(64) for h in range(1, 4)]
+    asn_hosts = [f"100.{64 + s // 16}.{(s % 16) * 4}.{h}" for s in range(32) for h in range(1, 3)]
+    bots += asn_hosts
+    bots += [f"2001:db8:bad:{s:x}::{h:x}" for s in range(8) for h in range(1, 21)]
+    with open(path, 'w') as f:
+        for cycle in range(cycles):
+            for ip in legit:
+                f.write(f"{cycle} {ip} {rng.randint(0, 3)}\n")
+            if cycle < cycles - 1:
+                for ip in asn_hosts:
+                    f.write(f"{cycle} {ip} {rng.randint(1, 5)}\n")
+            else:
+                for ip in bots:
+                    f.write(f"{cycle} {ip} 40\n")  # < syn_threshold (50)
+    return len(bots)
+
+
+def write_asn_fixture(path):
+    with open(path, 'w') as f:
+        for s in range(32):
+            f.write(f"100.{64 + s // 16}.{(s % 16) * 4}.0/24 AS64500\n")
+
+
+def read_trace(path):
+    cycles = defaultdict(dict)
+    with open(path) as f:
+        for line in f:
+            cycle, ip, count = line.split()
+            cycles[int(cycle)][pack(ip)] = int(count)
+    return [cycles[c] for c in sorted(cycles)]
+
+
+def benchmark(threshold=50):
+    import shutil
+    import tempfile
+    import time
+    tmp = tempfile.mkdtemp()
+    trace, asn_file = os.path.join(tmp, 'botnet.txt'), os.path.join(tmp, 'asn.txt')
+    n_bots = write_botnet_trace(trace)
+    write_asn_fixture(asn_file)
+    rounds = read_trace(trace)
+
+    def decide(count, z, limit, name):
+        # Cùng luật với DosDetector.decide: HARD LIMIT (x3) hoặc vượt ngưỡng + Z > 3
+        if count > limit * 3:
+            return f"{name} (HARD LIMIT: {count} > {limit * 3:.0f})"
+        if count > limit and z > 3.0:
+            return f"{name} (Z-Score: {count} > {limit:.0f}, Z={z:.2f})"
+        return None
+
+    host = create_history()
+    agg = create_aggregator({'asn_prefix_file': asn_file})
+    elapsed = 0.0
+    host_bans, net_bans = [], []
+    for now, stats in enumerate(rounds):
+        host_bans = [ip for ip, count, z in host.update(stats, threshold, now=now) if decide(count, z, threshold, '')]
+        start = time.perf_counter()
+        net_bans = agg.analyze(stats, threshold, 'SYN Flood', decide, now=now)
+        elapsed += time.perf_counter() - start
+    table = PrefixTable(128)
+    for targets, _, _ in net_bans:
+        for net, plen in targets:
+            table.add(net, plen)
+    covered = sum(1 for key in rounds[-1] if key in table)
+    rules = sum(len(targets) for targets, _, _ in net_bans)
+    print(f"Trace: {len(rounds)} chu kỳ, {len(rounds[-1])} IP ở chu kỳ cuối, {n_bots} bot (mỗi bot 40 SYN < {threshold})")
+    print(f"  Chỉ theo IP : {len(host_bans)} IP bị chặn")
+    print(f"  Gộp subnet  : {len(net_bans)} lệnh chặn ({rules} rule CIDR) phủ {covered} IP, "
+          f"{elapsed / len(rounds) * 1000:.1f} ms/chu kỳ")
+    for targets, label, reason in net_bans:
+        print(f"    {label:22s} {len(targets):3d} prefix  {reason}")
+    shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:2] == ['bench']:
+        benchmark()
+    else:
+        print(__doc__)
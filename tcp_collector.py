@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Các bộ thu thập trạng thái TCP (SYN_RECV / ESTABLISHED) theo IP nguồn.
+
+- NetlinkCollector: đọc trực tiếp từ kernel qua NETLINK_SOCK_DIAG (inet_diag),
+  dữ liệu nhị phân, không phải parse text.
+- ProcNetCollector: đọc /proc/net/tcp và /proc/net/tcp6 (dự phòng), hoặc
+  file fixture cùng định dạng để test / benchmark.
+- SsCollector: cách cũ, gọi lệnh `ss` và parse từng dòng.
+
+Mọi collector có chung hàm collect(whitelist) -> (syn_stats, conn_stats), khóa
+là địa chỉ dạng int của ipaddr (IPv4 và IPv6 trong cùng một bảng). whitelist là
+bất kỳ đối tượng nào hỗ trợ `key in whitelist` (thường là
+whitelist.WhitelistMatcher, chấp nhận cả dải CIDR).
+
+Sau mỗi lần collect, collector.syn_ports = {cổng local: số socket SYN_RECV}
+(cổng đích bị nhắm tới, dùng cho entropy cổng của distribution_metrics).
+
+collect_sketch(syn_sketch, conn_sketch) (counting_mode = "sketch") nạp số đếm vào
+hai sketch.HeavyHitterSketch theo từng lô (mỗi buffer netlink / mỗi khối dòng
+của /proc), nên bộ nhớ không tăng theo số IP nguồn khác nhau.
+"""
+import socket
+import struct
+import subprocess
+import logging
+import time
+from collections import defaultdict
+
+from ipaddr import V4_BASE, try_pack
+
+# --- HẰNG SỐ NETLINK (linux/netlink.h, linux/sock_diag.h, linux/inet_diag.h) ---
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+TCP_ESTABLISHED = 1
+TCP_SYN_RECV = 3
+
+_NLMSG_HDR = struct.Struct('=IHHII')
+# inet_diag_req_v2: family, protocol, ext, pad, states, inet_diag_sockid (48 byte = 0)
+_DIAG_REQ = struct.Struct('=BBBxI48x')
+# Vị trí trong inet_diag_msg: state ở byte 1, cổng local ở byte 4..6, địa chỉ đích (peer) ở byte 24..40
+_MSG_STATE = 1
+_MSG_SPORT = 4
+_MSG_DST = 24
+_V4_MAPPED = b'\x00' * 10 + b'\xff\xff'
+_PROC_V6 = struct.Struct('<4I')
+
+# Trạng thái trong /proc/net/tcp (hex)
+_PROC_SYN_RECV = '03'
+_PROC_ESTABLISHED = '01'
+_PROC_CHUNK = 1 << 20  # Số byte mỗi khối dòng /proc ở chế độ sketch
+
+
+def _filter(stats, whitelist):
+    """Bỏ các IP thuộc whitelist (chỉ duyệt các IP duy nhất, không duyệt từng socket)"""
+    for ip in [ip for ip in stats if ip in whitelist]:
+        del stats[ip]
+    return stats
+
+
+class TcpCollector:
+    name = 'base'
+    syn_ports = {}
+
+    def collect(self, whitelist):
+        """Trả về (syn_stats, conn_stats): dict {khóa ipaddr: số socket}"""
+        raise NotImplementedError
+
+    def collect_sketch(self, syn_sketch, conn_sketch):
+        """Đếm vào hai HeavyHitterSketch (whitelist lọc ở top()). Mặc định đếm chính xác
+        rồi nạp một lần; netlink / proc ghi đè để nạp theo lô."""
+        syn_stats, conn_stats = self.collect(())
+        syn_sketch.update(syn_stats)
+        conn_sketch.update(conn_stats)
+
+
+class NetlinkCollector(TcpCollector):
+    """Đếm socket theo peer qua NETLINK_INET_DIAG trong một lượt duyệt"""
+    name = 'netlink'
+
+    def __init__(self, bufsize=1 << 20):
+        self.bufsize = bufsize
+        self.states = (1 << TCP_SYN_RECV) | (1 << TCP_ESTABLISHED)
+
+    def _dump(self, family, syn_raw, conn_raw, syn_ports, on_buffer=None):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_SOCK_DIAG)
+        try:
+            req = _DIAG_REQ.pack(family, socket.IPPROTO_TCP, 0, self.states)
+            hdr = _NLMSG_HDR.pack(_NLMSG_HDR.size + len(req), SOCK_DIAG_BY_FAMILY,
+                                  NLM_F_REQUEST | NLM_F_DUMP, 1, 0)
+            sock.send(hdr + req)
+            buf = bytearray(self.bufsize)
+            unpack_hdr = _NLMSG_HDR.unpack_from
+            v4 = family == socket.AF_INET
+            while True:
+                n = sock.recv_into(buf)
+                off = 0
+                while off + 16 <= n:
+                    length, msg_type = unpack_hdr(buf, off)[:2]
+                    if msg_type == NLMSG_DONE:
+                        return
+                    if msg_type == NLMSG_ERROR:
+                        errno = -struct.unpack_from('=i', buf, off + 16)[0]
+                        raise OSError(errno, 'inet_diag dump lỗi')
+                    msg = off + 16
+                    dst = msg + _MSG_DST
+                    if v4:
+                        key = bytes(buf[dst:dst + 4])
+                    else:
+                        key = bytes(buf[dst:dst + 16])
+                        if key[:12] == _V4_MAPPED:
+                            key = key[12:]  # ::ffff:a.b.c.d đếm chung với a.b.c.d
+                    if buf[msg + _MSG_STATE] == TCP_SYN_RECV:
+                        syn_raw[key] += 1
+                        syn_ports[buf[msg + _MSG_SPORT] << 8 | buf[msg + _MSG_SPORT + 1]] += 1
+                    else:
+                        conn_raw[key] += 1
+                    off += (length + 3) & ~3
+                if on_buffer:
+                    on_buffer()
+        finally:
+            sock.close()
+
+    def collect(self, whitelist):
+        syn_raw, conn_raw = defaultdict(int), defaultdict(int)
+        self.syn_ports = defaultdict(int)
+        self._dump(socket.AF_INET, syn_raw, conn_raw, self.syn_ports)
+        self._dump(socket.AF_INET6, syn_raw, conn_raw, self.syn_ports)
+        return _filter(self._keys(syn_raw), whitelist), _filter(self._keys(conn_raw), whitelist)
+
+    @staticmethod
+    def _keys(raw):
+        # Đổi bytes -> khóa int một lần cho mỗi peer (không phải mỗi socket)
+        from_bytes = int.from_bytes
+        return {from_bytes(k, 'big') | (V4_BASE if len(k) == 4 else 0): v for k, v in raw.items()}
+
+    def collect_sketch(self, syn_sketch, conn_sketch):
+        syn_raw, conn_raw = defaultdict(int), defaultdict(int)
+
+        def flush():
+            syn_sketch.update(self._keys(syn_raw))
+            conn_sketch.update(self._keys(conn_raw))
+            syn_raw.clear()
+            conn_raw.clear()
+
+        self.syn_ports = defaultdict(int)
+        for family in (socket.AF_INET, socket.AF_INET6):
+            self._dump(family, syn_raw, conn_raw, self.syn_ports, flush)
+            flush()  # Phần còn lại của buffer cuối (dump kết thúc bằng NLMSG_DONE)
+
+
+class ProcNetCollector(TcpCollector):
+    """Đọc /proc/net/tcp{,6}; truyền paths khác để đọc file fixture"""
+    name = 'proc'
+
+    def __init__(self, paths=('/proc/net/tcp', '/proc/net/tcp6')):
+        self.paths = paths
+
+    @staticmethod
+    def _hex_to_key(h):
+        # IPv4: 8 ký tự hex theo byte order của host (little-endian)
+        if len(h) == 8:
+            return V4_BASE | int.from_bytes(bytes.fromhex(h), 'little')
+        # IPv6: 4 word 32 bit, mỗi word in theo byte order của host
+        if len(h) == 32:
+            a, b, c, d = _PROC_V6.unpack(bytes.fromhex(h))
+            return a << 96 | b << 64 | c << 32 | d
+        return None
+
+    def _scan(self, syn_raw, conn_raw, on_chunk=None):
+        ports = defaultdict(int)
+        for path in self.paths:
+            try:
+                with open(path, 'r') as f:
+                    next(f, None)  # Bỏ dòng tiêu đề
+                    while True:
+                        lines = f.readlines(_PROC_CHUNK)
+                        if not lines:
+                            break
+                        for line in lines:
+                            parts = line.split(None, 4)
+                            st = parts[3]
+                            if st == _PROC_ESTABLISHED:
+                                conn_raw[parts[2].partition(':')[0]] += 1
+                            elif st == _PROC_SYN_RECV:
+                                syn_raw[parts[2].partition(':')[0]] += 1
+                                ports[parts[1][-4:]] += 1
+                        if on_chunk:
+                            on_chunk()
+            except FileNotFoundError:
+                continue
+        self.syn_ports = {int(h, 16): n for h, n in ports.items()}
+
+    def _keys(self, raw):
+        stats = defaultdict(int)
+        for h, count in raw.items():
+            key = self._hex_to_key(h)
+            if key is not None: stats[key] += count
+        return stats
+
+    def collect(self, whitelist):
+        syn_raw, conn_raw = defaultdict(int), defaultdict(int)
+        self._scan(syn_raw, conn_raw)
+        return _filter(self._keys(syn_raw), whitelist), _filter(self._keys(conn_raw), whitelist)
+
+    def collect_sketch(self, syn_sketch, conn_sketch):
+        syn_raw, conn_raw = defaultdict(int), defaultdict(int)
+
+        def flush():
+            syn_sketch.update(self._keys(syn_raw))
+            conn_sketch.update(self._keys(conn_raw))
+            syn_raw.clear()
+            conn_raw.clear()
+
+        self._scan(syn_raw, conn_raw, flush)
+
+
+class SsCollector(TcpCollector):
+    """Cách cũ: gọi `ss` hai lần và parse text"""
+    name = 'ss'
+
+    def collect(self, whitelist):
+        syn_stats = defaultdict(int)
+        conn_stats = defaultdict(int)
+        self.syn_ports = defaultdict(int)
+        res_syn = subprocess.run(['ss', '-nt', 'state', 'syn-recv'], capture_output=True, text=True)
+        for line in res_syn.stdout.splitlines()[1:]:
+            parse_ss_line(line, syn_stats, whitelist, self.syn_ports)
+
+        res_est = subprocess.run(['ss', '-nt', 'state', 'established'], capture_output=True, text=True)
+        for line in res_est.stdout.splitlines()[1:]:
+            parse_ss_line(line, conn_stats, whitelist)
+        return syn_stats, conn_stats
+
+
+def parse_ss_peer(peer_str):
+    """'1.2.3.4:80' / '[2001:db8::1]:443' / '[fe80::1%eth0]:22' -> khóa ipaddr hoặc None"""
+    ip = peer_str.rpartition(':')[0].strip('[]').partition('%')[0]
+    return try_pack(ip) if ip else None
+
+
+def parse_ss_line(line, stats_dict, whitelist, ports=None):
+    parts = line.split()
+    try:
+        # ss output: State Recv-Q Send-Q Local:Port Peer:Port
+        peer_idx = 4 if len(parts) > 4 else 3
+        if ports is not None:
+            ports[int(parts[peer_idx - 1].rpartition(':')[2])] += 1
+        key = parse_ss_peer(parts[peer_idx])
+        if key is not None and key not in whitelist:
+            stats_dict[key] += 1
+    except: pass
+
+
+COLLECTORS = {
+    'netlink': NetlinkCollector,
+    'proc': ProcNetCollector,
+    'ss': SsCollector,
+}
+
+
+def create_collector(config):
+    """Chọn collector theo config['tcp_collector'] ('auto' = netlink -> proc -> ss)"""
+    name = config.get('tcp_collector', 'auto')
+    if name in COLLECTORS:
+        return COLLECTORS[name]()
+    for candidate in (NetlinkCollector, ProcNetCollector):
+        collector = candidate()
+        try:
+            collector.collect([])
+            return collector
+        except Exception as e:
+            logging.info(f"Collector {collector.name} không dùng được: {e}")
+    return SsCollector()
+
+
+# === BENCHMARK VỚI FILE FIXTURE ===
+_PROC_HEADER = "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n"
+
+
+def _proc_hex6(key):
+    # Ngược với _hex_to_key: mỗi word 32 bit in theo byte order little-endian
+    return _PROC_V6.pack(key >> 96, key >> 64 & 0xffffffff, key >> 32 & 0xffffffff,
+                         key & 0xffffffff).hex().upper()
+
+
+def write_proc_fixture(path, n_sockets, n_peers, v6=False):
+    """Sinh file giả lập /proc/net/tcp với n_sockets socket từ n_peers IP.
+    v6=True: định dạng /proc/net/tcp6, nửa số peer là ::ffff:11.x.x.x, nửa là 2001:db8::/32"""
+    local = _proc_hex6(1) if v6 else '0100000A'
+    with open(path, 'w') as f:
+        f.write(_PROC_HEADER)
+        for i in range(n_sockets):
+            peer = i % n_peers
+            if not v6:
+                rem = struct.pack('!I', 0x0A000000 + peer)[::-1].hex().upper()
+            elif peer % 2:
+                rem = _proc_hex6(V4_BASE | 0x0B000000 + peer)
+            else:
+                rem = _proc_hex6(0x20010db8 << 96 | peer << 16 | 1)
+            st = _PROC_SYN_RECV if i % 4 == 0 else _PROC_ESTABLISHED
+            f.write(f"{i:4d}: {local}:0050 {rem}:{1024 + i % 60000:04X} {st} "
+                    f"00000000:00000000 00:00000000 00000000     0        0 {i} 1 0000000000000000 20 4 30 10 -1\n")
+
+
+class _StringProcCollector(ProcNetCollector):
+    """Bản cũ (khóa chuỗi, chỉ IPv4) để so sánh thông lượng trong benchmark"""
+    name = 'proc-str'
+
+    @staticmethod
+    def _hex_to_key(h):
+        if len(h) == 8:
+            return socket.inet_ntoa(bytes.fromhex(h)[::-1])
+        if h.startswith('0000000000000000FFFF0000'):
+            return socket.inet_ntoa(bytes.fromhex(h[24:])[::-1])
+        return None
+
+
+def _best_of(collector, whitelist, rounds=3):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        syn, conn = collector.collect(whitelist)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, sum(syn.values()) + sum(conn.values()), len(syn) + len(conn)
+
+
+def benchmark(n_sockets=200000, n_peers=5000):
+    """So sánh đường IPv4 (khóa chuỗi cũ / khóa int) và dual-stack trên cùng số socket"""
+    import os
+    import tempfile
+    from whitelist import WhitelistMatcher
+    whitelist = WhitelistMatcher(['127.0.0.1', '::1', '192.168.0.0/16', 'fd00::/8'])
+    with tempfile.TemporaryDirectory() as tmp:
+        tcp, tcp4_half, tcp6_half = (os.path.join(tmp, name) for name in ('tcp', 'tcp4h', 'tcp6h'))
+        write_proc_fixture(tcp, n_sockets, n_peers)
+        write_proc_fixture(tcp4_half, n_sockets // 2, n_peers // 2)
+        write_proc_fixture(tcp6_half, n_sockets - n_sockets // 2, n_peers - n_peers // 2, v6=True)
+        runs = [('IPv4, khóa chuỗi (cũ)', _StringProcCollector(paths=(tcp,))),
+                ('IPv4, khóa int', ProcNetCollector(paths=(tcp,))),
+                ('dual-stack, khóa int', ProcNetCollector(paths=(tcp4_half, tcp6_half)))]
+        try:
+            NetlinkCollector().collect([])
+            runs.append(('netlink (hệ thống)', NetlinkCollector()))
+        except Exception as e:
+            print(f"netlink: bỏ qua ({e})")
+        for label, collector in runs:
+            elapsed, sockets, peers = _best_of(collector, whitelist)
+            print(f"{label:22s} {sockets} socket, {peers} peer: {elapsed * 1000:7.1f} ms "
+                  f"({sockets / elapsed / 1e6:.2f} triệu socket/s)")
+        # Flood giả mạo nguồn: mỗi socket một peer khác nhau, đếm chính xác vs sketch
+        from sketch import HeavyHitterSketch
+        spoofed = os.path.join(tmp, 'spoofed')
+        write_proc_fixture(spoofed, n_sockets, n_sockets)
+        collector = ProcNetCollector(paths=(spoofed,))
+        elapsed, sockets, peers = _best_of(collector, whitelist, rounds=1)
+        print(f"{'giả mạo, chính xác':22s} {sockets} socket, {peers} peer: {elapsed * 1000:7.1f} ms")
+        syn_sketch, conn_sketch = HeavyHitterSketch(), HeavyHitterSketch()
+        start = time.perf_counter()
+        collector.collect_sketch(syn_sketch, conn_sketch)
+        syn, conn = syn_sketch.top(whitelist), conn_sketch.top(whitelist)
+        elapsed = time.perf_counter() - start
+        print(f"{'giả mạo, sketch':22s} {syn_sketch.total + conn_sketch.total} socket, {len(syn) + len(conn)} peer "
+              f"(HLL ~{syn_sketch.cardinality() + conn_sketch.cardinality()} nguồn): {elapsed * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    import sys
+    benchmark(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,99 @@
+import os
+import sys
+
+import pytest
+
+# Các module của dự án nằm phẳng ở thư mục gốc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Một script giả cho mọi công cụ: ghi argv (+ stdin của lệnh restore / nft -f -) vào $FAKE_LOG.
+# FAKE_FAIL="ipset nft": các công cụ này thoát 1; FAKE_FAIL_ARG=1.2.3.4: lệnh có đối số này thoát 1.
+# iptables -C luôn thoát 1 (rule chưa có); `nft -j list` in $NFT_LIST_JSON; `ipset list` in $IPSET_LIST.
+FAKE_TOOL = r'''#!/bin/sh
+tool=$(basename "$0")
+{ printf '## %s %s\n' "$tool" "$*"; case "$tool $*" in *restore*|*" -f -"*) cat;; esac; } >> "$FAKE_LOG"
+case " $FAKE_FAIL " in *" $tool "*) exit 1;; esac
+if [ -n "$FAKE_FAIL_ARG" ]; then case " $* " in *" $FAKE_FAIL_ARG "*) exit 1;; esac; fi
+case "$tool $*" in "iptables "*" -C "*|"ip6tables "*" -C "*) exit 1;; esac
+case "$tool $*" in "nft -j list"*) [ -n "$NFT_LIST_JSON" ] && cat "$NFT_LIST_JSON";; esac
+case "$tool $*" in "ipset list"*) [ -n "$IPSET_LIST" ] && cat "$IPSET_LIST";; esac
+exit 0
+'''
+TOOLS = ('iptables', 'ip6tables', 'iptables-restore', 'ip6tables-restore', 'ipset', 'nft', 'conntrack')
+
+
+class FakeBin:
+    def __init__(self, directory, monkeypatch):
+        self.directory = directory
+        self.log = os.path.join(directory, 'calls.log')
+        self.monkeypatch = monkeypatch
+        open(self.log, 'w').close()
+
+    def calls(self):
+        """[(công cụ, đối số, stdin)] theo thứ tự gọi"""
+        with open(self.log) as f:
+            text = f.read()
+        calls = []
+        for chunk in text.split('## ')[1:]:
+            head, _, body = chunk.partition('\n')
+            tool, _, args = head.partition(' ')
+            calls.append((tool, args, body))
+        return calls
+
+    def reset(self):
+        open(self.log, 'w').close()
+
+    def fail(self, tools='', arg=''):
+        self.monkeypatch.setenv('FAKE_FAIL', tools)
+        self.monkeypatch.setenv('FAKE_FAIL_ARG', arg)
+
+    def output(self, name, path):
+        self.monkeypatch.setenv(name, str(path))
+
+
+@pytest.fixture
+def fake_bin(tmp_path, monkeypatch):
+    """iptables / ip6tables / *-restore / ipset / nft / conntrack giả đứng đầu PATH"""
+    directory = tmp_path / 'bin'
+    directory.mkdir()
+    for tool in TOOLS:
+        path = directory / tool
+        path.write_text(FAKE_TOOL)
+        path.chmod(0o755)
+    monkeypatch.setenv('PATH', str(directory) + os.pathsep + os.environ.get('PATH', ''))
+    monkeypatch.setenv('FAKE_LOG', str(directory / 'calls.log'))
+    monkeypatch.setenv('FAKE_FAIL', '')
+    monkeypatch.setenv('FAKE_FAIL_ARG', '')
+    return FakeBin(str(directory), monkeypatch)
+
+
+class _NoTcp:
+    name = 'test'
+
+    def collect(self, whitelist):
+        return {}, {}
+
+
+@pytest.fixture
+def make_detector(fake_bin, tmp_path):
+    """DosDetector chạy trên binary giả, backend ipset, không có collector TCP / file trạng thái"""
+    from alert_journal import AlertJournal
+    from auto_block_sua1 import DosDetector
+    from ban_backend import IpsetBackend
+    detectors = []
+
+    def make(**config):
+        config = dict({'whitelist': [], 'subnet_levels': [], 'subnet_levels_v6': [],
+                       'udp_collector': 'dump', 'ban_time': 300}, **config)
+        detector = DosDetector(config=config, journal=AlertJournal(str(tmp_path / 'alerts.json')),
+                               ban_backend=IpsetBackend(), tcp_collector=_NoTcp(), state_file=None)
+        detectors.append(detector)
+        return detector
+    yield make
+    for detector in detectors:
+        detector.blocklist.stop()
+
+
+@pytest.fixture
+def detector(make_detector):
+    return make_detector()
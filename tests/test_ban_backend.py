@@ -0,0 +1,123 @@
+import pytest
+
+from ban_backend import Ban, IpsetBackend, IptablesBackend, run_command
+
+BANS = [Ban('203.0.113.50', 300, 'SYN Flood'), Ban('2001:db8::1', 600, 'UDP Flood'),
+        Ban('45.10.0.0/16', 0, 'SYN Flood /16')]
+
+
+# --- ipset ---
+def test_ipset_batch_is_one_restore(fake_bin):
+    failed = IpsetBackend().apply(BANS, ['198.51.100.9'])
+    assert not failed
+    calls = fake_bin.calls()
+    restores = [c for c in calls if c[0] == 'ipset']
+    assert [args for _, args, _ in restores] == ['restore -exist']
+    assert restores[0][2].splitlines() == [
+        'add fw_blocked 203.0.113.50 timeout 300',
+        'add fw_blocked6 2001:db8::1 timeout 600',
+        'add fw_blocked 45.10.0.0/16 timeout 0',
+        'del fw_blocked 198.51.100.9',
+    ]
+    # Chỉ IP chặn vì UDP Flood bị cắt luồng conntrack
+    assert [args for tool, args, _ in calls if tool == 'conntrack'] == ['-D -p udp -f ipv6 -s 2001:db8::1']
+
+
+def test_ipset_setup_waits_for_xtables_lock(fake_bin):
+    IpsetBackend().setup()
+    rules = [(tool, args) for tool, args, _ in fake_bin.calls() if tool.endswith('tables')]
+    assert rules == [
+        ('iptables', '-w -C INPUT -m set --match-set fw_blocked src -j DROP'),
+        ('iptables', '-w -I INPUT 1 -m set --match-set fw_blocked src -j DROP'),
+        ('ip6tables', '-w -C INPUT -m set --match-set fw_blocked6 src -j DROP'),
+        ('ip6tables', '-w -I INPUT 1 -m set --match-set fw_blocked6 src -j DROP'),
+    ]
+
+
+def test_ipset_failure_marks_whole_batch(fake_bin):
+    fake_bin.fail('ipset')
+    assert IpsetBackend().apply(BANS, []) == {b.ip for b in BANS}
+
+
+def test_conntrack_failure_is_not_a_ban_failure(fake_bin):
+    fake_bin.fail('conntrack')
+    assert IpsetBackend().apply(BANS, []) == set()
+
+
+def test_ipset_list_banned(fake_bin, tmp_path):
+    listing = tmp_path / 'ipset.txt'
+    listing.write_text('create fw_blocked hash:net family inet timeout 0\n'
+                       'add fw_blocked 1.2.3.4 timeout 120\nadd fw_blocked 10.0.0.0/8 timeout 0\n')
+    fake_bin.output('IPSET_LIST', listing)
+    # Set IPv6 cũng đọc cùng file giả: kết quả gộp theo khóa
+    assert IpsetBackend().list_banned() == {'1.2.3.4': 120, '10.0.0.0/8': 0}
+
+
+# --- iptables ---
+def test_iptables_checks_then_inserts_each_ip(fake_bin):
+    assert not IptablesBackend().apply(BANS[:1], ['198.51.100.9'])
+    assert [(tool, args) for tool, args, _ in fake_bin.calls()] == [
+        ('iptables', '-w -C INPUT -s 203.0.113.50 -j DROP'),
+        ('iptables', '-w -I INPUT 1 -s 203.0.113.50 -j DROP'),
+        ('iptables', '-w -D INPUT -s 198.51.100.9 -j DROP'),
+    ]
+
+
+def test_iptables_failure_is_per_ip(fake_bin):
+    fake_bin.fail(arg='2001:db8::1')
+    assert IptablesBackend().apply(BANS, []) == {'2001:db8::1'}
+
+
+def test_iptables_batch_is_one_restore_per_family(fake_bin):
+    cmds = IptablesBackend().batch_commands(BANS, ['198.51.100.9'])
+    assert all(run_command(c) for c in cmds)
+    restores = {tool: body for tool, _, body in fake_bin.calls() if tool.endswith('-restore')}
+    assert restores == {
+        'iptables-restore': '*filter\n-D INPUT -s 198.51.100.9 -j DROP\n-I INPUT -s 203.0.113.50 -j DROP\n'
+                            '-I INPUT -s 45.10.0.0/16 -j DROP\nCOMMIT\n',
+        'ip6tables-restore': '*filter\n-I INPUT -s 2001:db8::1 -j DROP\nCOMMIT\n',
+    }
+
+
+# --- Đường lỗi -> thử lại của detector ---
+def test_failed_ban_is_forgotten_and_retried(fake_bin, detector):
+    fake_bin.fail('ipset')
+    detector.block_ip('203.0.113.50', 'SYN Flood')
+    detector.flush_bans()
+    # Lỗi: bỏ trạng thái đã chặn và lịch hết hạn để chu kỳ sau phát hiện lại thì chặn lại
+    assert '203.0.113.50' not in detector.banned_ips
+    assert detector.ban_scheduler.next_due() is None
+
+    fake_bin.fail('')
+    fake_bin.reset()
+    detector.block_ip('203.0.113.50', 'SYN Flood')
+    detector.flush_bans()
+    assert '203.0.113.50' in detector.banned_ips
+    retried = [body for tool, _, body in fake_bin.calls() if tool == 'ipset']
+    assert len(retried) == 1 and retried[0].startswith('add fw_blocked 203.0.113.50 timeout ')
+
+
+def _unbanned(detector, path):
+    import alert_journal
+    detector.journal.flush()
+    return {a['ip']: a['reason'] for a in alert_journal.tail(path, 100) if a['action'] == 'UNBANNED'}
+
+
+def test_unban_reasons(fake_bin, detector, tmp_path):
+    for target in ('45.10.7.1', '45.10.7.0/26', '198.51.100.9'):
+        detector.block_ip(target, 'SYN Flood')
+    detector.flush_bans()
+    detector.flush_bans()  # Host được gộp vào dải sau khi dải chặn thành công
+    # Dải rộng hơn: gỡ dải hẹp trong cùng lô
+    detector.block_ip('45.10.0.0/16', 'SYN Flood /16')
+    detector.flush_bans()
+    detector.ban_scheduler.cancel('198.51.100.9')
+    detector.ban_scheduler.schedule('198.51.100.9', 1, 0, ttl=1)
+    detector.unban_old_ips()
+    detector.flush_bans()
+    assert _unbanned(detector, str(tmp_path / 'alerts.json')) == {
+        '45.10.7.0/26': 'Superseded by 45.10.0.0/16',
+        '45.10.7.1': 'Superseded by 45.10.7.0/26',
+        '198.51.100.9': 'Expired',
+    }
+    assert not detector.unban_reasons
@@ -0,0 +1,78 @@
+import pytest
+
+import ipaddr
+from ban_backend import NftBackend
+from bulk_actions import BulkJob
+from cidr_merge import to_range
+
+
+def _plan(lines, existing=None):
+    return BulkJob('block', NftBackend()).feed(line + '\n' for line in lines).plan(existing or {})
+
+
+def _no_overlap(job, existing):
+    """Các dải trong set interval sau lô (kernel còn lại + dải mới) không chồng lấn nhau"""
+    nets = [t for t in existing if '/' in t and t not in job.unbans] + [b.ip for b in job.bans if '/' in b.ip]
+    ranges = sorted(to_range(*ipaddr.parse_cidr(t)) for t in nets)
+    return all(a[1] < b[0] for a, b in zip(ranges, ranges[1:]))
+
+
+def _covered(job, existing, addr):
+    """Thời gian sống dài nhất của các mục chứa addr sau lô (0 = vĩnh viễn, None = không chặn)"""
+    key = ipaddr.pack(addr)
+    lives = []
+    for target, timeout in list(existing.items()) + [(b.ip, b.timeout) for b in job.bans]:
+        start, end = to_range(*ipaddr.parse_cidr(target))
+        if target not in job.unbans and start <= key <= end:
+            lives.append(timeout)
+    if not lives:
+        return None
+    return 0 if 0 in lives or None in lives else max(lives)
+
+
+@pytest.mark.parametrize('lines, existing', [
+    (['1.2.3.0/25 0', '1.2.3.0/24 60'], {}),
+    (['1.2.3.0/24 60', '1.2.3.0/25 0'], {}),
+    (['10.0.0.0/8 60', '10.1.0.0/16 600', '10.1.2.0/24 0', '10.200.0.0/30'], {}),
+    (['2001:db8::/32 60', '2001:db8:1::/48 0'], {}),
+    (['1.2.3.0/24 60'], {'1.2.3.0/25': None, '1.2.3.128/26': 30}),
+])
+def test_mixed_ttl_nested_ranges_do_not_overlap(lines, existing):
+    job = _plan(lines, existing)
+    assert _no_overlap(job, existing)
+    # Mỗi dòng vẫn được chặn ít nhất bằng ttl nó yêu cầu
+    for line in lines:
+        cidr, _, ttl = line.partition(' ')
+        network, plen = ipaddr.parse_cidr(cidr)
+        for key in to_range(network, plen):
+            life = _covered(job, existing, ipaddr.format_cidr(key, 128))
+            assert life is not None
+            assert life == 0 or (ttl and life >= int(ttl))
+
+
+def test_wider_shorter_range_is_split_around_longer_one():
+    job = _plan(['1.2.3.0/25 0', '1.2.3.0/24 60'])
+    assert [(b.ip, b.timeout) for b in job.bans] == [('1.2.3.0/25', 0), ('1.2.3.128/25', 60)]
+    assert job.commands()[0].input == \
+        'add element inet fw_auto_block blocked4_net { 1.2.3.0/25, 1.2.3.128/25 timeout 60s }\n'
+    wide = next(r for r in job.results if r['input'] == '1.2.3.0/24')
+    assert wide['status'] == 'blocked' and 'tách' in wide['message']
+
+
+def test_host_inside_shorter_range_stays_separate():
+    # Host nằm trong set blocked4, không chồng lấn với set interval: không cần tách
+    job = _plan(['10.0.0.5 0', '10.0.0.0/8 60'])
+    assert [(b.ip, b.timeout) for b in job.bans] == [('10.0.0.5', 0), ('10.0.0.0/8', 60)]
+
+
+def test_longer_kernel_range_is_kept_and_shorter_one_superseded():
+    existing = {'1.2.3.0/25': None, '1.2.3.128/26': 30}
+    job = _plan(['1.2.3.0/24 60'], existing)
+    assert job.unbans == ['1.2.3.128/26']
+    assert [b.ip for b in job.bans] == ['1.2.3.128/25']
+
+
+def test_covered_by_longer_range_in_same_batch():
+    job = _plan(['10.0.0.0/8 0', '10.1.0.0/16 60'])
+    assert [b.ip for b in job.bans] == ['10.0.0.0/8']
+    assert {r['input']: r['target'] for r in job.results} == {'10.0.0.0/8': '10.0.0.0/8', '10.1.0.0/16': '10.0.0.0/8'}
@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+import ipaddr
+from cidr_merge import collapse, collapse_text, merge_ranges, range_to_cidrs, subtract_ranges, to_range
+
+
+def _addresses(entries):
+    """Tập địa chỉ (dạng đoạn đã gộp) mà danh sách CIDR phủ"""
+    return merge_ranges(to_range(*ipaddr.parse_cidr(e)) for e in entries)
+
+
+@pytest.mark.parametrize('entries, expected', [
+    (['1.2.3.0/25', '1.2.3.128/25'], ['1.2.3.0/24']),
+    (['10.0.0.1', '10.0.0.0/8'], ['10.0.0.0/8']),
+    (['1.2.3.4', '1.2.3.5', '1.2.3.6', '1.2.3.7'], ['1.2.3.4/30']),
+    (['1.2.3.5', '1.2.3.6'], ['1.2.3.5', '1.2.3.6']),       # liền kề nhưng không căn biên
+    (['1.2.3.1', '1.2.3.2', '1.2.3.3'], ['1.2.3.1', '1.2.3.2/31']),
+    (['2001:db8::/33', '2001:db8:8000::/33'], ['2001:db8::/32']),
+    (['0.0.0.0/1', '128.0.0.0/1'], ['0.0.0.0/0']),
+    (['x', '1.2.3.0/24', '1.2.3.0/33'], ['1.2.3.0/24']),    # mục không hợp lệ bị bỏ
+    ([], []),
+])
+def test_collapse_text(entries, expected):
+    assert collapse_text(entries) == expected
+
+
+def test_v4_and_v6_are_merged_separately():
+    # ::fffe:ffff:ffff liền kề ::ffff:0:0/96 (0.0.0.0/0) trên trục 128 bit nhưng không được nối
+    assert collapse_text(['0.0.0.0/0', '::fffe:ffff:ffff', '::1:0:0:0/128']) == \
+        ['::fffe:ffff:ffff', '0.0.0.0/0', '::1:0:0:0']
+
+
+def test_merge_ranges_joins_adjacent_and_overlapping():
+    assert merge_ranges([(10, 20), (21, 30), (5, 12), (40, 50), (45, 45)]) == [(5, 30), (40, 50)]
+    assert merge_ranges([]) == []
+
+
+def test_subtract_ranges():
+    ranges = [(0, 99), (200, 299)]
+    holes = [(10, 19), (90, 210), (250, 250)]
+    assert subtract_ranges(ranges, holes) == [(0, 9), (20, 89), (211, 249), (251, 299)]
+    assert subtract_ranges(ranges, []) == ranges
+    assert subtract_ranges(ranges, [(0, 1000)]) == []
+
+
+def test_range_to_cidrs_is_minimal_and_exact():
+    assert range_to_cidrs(0, 2 ** 128 - 1) == [(0, 0)]
+    assert range_to_cidrs(4, 7) == [(4, 126)]
+    assert range_to_cidrs(1, 6) == [(1, 128), (2, 127), (4, 127), (6, 128)]
+
+
+def test_random_lists_cover_same_addresses():
+    rng = random.Random(3)
+    for _ in range(50):
+        entries = []
+        for _ in range(rng.randrange(1, 200)):
+            if rng.random() < 0.8:
+                entries.append(f'45.{rng.randrange(2)}.{rng.randrange(4)}.{rng.randrange(256)}/{rng.choice((24, 30, 32))}')
+            else:
+                entries.append(f'2001:db8:{rng.randrange(4):x}::/{rng.choice((48, 64, 128))}')
+        merged = collapse_text(entries)
+        assert _addresses(merged) == _addresses(entries)
+        assert len(merged) <= len(set(entries))
+        # Kết quả không chồng lấn và đã tối thiểu: gộp lại lần nữa không đổi
+        assert collapse_text(merged) == merged
+        ranges = [to_range(*ipaddr.parse_cidr(e)) for e in merged]
+        assert all(a[1] < b[0] for a, b in zip(ranges, ranges[1:]))
+
+
+def test_collapse_keys():
+    assert collapse([ipaddr.parse_cidr('10.0.0.0/9'), ipaddr.parse_cidr('10.128.0.0/9')]) == \
+        [ipaddr.parse_cidr('10.0.0.0/8')]
@@ -0,0 +1,119 @@
+import os
+import time
+
+import pytest
+
+from config_manager import DEFAULTS, ConfigError, ConfigManager, compile_config, save_config_atomic, validate
+
+
+def _problem(key, value):
+    errors = validate({key: value})
+    assert len(errors) <= 1
+    return errors[0] if errors else None
+
+
+def test_defaults_are_valid():
+    assert validate(DEFAULTS) == []
+    assert validate({}) == []
+
+
+def test_not_an_object():
+    assert validate(['syn_threshold', 50]) == ['config phải là một object JSON']
+
+
+def test_unknown_keys_are_kept_unchecked():
+    assert validate({'custom_key': object()}) == []
+    assert compile_config({'custom_key': 1}).config['custom_key'] == 1
+
+
+@pytest.mark.parametrize('key, value', [
+    ('syn_threshold', 0),
+    ('syn_threshold', 2.5),
+    ('syn_threshold', '50'),
+    ('syn_threshold', True),        # bool không tính là số
+    ('ban_time', -1),
+    ('check_interval', 0),          # above: phải > 0
+    ('ban_escalation', 0.5),
+    ('sketch_width', 32),
+    ('events_retention', -1),
+    ('events_max_rows', 1.5),
+    ('ban_backend', 'pf'),
+    ('daemon_mode', 'threads'),
+    ('instrumentation', 'yes'),
+])
+def test_invalid_values(key, value):
+    assert _problem(key, value).startswith(f'{key}: ')
+
+
+@pytest.mark.parametrize('key, value', [
+    ('ban_time', 0),
+    ('check_interval', 0.5),
+    ('ban_escalation', 1.5),
+    ('syn_threshold', 50.0),        # số nguyên dạng float
+    ('events_retention', 0),
+    ('events_max_rows', 0),
+    ('instrumentation', False),
+])
+def test_valid_edge_values(key, value):
+    assert _problem(key, value) is None
+
+
+@pytest.mark.parametrize('key, value, ok', [
+    ('subnet_levels', [24, 16, 'asn'], True),
+    ('subnet_levels', [33], False),
+    ('subnet_levels', [0], False),
+    ('subnet_levels', [True], False),
+    ('subnet_levels', '24', False),
+    ('subnet_levels_v6', [64, 128], True),
+    ('subnet_levels_v6', ['asn'], False),
+    ('subnet_multipliers', {'24': 4, '16': 0.5}, True),
+    ('subnet_multipliers', {'24': 0}, False),
+    ('subnet_multipliers', [4], False),
+    ('cache_ttls', {'blocked': 0, 'alerts': 2.5}, True),
+    ('cache_ttls', {'blocked': -1}, False),
+    ('cache_ttls', {'blocked': True}, False),
+    ('blocklist_feeds', ['/etc/feeds/a.txt'], True),
+    ('blocklist_feeds', [''], False),
+    ('blocklist_feeds', '/etc/feeds/a.txt', False),
+])
+def test_structured_values(key, value, ok):
+    assert (_problem(key, value) is None) == ok
+
+
+def test_whitelist_lists_invalid_entries():
+    assert _problem('whitelist', ['10.0.0.0/8', '::ffff:1.2.3.4', '2001:db8::/32']) is None
+    problem = _problem('whitelist', ['10.0.0.0/8', '1.2.3.999', '10.0.0.0/33'])
+    assert problem == 'whitelist: mục không hợp lệ: 1.2.3.999, 10.0.0.0/33'
+    assert _problem('whitelist', '127.0.0.1') == 'whitelist: phải là list IP / CIDR'
+
+
+def test_all_errors_are_reported():
+    with pytest.raises(ConfigError) as e:
+        compile_config({'syn_threshold': -5, 'ban_backend': 'pf', 'whitelist': ['1.2.3.999']})
+    assert [p.split(':')[0] for p in e.value.errors] == ['syn_threshold', 'ban_backend', 'whitelist']
+    assert str(e.value) == '; '.join(e.value.errors)
+
+
+def test_invalid_file_keeps_previous_snapshot(tmp_path):
+    path = str(tmp_path / 'firewall_auto_block.json')
+    save_config_atomic(path, {'syn_threshold': 80})
+    manager = ConfigManager(path, use_inotify=False)
+    snapshot = manager.snapshot
+    assert snapshot.thresholds['syn'] == 80
+
+    for bad in ({'syn_threshold': -5}, {'ban_backend': 'pf'}, {'whitelist': ['1.2.3.999']}):
+        save_config_atomic(path, bad)
+        os.utime(path, ns=(0, time.time_ns() + 1))  # mtime có thể trùng trên fs độ phân giải thô
+        assert manager.poll() is None
+        assert manager.snapshot is snapshot
+
+    save_config_atomic(path, {'syn_threshold': 60})
+    os.utime(path, ns=(0, time.time_ns() + 1))
+    assert manager.poll().thresholds['syn'] == 60
+    assert manager.version == snapshot.version + 1
+
+
+def test_overrides_are_validated():
+    with pytest.raises(ConfigError):
+        ConfigManager(None, {'events_max_rows': -1})
+    assert ConfigManager(None, {'events_max_rows': 10}).snapshot.config['events_max_rows'] == 10
@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+
+from event_store import EventStore, attack_type_of
+
+
+def _store(tmp_path, n=100):
+    store = EventStore(str(tmp_path / 'events.db'))
+    store.add_events({'timestamp': 1000 + i, 'ip': f'10.0.0.{i % 250}', 'action': 'BLOCKED',
+                      'reason': 'SYN Flood (Z-Score: 9.1)'} for i in range(n))
+    return store
+
+
+def test_prune_events_by_age(tmp_path):
+    store = _store(tmp_path)
+    assert store.prune_events(before=1060) == 60
+    assert store.count() == 40
+    assert store.recent(1)[0]['timestamp'] == 1099
+
+
+def test_prune_events_keeps_newest_rows(tmp_path):
+    store = _store(tmp_path)
+    assert store.prune_events(max_rows=30) == 70
+    assert store.count() == 30
+    assert min(e['timestamp'] for e in store.recent(100)) == 1070
+    # Không giới hạn: không xóa gì
+    assert store.prune_events() == 0 and store.count() == 30
+
+
+def test_detector_prunes_events_with_metrics(tmp_path):
+    from auto_block_sua1 import DosDetector
+    store = _store(tmp_path)
+    store.add_metrics(1000, {'syn_src.norm': 0.5})
+    detector = SimpleNamespace(config={'metrics_retention': 10, 'events_retention': 50, 'events_max_rows': 20})
+    DosDetector.prune_store(detector, store, now=1100)
+    assert store.count() == 20
+    assert store.metric_series(['syn_src.norm'], 0) == {'syn_src.norm': []}
+
+
+def test_attack_type_ignores_unban_reasons():
+    assert attack_type_of('SYN Flood (Z-Score: 9.1)') == 'SYN Flood'
+    assert attack_type_of('Expired') is None
+    assert attack_type_of('Superseded by 10.0.0.0/8') is None
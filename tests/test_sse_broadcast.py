@@ -0,0 +1,52 @@
+import json
+import threading
+
+from sse_broadcast import StatusBroadcaster
+
+
+def _payload(data):
+    return json.loads(data.decode('utf-8').split('data: ', 1)[1])
+
+
+class _HookedCondition(threading.Condition):
+    """Condition gọi hook ngay sau mỗi lần nhả khóa: mô phỏng subscriber kết nối đúng lúc đó"""
+
+    def __init__(self):
+        super().__init__()
+        self.hook = None
+        self.busy = False
+
+    def __exit__(self, *exc):
+        result = super().__exit__(*exc)
+        if self.hook and not self.busy:
+            self.busy = True
+            try:
+                self.hook()
+            finally:
+                self.busy = False
+        return result
+
+
+def test_new_subscriber_never_sees_alert_twice():
+    batches = iter([[{'ip': f'203.0.113.{i}'}, {'ip': f'198.51.100.{i}'}] for i in range(5)])
+    broadcaster = StatusBroadcaster(lambda: ({'blocked_count': 1}, next(batches)))
+    cond = broadcaster.cond = _HookedCondition()
+    joins = []
+
+    def connect():
+        # Subscriber mới: snapshot tại seq hiện tại, sau đó chỉ nhận event có seq lớn hơn
+        with cond:
+            joins.append((broadcaster.seq, _payload(broadcaster._pending(None)[0])['alerts']))
+
+    cond.hook = connect
+    for _ in range(5):
+        broadcaster.tick()
+    cond.hook = None
+    assert joins
+    for seq, alerts in joins:
+        seen = [a['ip'] for a in alerts]
+        for s, data in broadcaster.events:
+            if s > seq:
+                seen += [a['ip'] for a in _payload(data)['alerts']]
+        assert len(seen) == len(set(seen))
+        assert len(seen) == 10
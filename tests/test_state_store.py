@@ -0,0 +1,51 @@
+import time
+from types import SimpleNamespace
+
+import ipaddr
+import state_store
+from ban_scheduler import BanScheduler
+from zscore_engine import create_history
+
+
+def _detector():
+    return SimpleNamespace(banned_ips={}, ban_reasons={}, ban_scheduler=BanScheduler(),
+                           pending_bans=[], pending_unbans=[], config={'ban_time': 300},
+                           is_valid_target=lambda ip: True,
+                           **{name: create_history(max_keys=100) for name in state_store.HISTORIES})
+
+
+def _filled(now, histories=state_store.HISTORIES):
+    detector = _detector()
+    keys = [ipaddr.pack(f'10.0.0.{i}') for i in range(10)]
+    for cycle in range(5):
+        for name in histories:
+            getattr(detector, name).update({key: i + cycle for i, key in enumerate(keys)}, now=now - 5 + cycle)
+    detector.banned_ips['203.0.113.50'] = now
+    detector.ban_reasons['203.0.113.50'] = 'Packet Flood'
+    detector.ban_scheduler.schedule('203.0.113.50', 300, now)
+    return detector
+
+
+def test_pkt_history_round_trip(tmp_path):
+    now = time.time()
+    path = str(tmp_path / 'state.bin')
+    state_store.write_atomic(path, state_store.snapshot(_filled(now), now))
+    restored = _detector()
+    stats = state_store.restore(restored, state_store.load(path), live={'203.0.113.50': 300}, now=now)
+    assert restored.pkt_history.tracked_keys == 10
+    assert stats['history'] == 10 * len(state_store.HISTORIES)
+    assert stats['kept'] == 1
+
+
+def test_restore_snapshot_without_pkt_history(tmp_path, monkeypatch):
+    now = time.time()
+    old = state_store.HISTORIES[:3]
+    # Snapshot ghi bởi phiên bản chỉ có 3 bộ lịch sử
+    monkeypatch.setattr(state_store, 'HISTORIES', old)
+    data = state_store.snapshot(_filled(now, old), now)
+    monkeypatch.undo()
+    restored = _detector()
+    stats = state_store.restore(restored, state_store.unpack(data), live={}, now=now)
+    assert restored.pkt_history.tracked_keys == 0
+    assert stats['history'] == 10 * len(old)
+    assert stats['reapplied'] == 1
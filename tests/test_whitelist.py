@@ -0,0 +1,113 @@
+import pytest
+
+import ipaddr
+from prefix_table import PrefixTable
+from whitelist import WhitelistMatcher, matcher_for, normalize_entry
+
+
+def _net(text):
+    return ipaddr.parse_cidr(text)
+
+
+# --- PrefixTable ---
+def test_longest_prefix_wins():
+    table = PrefixTable(128)
+    table.add(*_net('10.0.0.0/8'), 'wide')
+    table.add(*_net('10.1.0.0/16'), 'narrow')
+    assert table.lookup(ipaddr.pack('10.1.2.3')) == 'narrow'
+    assert table.lookup(ipaddr.pack('10.2.0.1')) == 'wide'
+    assert table.lookup(ipaddr.pack('11.0.0.1')) is None
+    table.remove(*_net('10.1.0.0/16'))
+    assert table.lookup(ipaddr.pack('10.1.2.3')) == 'wide'
+    assert len(table) == 1
+
+
+def test_covers_covering_and_overlaps():
+    table = PrefixTable(128)
+    table.add(*_net('10.1.0.0/16'), '10.1.0.0/16')
+    table.add(*_net('192.0.2.7'), '192.0.2.7')
+    assert table.covers(*_net('10.1.2.0/24')) and not table.covers(*_net('10.0.0.0/8'))
+    assert table.covering(*_net('10.1.2.0/24')) == '10.1.0.0/16'
+    assert table.covering(*_net('10.0.0.0/8')) is None
+    # overlaps: chứa hoặc nằm trong
+    assert table.overlaps(*_net('10.0.0.0/8'))
+    assert table.overlaps(*_net('10.1.255.0/24'))
+    assert table.overlaps(*_net('192.0.2.0/24'))
+    assert not table.overlaps(*_net('10.2.0.0/16'))
+    # Bảng đổi thì bộ nhớ đệm của overlaps phải được làm mới
+    table.add(*_net('10.2.3.0/24'))
+    assert table.overlaps(*_net('10.2.0.0/16'))
+    table.remove(*_net('10.2.3.0/24'))
+    assert not table.overlaps(*_net('10.2.0.0/16'))
+
+
+def test_zero_length_prefix():
+    table = PrefixTable(128)
+    table.add(0, 0, 'all')
+    assert table.lookup(ipaddr.pack('2001:db8::1')) == 'all'
+    assert table.lookup(ipaddr.pack('1.2.3.4')) == 'all'
+    assert table.covers(*_net('10.0.0.0/8')) and table.overlaps(*_net('::/0'))
+
+
+# --- WhitelistMatcher ---
+def test_matches_hosts_and_ranges_by_key_or_string():
+    matcher = WhitelistMatcher(['127.0.0.1', '10.0.0.0/8', '2001:db8::/32', 'không hợp lệ', '1.2.3.0/33'])
+    assert matcher.invalid == ['không hợp lệ', '1.2.3.0/33']
+    assert len(matcher) == 3
+    assert '127.0.0.1' in matcher and '127.0.0.2' not in matcher
+    assert matcher.match('10.200.1.1') == '10.0.0.0/8'
+    assert matcher.match(ipaddr.pack('10.200.1.1')) == '10.0.0.0/8'
+    assert '2001:db8:ffff::1' in matcher and '2001:db9::1' not in matcher
+    assert 'rác' not in matcher
+
+
+def test_v4_mapped_addresses():
+    matcher = WhitelistMatcher(['192.0.2.0/24', '::ffff:198.51.100.0/120'])
+    # Dạng ::ffff:a.b.c.d là cùng một địa chỉ IPv4
+    assert '::ffff:192.0.2.9' in matcher
+    assert '198.51.100.7' in matcher
+    assert normalize_entry('::ffff:198.51.100.0/120') == '198.51.100.0/24'
+
+
+def test_zero_prefix_entries():
+    v4_all = WhitelistMatcher(['0.0.0.0/0'])
+    assert '8.8.8.8' in v4_all and '2001:db8::1' not in v4_all
+    v6_all = WhitelistMatcher(['::/0'])
+    # ::/0 chứa cả vùng ::ffff:0:0/96 nên khớp cả IPv4
+    assert '2001:db8::1' in v6_all and '8.8.8.8' in v6_all
+
+
+def test_overlapping_entries_return_most_specific():
+    matcher = WhitelistMatcher(['10.0.0.0/8', '10.1.0.0/16', '10.1.2.3'])
+    assert matcher.match('10.1.2.3') == '10.1.2.3'
+    assert matcher.match('10.1.2.4') == '10.1.0.0/16'
+    assert matcher.match('10.9.0.1') == '10.0.0.0/8'
+
+
+@pytest.mark.parametrize('cidr, expected', [
+    ('10.0.0.0/8', True),          # dải mới nằm trong whitelist
+    ('10.1.0.0/16', True),
+    ('0.0.0.0/0', True),           # dải mới chứa mục whitelist
+    ('192.0.2.0/24', True),        # chứa host 192.0.2.10
+    ('192.0.3.0/24', False),
+    ('2001:db8::/48', True),
+    ('2001:db9::/32', False),
+    ('::/0', True),
+])
+def test_overlaps_for_bulk_blocking(cidr, expected):
+    matcher = WhitelistMatcher(['10.0.0.0/8', '192.0.2.10', '2001:db8:0:1::/64'])
+    assert matcher.overlaps(*_net(cidr)) is expected
+
+
+def test_matcher_for_recompiles_only_on_change():
+    first = matcher_for(['10.0.0.0/8'])
+    assert matcher_for(['10.0.0.0/8']) is first
+    assert matcher_for(['10.0.0.0/8', '::1']) is not first
+
+
+def test_detector_skips_ranges_touching_whitelist(make_detector):
+    detector = make_detector(whitelist=['10.1.2.3', '2001:db8::/48'])
+    assert '10.1.2.3' in detector.whitelist and '::ffff:10.1.2.3' in detector.whitelist
+    assert detector.skip_net(*_net('10.1.0.0/16'))
+    assert detector.skip_net(*_net('2001:db8::/32'))
+    assert not detector.skip_net(*_net('10.2.0.0/16'))
@@ -0,0 +1,107 @@
+import random
+
+import pytest
+
+from zscore_engine import DequeHistory, MatrixHistory, create_history, np
+
+ENGINES = [DequeHistory] + ([MatrixHistory] if np is not None else [])
+
+
+def _check_rows(history):
+    """Bảng IP -> hàng và hàng -> IP của MatrixHistory phải khớp nhau"""
+    if isinstance(history, MatrixHistory):
+        for ip, row in history.index.items():
+            assert history.keys[row] == ip
+        occupied = {r for r, ip in enumerate(history.keys) if ip is not None}
+        assert occupied == set(history.index.values())
+        assert not occupied & set(history.free_rows)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_idle_then_capacity_eviction(engine):
+    history = engine(max_keys=10, idle_ttl=100)
+    history.update({f'a{i}': 5 for i in range(10)}, now=0)
+    history.update({f'a{i}': 5 for i in range(5)}, now=150)
+    # a5..a9 quá idle_ttl; sau đó thiếu chỗ nên phải loại thêm 3 IP cũ nhất
+    history.update({f'b{i}': 5 for i in range(8)}, now=160)
+    assert len(history) == 10
+    assert all(f'b{i}' in _keys(history) for i in range(8))
+    _check_rows(history)
+    # Các lần update sau vẫn chạy (hàng đã giải phóng không bị loại lại)
+    for step in range(5):
+        history.update({f'c{step}-{i}': 5 for i in range(7)}, now=170 + step * 200)
+        assert len(history) <= 10
+        _check_rows(history)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_random_churn_keeps_rows_consistent(engine):
+    history = engine(max_keys=50, idle_ttl=30)
+    rng = random.Random(1)
+    for now in range(40):
+        stats = {f'10.0.0.{rng.randrange(80)}': rng.randint(0, 20) for _ in range(40)}
+        history.update(stats, now=now)
+    _check_rows(history)
+    assert len(history) <= 50
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_cap_holds_within_one_burst(engine):
+    """Một chu kỳ có nhiều IP mới hơn max_keys: không được vượt max_keys"""
+    history = engine(max_keys=1000)
+    history.update({f'old{i}': 5 for i in range(300)}, now=0)
+    burst = {i: i % 7 for i in range(50000)}
+    burst.update({f'hot{i}': 10000 for i in range(10)})
+    result = history.update(burst, now=1)
+    assert len(history) == 1000
+    assert len(result) == len(burst)
+    assert all(z == 0.0 for *_, z in result)  # IP mới chưa đủ mẫu
+    if isinstance(history, MatrixHistory):
+        # Giữ các IP mới số đếm cao nhất, ma trận không phình theo burst
+        assert all(f'hot{i}' in history.index for i in range(10))
+        assert len(history.n) < 2 * 1000
+        _check_rows(history)
+    # IP của chu kỳ hiện tại đã đủ lấp max_keys: chu kỳ sau vẫn đúng giới hạn
+    history.update({f'next{i}': 1 for i in range(5000)}, now=2)
+    assert len(history) == 1000
+    _check_rows(history)
+
+
+@pytest.mark.skipif(np is None, reason='cần NumPy')
+def test_engines_agree():
+    rng = random.Random(2)
+    deque, matrix = DequeHistory(max_keys=1000), MatrixHistory(max_keys=1000)
+    for cycle in range(12):
+        stats = {f'10.0.{i >> 8}.{i & 255}': rng.randint(40, 200) if cycle == 11 and i % 50 == 0
+                 else rng.randint(0, 20) for i in range(500)}
+        a, b = deque.update(stats, 30, now=cycle), matrix.update(stats, 30, now=cycle)
+    assert [(ip, c) for ip, c, _ in a] == [(ip, c) for ip, c, _ in b]
+    assert [z for *_, z in a] == pytest.approx([z for *_, z in b])
+
+
+def _keys(history):
+    return history.index if isinstance(history, MatrixHistory) else history.store
+
+
+def _rss_mb():
+    import os
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+@pytest.mark.skipif(not __import__('os').path.exists('/proc/self/statm'), reason='cần /proc')
+def test_rss_flat_under_spoofed_sources(total=10000000, batch=100000, max_keys=50000):
+    """Nguồn giả mạo ngẫu nhiên: sau khi đầy max_keys, RSS phải đi ngang"""
+    history = create_history(max_keys=max_keys, idle_ttl=10 ** 9)
+    rng = random.Random(1)
+    warmup = max(total // 5, batch)  # Mốc cố định theo total, sau khi bộ nhớ đã đầy
+    baseline = None
+    for now, fed in enumerate(range(batch, total + 1, batch), 1):
+        stats = {f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}": 1
+                 for _ in range(batch)}
+        history.update(stats, 50, now=now)
+        if baseline is None and fed >= warmup:
+            baseline = _rss_mb()
+    assert len(history) <= max_keys
+    assert baseline is not None
+    assert (_rss_mb() - baseline) / baseline < 0.10
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Cache TTL có single-flight cho các truy vấn đọc của Web dashboard.
+
+FirewallManager.get_stats / get_iptables_rules và probe systemctl chạy tiến trình
+con mới ở mỗi request; N request đồng thời = N lần fork cùng một lệnh.
+TTLCache.get(key, loader):
+- còn hạn (ttl theo từng khóa) -> trả về ngay (hit);
+- hết hạn và chưa ai nạp -> người gọi này nạp (miss), những người gọi cùng lúc
+  chờ kết quả của lần nạp đó thay vì tự chạy lệnh (coalesced);
+- loader lỗi -> mọi người đang chờ nhận cùng exception, không lưu vào cache.
+invalidate(...) sau khi chặn / gỡ chặn / lưu config: xóa khóa và bỏ kết quả của
+lần nạp đang chạy dở (có thể đã đọc trạng thái cũ).
+
+    python3 ttl_cache.py [số thread]   # request/s khi không cache và khi có cache
+"""
+import threading
+import time
+
+DEFAULT_TTL = 2.0
+
+
+class _Flight:
+    __slots__ = ('event', 'value', 'error', 'stale')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.stale = False
+
+
+class TTLCache:
+    def __init__(self, ttls=None, default_ttl=DEFAULT_TTL):
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self.lock = threading.Lock()
+        self.entries = {}   # khóa -> (hết hạn, giá trị)
+        self.inflight = {}  # khóa -> _Flight
+        self.counts = {}    # khóa -> [hit, miss, coalesced, lỗi, invalidate]
+
+    def set_ttls(self, ttls):
+        with self.lock:
+            self.ttls.update(ttls)
+
+    def _count(self, key, field):
+        row = self.counts.get(key)
+        if row is None:
+            row = self.counts[key] = [0, 0, 0, 0, 0]
+        row[field] += 1
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._count(key, 0)
+                return entry[1]
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = _Flight()
+                self._count(key, 1)
+            else:
+                self._count(key, 2)
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = loader()
+        except BaseException as e:
+            flight.error = e
+            with self.lock:
+                self._count(key, 3)
+            raise
+        finally:
+            with self.lock:
+                if self.inflight.get(key) is flight:
+                    del self.inflight[key]
+                if flight.error is None and not flight.stale:
+                    ttl = self.ttls.get(key, self.default_ttl)
+                    if ttl > 0:
+                        self.entries[key] = (time.monotonic() + ttl, flight.value)
+            flight.event.set()
+        return flight.value
+
+    def cached(self, key):
+        """Decorator cho hàm không tham số: @cache.cached('rules')"""
+        def wrap(func):
+            def wrapper():
+                return self.get(key, func)
+            wrapper.__name__ = func.__name__
+            wrapper.__doc__ = func.__doc__
+            wrapper.uncached = func
+            return wrapper
+        return wrap
+
+    def invalidate(self, *keys):
+        """Xóa các khóa (không truyền khóa nào = xóa hết)"""
+        with self.lock:
+            for key in keys or list(set(self.entries) | set(self.inflight)):
+                self.entries.pop(key, None)
+                flight = self.inflight.pop(key, None)
+                if flight is not None:
+                    # Người đang chờ vẫn nhận kết quả, nhưng không lưu; người gọi sau nạp lại
+                    flight.stale = True
+                self._count(key, 4)
+
+    def stats(self):
+        """{khóa: {hits, misses, coalesced, errors, invalidations, hit_rate}, '_total': ...}"""
+        with self.lock:
+            rows = {k: list(v) for k, v in self.counts.items()}
+        result = {}
+        total = [0, 0, 0, 0, 0]
+        for key, row in sorted(rows.items()):
+            total = [a + b for a, b in zip(total, row)]
+            result[key] = _stats_row(row, self.ttls.get(key, self.default_ttl))
+        result['_total'] = _stats_row(total, None)
+        return result
+
+
+def _stats_row(row, ttl):
+    hits, misses, coalesced, errors, invalidations = row
+    requests = hits + misses + coalesced
+    stats = {'hits': hits, 'misses': misses, 'coalesced': coalesced, 'errors': errors,
+             'invalidations': invalidations,
+             # hit_rate: phần request không phải tự chạy loader
+             'hit_rate': round((hits + coalesced) / requests, 4) if requests else 0.0}
+    if ttl is not None:
+        stats['ttl'] = ttl
+    return stats
+
+
+# === BENCHMARK ===
+def _run(threads, seconds, handler):
+    done = [0] * threads
+    stop = time.perf_counter() + seconds
+
+    def worker(i):
+        while time.perf_counter() < stop:
+            handler()
+            done[i] += 1
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return sum(done) / seconds
+
+
+def benchmark(threads=16, seconds=3.0):
+    """Giả lập handler /api/status (list_banned + systemctl + đọc cảnh báo) và
+    /api/rules (iptables -L): mỗi probe là một tiến trình con thật"""
+    import subprocess
+    loads = {'probe': 0}
+
+    def probe(cost=0.005):
+        loads['probe'] += 1
+        subprocess.run(['true'])
+        time.sleep(cost)  # thời gian iptables / systemctl tự chạy
+        return []
+
+    def status(get):
+        return {'blocked': len(get('blocked', probe)), 'service': get('service', probe),
+                'alerts': get('alerts', probe)}
+
+    def rules(get):
+        return get('rules', probe)
+
+    for name, handler in (('/api/status', status), ('/api/rules', rules)):
+        for label, cache in (('không cache', None), ('TTL 2s + single-flight', TTLCache(default_ttl=2.0))):
+            loads['probe'] = 0
+            get = cache.get if cache else (lambda key, loader: loader())
+            rate = _run(threads, seconds, lambda: handler(get))
+            extra = f", hit rate {cache.stats()['_total']['hit_rate']:.4f}" if cache else ''
+            print(f"{name:12s} {label:24s} {threads} thread: {rate:10.0f} req/s, "
+                  f"{loads['probe']:6d} lần chạy lệnh{extra}")
+
+    # Single-flight: N request cùng lúc khi cache trống chỉ chạy một lệnh
+    cache = TTLCache(default_ttl=2.0)
+    loads['probe'] = 0
+    barrier = threading.Barrier(threads)
+
+    def burst():
+        barrier.wait()
+        cache.get('rules', lambda: probe(0.05))
+
+    pool = [threading.Thread(target=burst) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    print(f"{threads} request đồng thời khi cache trống: {loads['probe']} lần chạy lệnh, "
+          f"{cache.stats()['rules']}")
+
+
+if __name__ == "__main__":
+    import sys
+    benchmark(*(int(a) for a in sys.argv[1:2]))
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Bộ đếm luồng UDP theo IP nguồn dựa trên sự kiện conntrack.
+
+Thay vì chạy `conntrack -L -p udp | head -n 5000` mỗi chu kỳ, ConntrackEventCounter
+đọc luồng sự kiện `conntrack -E` (NEW / DESTROY) trong một thread nền và giữ số
+luồng đang sống của từng IP trong bộ nhớ. Chu kỳ phát hiện chỉ cần đọc bộ đếm.
+
+Sự kiện có thể bị mất khi buffer netlink tràn, vì vậy bộ đếm được đồng bộ lại
+bằng một lần dump đầy đủ (không giới hạn dòng) sau mỗi resync_interval giây.
+
+conntrack chỉ trả về IPv4 nếu không có `-f`, nên mỗi họ địa chỉ có một lần dump
+và một luồng sự kiện riêng; bộ đếm dùng khóa int của ipaddr cho cả hai.
+
+Bộ đếm cũng giữ số luồng đang sống theo cổng đích (dport của chiều đi), dùng cho
+entropy cổng của distribution_metrics; số cổng tối đa 65536 nên luôn dùng dict.
+
+sketch_factory (counting_mode = "sketch"): thay dict bằng sketch.HeavyHitterSketch,
+sự kiện được gộp vào lô nhỏ rồi nạp vào sketch; snapshot() trả về top-k.
+"""
+import subprocess
+import threading
+import logging
+import time
+from collections import defaultdict
+
+from ipaddr import try_pack
+
+FAMILIES = ('ipv4', 'ipv6')
+
+
+def parse_conntrack_line(line):
+    """Trả về (delta, ip nguồn) cho một dòng conntrack, hoặc (0, None)"""
+    line = line.lstrip()
+    if line.startswith('[NEW]'):
+        delta = 1
+    elif line.startswith('[DESTROY]'):
+        delta = -1
+    elif line.startswith('['):
+        return 0, None  # [UPDATE] và các sự kiện khác không đổi số luồng
+    else:
+        delta = 1  # Dòng của `conntrack -L` (dump)
+    i = line.find('src=')
+    if i < 0:
+        return 0, None
+    j = line.find(' ', i)
+    return delta, line[i + 4:j if j > 0 else None]
+
+
+def parse_conntrack_dport(line):
+    """dport đầu tiên của dòng conntrack (chiều đi), hoặc None"""
+    i = line.find('dport=')
+    if i < 0:
+        return None
+    j = line.find(' ', i)
+    value = line[i + 6:j if j > 0 else None].strip()
+    return int(value) if value.isdigit() else None
+
+
+class ConntrackEventCounter:
+    PENDING_MAX = 4096    # Số khóa tối đa của lô chờ nạp vào sketch
+    RESYNC_CHUNK = 65536  # Số dòng dump mỗi lô khi resync ở chế độ sketch
+
+    def __init__(self, resync_interval=300, buffer_size=16 * 1024 * 1024, sketch_factory=None):
+        self.resync_interval = resync_interval
+        self.buffer_size = buffer_size
+        self.counts = defaultdict(int)
+        self.port_counts = defaultdict(int)
+        self.sketch_factory = sketch_factory
+        self.sketch = sketch_factory() if sketch_factory else None
+        self.pending = defaultdict(int)
+        self.lock = threading.Lock()
+        self.events = 0
+        self.last_resync = 0
+        self._procs = {}
+        self._keys = {}  # chuỗi IP -> khóa int (luồng của cùng một IP lặp lại rất nhiều)
+        self._running = False
+
+    # --- Cập nhật bộ đếm ---
+    def feed_line(self, line):
+        delta, ip = parse_conntrack_line(line)
+        if not ip:
+            return
+        key = self._keys.get(ip)
+        if key is None:
+            key = try_pack(ip)
+            if key is None:
+                return
+            if len(self._keys) >= 200000:
+                self._keys.clear()
+            self._keys[ip] = key
+        # dport của chiều đi, giữ dạng chuỗi (đổi sang int khi đọc ở ports())
+        i = line.find('dport=')
+        port = line[i + 6:line.find(' ', i)] if i > 0 else None
+        with self.lock:
+            self.events += 1
+            if port:
+                ports = self.port_counts
+                value = ports[port] + delta
+                if value > 0:
+                    ports[port] = value
+                else:
+                    del ports[port]
+            if self.sketch is not None:
+                self.pending[key] += delta
+                if len(self.pending) >= self.PENDING_MAX:
+                    self._flush_pending()
+                return
+            value = self.counts[key] + delta
+            if value > 0:
+                self.counts[key] = value
+            else:
+                del self.counts[key]
+
+    def _flush_pending(self):
+        # Gọi khi đang giữ lock
+        self.sketch.update(self.pending)
+        self.pending = defaultdict(int)
+
+    def resync(self):
+        """Dump toàn bộ bảng UDP một lần để hiệu chỉnh bộ đếm"""
+        if self.sketch is not None:
+            return self._resync_sketch()
+        counts = defaultdict(int)
+        ports = defaultdict(int)
+        for family in FAMILIES:
+            res = subprocess.run(['conntrack', '-L', '-p', 'udp', '-f', family], capture_output=True, text=True)
+            for line in res.stdout.splitlines():
+                delta, ip = parse_conntrack_line(line)
+                key = try_pack(ip) if ip else None
+                if key is not None:
+                    counts[key] += delta
+                    port = parse_conntrack_dport(line)
+                    if port is not None: ports[str(port)] += delta
+        with self.lock:
+            self.counts = counts
+            self.port_counts = ports
+        self.last_resync = time.time()
+
+    def _resync_sketch(self):
+        sketch = self.sketch_factory()
+        ports = defaultdict(int)
+        for family in FAMILIES:
+            proc = subprocess.Popen(['conntrack', '-L', '-p', 'udp', '-f', family], stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL, text=True)
+            batch = defaultdict(int)
+            for n, line in enumerate(proc.stdout, 1):
+                delta, ip = parse_conntrack_line(line)
+                key = try_pack(ip) if ip else None
+                if key is not None:
+                    batch[key] += delta
+                    port = parse_conntrack_dport(line)
+                    if port is not None: ports[str(port)] += delta
+                if n % self.RESYNC_CHUNK == 0:
+                    sketch.update(batch)
+                    batch = defaultdict(int)
+            sketch.update(batch)
+            proc.wait()
+        with self.lock:
+            self.sketch = sketch
+            self.pending = defaultdict(int)
+            self.port_counts = ports
+        self.last_resync = time.time()
+
+    def snapshot(self, whitelist):
+        """Số luồng UDP hiện tại theo khóa ipaddr (đã lọc whitelist)"""
+        if self._running and time.time() - self.last_resync > self.resync_interval:
+            try:
+                self.resync()
+            except Exception as e:
+                logging.error(f"Lỗi resync conntrack: {e}")
+        with self.lock:
+            if self.sketch is not None:
+                self._flush_pending()
+                return defaultdict(int, self.sketch.top(whitelist))
+            items = list(self.counts.items())
+        return defaultdict(int, ((key, c) for key, c in items if key not in whitelist))
+
+    def ports(self):
+        """{cổng đích: số luồng UDP đang sống}"""
+        with self.lock:
+            items = list(self.port_counts.items())
+        return {int(port): n for port, n in items if port.isdigit()}
+
+    # --- Luồng sự kiện ---
+    def start(self):
+        self._running = True
+        self.resync()
+        for family in FAMILIES:
+            threading.Thread(target=self._event_loop, args=(family,), daemon=True).start()
+
+    def stop(self):
+        self._running = False
+        for proc in list(self._procs.values()):
+            proc.terminate()
+
+    def _event_loop(self, family):
+        cmd = ['conntrack', '-E', '-p', 'udp', '-f', family, '-e', 'NEW,DESTROY', '-b', str(self.buffer_size)]
+        while self._running:
+            try:
+                proc = self._procs[family] = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                                              text=True, bufsize=1 << 16)
+                for line in proc.stdout:
+                    if 'No buffer space' in line:
+                        # Mất sự kiện -> hiệu chỉnh lại ở lần snapshot tới
+                        logging.warning("conntrack -E tràn buffer, sẽ resync")
+                        self.last_resync = 0
+                        continue
+                    self.feed_line(line)
+                proc.wait()
+            except Exception as e:
+                logging.error(f"Lỗi đọc sự kiện conntrack ({family}): {e}")
+            if self._running:
+                time.sleep(1)
+
+    # --- Chế độ replay (benchmark offline) ---
+    def replay(self, path):
+        """Nạp file sự kiện đã ghi lại (output của `conntrack -E`), trả về số sự kiện"""
+        before = self.events
+        with open(path, 'r') as f:
+            for line in f:
+                self.feed_line(line)
+        return self.events - before
+
+
+def write_event_fixture(path, n_events, n_sources):
+    """Sinh file sự kiện giả: mỗi luồng NEW, 1/3 luồng có DESTROY tương ứng"""
+    with open(path, 'w') as f:
+        for i in range(n_events):
+            src = f"10.{i % n_sources >> 16 & 255}.{i % n_sources >> 8 & 255}.{i % n_sources & 255}"
+            tag = '[DESTROY]' if i % 3 == 2 else '    [NEW]'
+            f.write(f"{tag} udp      17 30 src={src} dst=192.168.1.1 sport={1024 + i % 60000} dport=53 "
+                    f"[UNREPLIED] src=192.168.1.1 dst={src} sport=53 dport={1024 + i % 60000}\n")
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import tempfile
+    from sketch import HeavyHitterSketch
+    if len(sys.argv) > 2 and sys.argv[1] == 'replay':
+        path, cleanup = sys.argv[2], False
+    else:
+        n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+        path, cleanup = os.path.join(tempfile.gettempdir(), 'conntrack_events.txt'), True
+        write_event_fixture(path, n, 50000)
+    for label, factory in (('chính xác', None), ('sketch', HeavyHitterSketch)):
+        counter = ConntrackEventCounter(sketch_factory=factory)
+        start = time.perf_counter()
+        n_events = counter.replay(path)
+        top = counter.snapshot(())
+        elapsed = time.perf_counter() - start
+        sources = counter.sketch.cardinality() if counter.sketch else len(counter.counts)
+        print(f"{label:9s}: {n_events} sự kiện trong {elapsed:.2f}s -> {n_events / elapsed:,.0f} sự kiện/s, "
+              f"~{sources} IP nguồn, snapshot {len(top)} IP")
+    if cleanup:
+        os.remove(path)
@@ -4,12 +4,23 @@ Web Dashboard quản trị Firewall - PBL4
 Chạy với quyền root: sudo python3 web_dashboard.py
 """
 
-from flask import Flask, render_template, jsonify, request, session, redirect, url_for
+from flask import Flask, Response, render_template, jsonify, request, session, redirect, url_for
 from functools import wraps
 import subprocess
 import json
 import os
+import time
 from datetime import datetime
+import alert_journal
+from event_store import open_store
+import whitelist
+import ipaddr
+from config_manager import DEFAULTS, read_config, save_config_atomic, validate
+from ban_backend import Ban, load_backend, run_command
+from bulk_actions import BulkJob
+from rules_model import CursorError, load_ruleset
+from sse_broadcast import StatusBroadcaster
+from ttl_cache import TTLCache
 
 app = Flask(__name__)
 app.secret_key = 'PBL3_SUPER_SECRET_KEY' # Dùng để mã hóa session đăng nhập
@@ -19,6 +30,13 @@ ALERT_FILE = '/var/log/firewall_alerts.json'
 CONFIG_FILE = '/etc/firewall_auto_block.json'
 ADMIN_PASSWORD = 'admin123'  # Mật khẩu đăng nhập web
 
+# Kho sự kiện SQLite do detector ghi (None nếu không mở được -> đọc nhật ký NDJSON)
+event_store = open_store()
+
+# Cache cho các truy vấn đọc (TTL theo khóa, config cache_ttls): N request đồng thời
+# chỉ chạy một lệnh; chặn / gỡ chặn / bật tắt service / lưu config xóa các khóa liên quan
+query_cache = TTLCache(DEFAULTS['cache_ttls'])
+
 # --- DECORATOR KIỂM TRA ĐĂNG NHẬP ---
 def login_required(f):
     @wraps(f)
@@ -31,56 +49,126 @@ def login_required(f):
 class FirewallManager:
     @staticmethod
     def is_valid_ip(ip):
-        if not ip: return False
-        parts = ip.split('.')
-        if len(parts) != 4: return False
-        try:
-            return all(0 <= int(part) <= 255 for part in parts)
-        except ValueError: return False
+        """IPv4 hoặc IPv6"""
+        return bool(ip) and ipaddr.is_valid(ip)
 
     @staticmethod
-    def get_iptables_rules():
-        try:
-            result = subprocess.run(['iptables', '-L', 'INPUT', '-n', '--line-numbers'], capture_output=True, text=True)
-            return result.stdout
-        except Exception as e:
-            return f"Error: {e}"
+    def backend():
+        """Backend chặn theo config (iptables / ipset / nft), cùng lựa chọn với detector"""
+        return load_backend(CONFIG_FILE)
+
+    @staticmethod
+    @query_cache.cached('rules')
+    def get_ruleset():
+        """Rule đã parse (rules_model.RuleSet); parse lại chỉ khi ruleset đổi generation"""
+        return load_ruleset(FirewallManager.backend())
 
     @staticmethod
     def block_ip(ip):
         try:
-            subprocess.run(['iptables', '-I', 'INPUT', '1', '-s', ip, '-j', 'DROP'], check=True)
-            return True, f"Đã chặn IP {ip}"
+            backend = FirewallManager.backend()
+            ok = all(run_command(c) for c in backend.commands([Ban(ip, 0, 'Chặn thủ công (web)')], []))
+            query_cache.invalidate('blocked', 'rules')
+            if ok:
+                return True, f"Đã chặn IP {ip} ({backend.name})"
+            return False, f"Không chặn được IP {ip} ({backend.name})"
         except Exception as e:
             return False, str(e)
 
     @staticmethod
     def unblock_ip(ip):
         try:
-            subprocess.run(['iptables', '-D', 'INPUT', '-s', ip, '-j', 'DROP'], check=True)
-            return True, f"Đã gỡ chặn IP {ip}"
+            backend = FirewallManager.backend()
+            ok = all(run_command(c) for c in backend.commands([], [ip]))
+            query_cache.invalidate('blocked', 'rules')
+            if ok:
+                return True, f"Đã gỡ chặn IP {ip} ({backend.name})"
+            return False, f"Không gỡ chặn được IP {ip} ({backend.name})"
         except Exception as e:
             return False, str(e)
 
+    @staticmethod
+    @query_cache.cached('service')
+    def service_status():
+        try:
+            res = subprocess.run(['systemctl', 'is-active', 'firewall-auto-block'], capture_output=True, text=True)
+            return res.stdout.strip().upper()
+        except Exception:
+            return "STOPPED"
+
+    @staticmethod
+    @query_cache.cached('blocked')
+    def blocked_count():
+        """Số IP / dải đang bị chặn theo backend đang dùng"""
+        return len(FirewallManager.backend().list_banned())
+
+    @staticmethod
+    @query_cache.cached('alerts')
+    def recent_alerts():
+        # 20 alerts mới nhất: truy vấn SQL theo index thời gian
+        if event_store:
+            return event_store.recent(20)
+        return alert_journal.tail(ALERT_FILE, 20)
+
     @staticmethod
     def get_stats():
         alerts = []
         blocked_count = 0
         try:
-            # Đếm số dòng DROP trong iptables
-            res = subprocess.run("iptables -L INPUT -n | grep DROP | wc -l", shell=True, capture_output=True, text=True)
-            blocked_count = int(res.stdout.strip())
-
-            # Đọc alerts
-            if os.path.exists(ALERT_FILE):
-                with open(ALERT_FILE, 'r') as f:
-                    alerts = json.load(f)
-                    if isinstance(alerts, list):
-                        alerts.sort(key=lambda x: x.get('timestamp', 0), reverse=True)
-                        alerts = alerts[:20] # Lấy 20 cái mới nhất
+            blocked_count = FirewallManager.blocked_count()
+            alerts = FirewallManager.recent_alerts()
         except: pass
         return blocked_count, alerts
 
+class StatusProbe:
+    """Probe cho luồng SSE: bộ đếm + chỉ các cảnh báo mới kể từ lần gọi trước
+    (theo id trong kho sự kiện, hoặc theo byte offset của nhật ký NDJSON)"""
+
+    def __init__(self):
+        self.last_id = None
+        self.tail = None
+
+    def new_alerts(self):
+        if event_store:
+            if self.last_id is None:
+                self.last_id = event_store.last_id()
+                return event_store.recent(20)
+            alerts, self.last_id = event_store.events_after(self.last_id)
+            return alerts
+        if self.tail is None:
+            # Lần đầu: 20 dòng cuối, sau đó chỉ đọc phần mới ghi thêm
+            self.tail = alert_journal.AlertTail(ALERT_FILE)
+            try:
+                st = os.stat(ALERT_FILE)
+                self.tail.offset, self.tail.inode = st.st_size, st.st_ino
+            except OSError:
+                pass
+            return alert_journal.tail(ALERT_FILE, 20)
+        return list(reversed(self.tail.poll()))[:20]
+
+    def __call__(self):
+        try:
+            blocked_count = FirewallManager.blocked_count()
+        except Exception:
+            blocked_count = 0
+        counters = {'blocked_count': blocked_count, 'service_status': FirewallManager.service_status()}
+        return counters, self.new_alerts()
+
+
+# Một producer chung cho mọi trình duyệt đang mở /api/stream (chỉ chạy khi có người xem)
+broadcaster = StatusBroadcaster(StatusProbe(), interval=DEFAULTS['stream_interval'])
+
+def apply_settings(config=None):
+    """stream_interval / cache_ttls từ file config (lúc khởi động và sau mỗi lần lưu)"""
+    try:
+        config = read_config(CONFIG_FILE) if config is None else config
+    except Exception:
+        config = {}
+    query_cache.set_ttls(config.get('cache_ttls', {}))
+    broadcaster.interval = float(config.get('stream_interval', DEFAULTS['stream_interval']))
+
+apply_settings()
+
 # --- ROUTES ---
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -115,20 +203,20 @@ def index():
 def api_status():
     blocked_count, alerts = FirewallManager.get_stats()
     
-    # Đọc trạng thái service
-    service_status = "STOPPED"
-    try:
-        res = subprocess.run(['systemctl', 'is-active', 'firewall-auto-block'], capture_output=True, text=True)
-        service_status = res.stdout.strip().upper()
-    except: pass
-
     return jsonify({
         'blocked_count': blocked_count,
         'alerts': alerts,
-        'service_status': service_status,
+        'service_status': FirewallManager.service_status(),
         'updated_at': datetime.now().strftime("%H:%M:%S")
     })
 
+@app.route('/api/stream')
+@login_required
+def api_stream():
+    """Server-Sent Events: 'snapshot' khi kết nối, sau đó chỉ 'delta' (bộ đếm đổi, cảnh báo mới)"""
+    return Response(broadcaster.stream(request.headers.get('Last-Event-ID')), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/action', methods=['POST'])
 @login_required
 def api_action():
@@ -141,20 +229,53 @@ def api_action():
         current = data.get('current_status')
         cmd = 'stop' if current == 'ACTIVE' else 'start'
         os.system(f"systemctl {cmd} firewall-auto-block")
+        query_cache.invalidate('service')
+        broadcaster.poke()
         return jsonify({'success': True, 'message': f"Đã gửi lệnh {cmd} service"})
 
     if not FirewallManager.is_valid_ip(ip):
         return jsonify({'success': False, 'message': 'IP không hợp lệ'})
 
     if action == 'block':
+        trusted = whitelist.load_matcher(CONFIG_FILE).match(ip)
+        if trusted:
+            return jsonify({'success': False, 'message': f'IP {ip} thuộc whitelist ({trusted})'})
         success, msg = FirewallManager.block_ip(ip)
     elif action == 'unblock':
         success, msg = FirewallManager.unblock_ip(ip)
     else:
         return jsonify({'success': False, 'message': 'Hành động không rõ'})
 
+    broadcaster.poke()
     return jsonify({'success': success, 'message': msg})
 
+@app.route('/api/bulk', methods=['POST'])
+@login_required
+def api_bulk():
+    """Chặn / gỡ chặn hàng loạt: body là danh sách mỗi dòng một IP / CIDR (văn bản hoặc NDJSON
+    {"ip", "ttl"}), đọc dạng luồng. ?action=block|unblock&ttl=<giây, 0 = vĩnh viễn>&details=all|errors|none
+    Gộp thành CIDR tối thiểu và áp dụng trong một lô (ipset restore / nft -f / iptables-restore)."""
+    args = request.args
+    try:
+        config = read_config(CONFIG_FILE)
+    except Exception:
+        config = {}
+    try:
+        job = BulkJob(args.get('action', 'block'), FirewallManager.backend(),
+                      whitelist.load_matcher(CONFIG_FILE), default_ttl=int(args.get('ttl', 0)),
+                      max_items=int(config.get('bulk_max_items', DEFAULTS['bulk_max_items'])))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    try:
+        job.feed(request.stream).plan()
+        success = job.apply()
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+    finally:
+        query_cache.invalidate('blocked', 'rules')
+        broadcaster.poke()
+    return jsonify({'success': success, **job.report(args.get('details', 'all'))})
+
 @app.route('/api/config', methods=['GET', 'POST'])
 @login_required
 def api_config():
@@ -168,16 +289,98 @@ def api_config():
     if request.method == 'POST':
         try:
             new_config = request.json
-            with open(CONFIG_FILE, 'w') as f:
-                json.dump(new_config, f, indent=4)
+            errors = validate(new_config)
+            if errors:
+                return jsonify({'success': False, 'message': f"Cấu hình không hợp lệ: {'; '.join(errors)}"})
+            if 'whitelist' in new_config:
+                new_config['whitelist'] = [whitelist.normalize_entry(e) for e in new_config['whitelist']]
+            # Gộp vào file hiện có (form chỉ gửi vài khóa), ghi file tạm rồi đổi tên
+            config = read_config(CONFIG_FILE)
+            config.update(new_config)
+            save_config_atomic(CONFIG_FILE, config)
+            # Backend chặn có thể đã đổi: bỏ toàn bộ cache
+            query_cache.invalidate()
+            apply_settings(config)
             return jsonify({'success': True, 'message': 'Đã lưu cấu hình!'})
         except Exception as e:
             return jsonify({'success': False, 'message': str(e)})
 
+@app.route('/api/whitelist/check')
+@login_required
+def api_whitelist_check():
+    """IP có thuộc whitelist không (khớp cả dải CIDR)"""
+    ip = request.args.get('ip', '').strip()
+    matched = whitelist.load_matcher(CONFIG_FILE).match(ip)
+    return jsonify({'ip': ip, 'whitelisted': matched is not None, 'entry': matched})
+
+@app.route('/api/events/summary')
+@login_required
+def api_events_summary():
+    """Thống kê nhanh từ kho sự kiện: top IP, cảnh báo theo giờ, số lần chặn 24h"""
+    if not event_store:
+        return jsonify({'error': 'Kho sự kiện không khả dụng'}), 503
+    since = time.time() - 86400
+    return jsonify({
+        'bans_24h': event_store.bans_last_24h(),
+        'top_offenders': event_store.top_offenders(since, 10),
+        'per_hour': event_store.per_hour(since),
+        'by_attack_type': event_store.by_attack_type(since),
+    })
+
+@app.route('/api/metrics/distribution')
+@login_required
+def api_metrics_distribution():
+    """Chuỗi entropy nguồn / cổng / giao thức theo cửa sổ trượt.
+    ?names=syn_src.norm,udp_src.entropy&since=<giây trước> (mặc định: entropy chuẩn hóa, 1 giờ)"""
+    if not event_store:
+        return jsonify({'error': 'Kho sự kiện không khả dụng'}), 503
+    names = [n for n in request.args.get('names', '').split(',') if n]
+    if not names:
+        names = [n for n in event_store.metric_names() if n.endswith(('.entropy', '.norm'))]
+    try:
+        since = time.time() - float(request.args.get('since', 3600))
+    except ValueError:
+        return jsonify({'error': 'since không hợp lệ'}), 400
+    return jsonify({'since': since, 'series': event_store.metric_series(names, since)})
+
 @app.route('/api/rules')
 @login_required
 def api_rules():
-    return jsonify({'rules': FirewallManager.get_iptables_rules()})
+    """Rule dạng bản ghi, lọc và phân trang phía server:
+    ?q=<IP|CIDR>&target=DROP&chain=INPUT&family=4|6&limit=200&cursor=...&counters=1
+    ETag theo generation của ruleset (cộng bộ đếm nếu counters=1) -> 304 khi không đổi"""
+    try:
+        ruleset = FirewallManager.get_ruleset()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    args = request.args
+    counters = args.get('counters') == '1'
+    etag = ruleset.etag(counters)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        try:
+            rules, next_cursor = ruleset.query(q=args.get('q', '').strip() or None, target=args.get('target') or None,
+                                               chain=args.get('chain') or None,
+                                               family=int(args['family']) if args.get('family') else None,
+                                               cursor=args.get('cursor') or None,
+                                               limit=int(args.get('limit', 200)), counters=counters)
+        except CursorError as e:
+            return jsonify({'error': str(e)}), 409
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        response = jsonify({'generation': ruleset.generation, 'total': len(ruleset),
+                            'rules': rules, 'next_cursor': next_cursor})
+    response.set_etag(etag)
+    # Trình duyệt luôn hỏi lại server (If-None-Match), không dùng bản cache khi chưa kiểm tra
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/cache/stats')
+@login_required
+def api_cache_stats():
+    """Hit rate của cache truy vấn theo từng khóa"""
+    return jsonify(query_cache.stats())
 
 if __name__ == '__main__':
     # SSL context='adhoc' để chạy HTTPS nếu cần, nhưng chạy local HTTP cho dễ
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Whitelist IP / CIDR (IPv4 và IPv6) dạng bảng longest-prefix-match.
+
+Whitelist trong /etc/firewall_auto_block.json trước đây là list Python: mỗi phép
+`ip not in whitelist` là O(số phần tử) và chỉ khớp đúng chuỗi. WhitelistMatcher
+biên dịch list đó một lần (mỗi khi config đổi) thành PrefixTable 128 bit theo
+khóa của ipaddr (IPv4 nằm trong ::ffff:0:0/96): `ip in matcher` chỉ tốn vài lần
+tra dict, không phụ thuộc số prefix, và chấp nhận cả dải như "10.0.0.0/8" hay
+"2001:db8::/32". ip có thể là khóa int (collector) hoặc chuỗi (GUI / web).
+Prefix IPv4 và IPv6 nằm ở hai bảng riêng để địa chỉ IPv4 không phải thử các độ
+dài prefix của IPv6 (mục IPv6 chứa cả ::ffff:0:0/96, ví dụ ::/0, có ở cả hai).
+
+Dùng chung cho collector (collect(whitelist) chỉ cần toán tử `in`), tab
+AutoBlock (kiểm tra mục nhập) và web API.
+
+Dùng:
+    python3 whitelist.py [100000]     # benchmark tra cứu
+"""
+import os
+
+import ipaddr
+from ipaddr import V4_BASE, V4_PREFIX
+from prefix_table import PrefixTable
+
+
+def normalize_entry(text):
+    """Dạng chuẩn để lưu vào config: '1.2.3.4', '10.0.0.0/8', '2001:db8::/32'
+    (::ffff:a.b.c.d được đổi về IPv4). ValueError nếu không hợp lệ."""
+    return ipaddr.format_cidr(*ipaddr.parse_cidr(text))
+
+
+class WhitelistMatcher:
+    def __init__(self, entries=()):
+        self.entries = list(entries)
+        self.v4 = PrefixTable(128)
+        self.v6 = PrefixTable(128)
+        self.invalid = []
+        for entry in self.entries:
+            try:
+                network, plen = ipaddr.parse_cidr(entry)
+            except ValueError:
+                self.invalid.append(entry)
+                continue
+            in_v4 = plen >= V4_PREFIX and network >> 32 == 0xffff
+            if not in_v4:
+                self.v6.add(network, plen, entry)
+            if in_v4 or (plen <= V4_PREFIX and V4_BASE >> (128 - plen) == network >> (128 - plen)):
+                self.v4.add(network, plen, entry)
+
+    def __len__(self):
+        return len(self.entries) - len(self.invalid)
+
+    def match(self, ip):
+        """Mục whitelist (chuỗi gốc trong config) chứa ip (khóa int hoặc chuỗi), hoặc None"""
+        if not isinstance(ip, int):
+            ip = ipaddr.try_pack(ip)
+            if ip is None:
+                return None
+        return (self.v4 if ip >> 32 == 0xffff else self.v6).lookup(ip)
+
+    def __contains__(self, ip):
+        return self.match(ip) is not None
+
+    def overlaps(self, network, plen):
+        """Dải network/plen (khóa 128 bit) có giao với whitelist không
+        (không chặn cả dải chứa IP tin cậy)"""
+        return self.v4.overlaps(network, plen) or self.v6.overlaps(network, plen)
+
+
+_cache = {}
+
+
+def matcher_for(entries):
+    """WhitelistMatcher cho list whitelist, chỉ biên dịch lại khi nội dung list đổi"""
+    key = tuple(entries or ())
+    matcher = _cache.get('matcher')
+    if matcher is None or _cache.get('key') != key:
+        matcher = WhitelistMatcher(key)
+        _cache.update(key=key, matcher=matcher)
+    return matcher
+
+
+def load_matcher(config_file):
+    """Matcher theo file config (dùng cho GUI / web), đọc lại khi file thay đổi"""
+    import json
+    try:
+        mtime = os.stat(config_file).st_mtime_ns
+    except OSError:
+        return matcher_for(())
+    if _cache.get('file') != (config_file, mtime):
+        try:
+            with open(config_file, 'r') as f:
+                entries = json.load(f).get('whitelist', [])
+        except Exception:
+            entries = []
+        _cache['file'] = (config_file, mtime)
+        _cache['file_matcher'] = matcher_for(entries)
+    return _cache['file_matcher']
+
+
+# === BENCHMARK ===
+def benchmark(n=100000, lookups=200000):
+    import random
+    import time
+    rng = random.Random(1)
+    entries = []
+    for i in range(n):
+        if i % 10 == 0:
+            entries.append(f"2001:db8:{rng.randrange(65536):x}:{rng.randrange(65536):x}::/{rng.choice([48, 56, 64])}")
+        else:
+            plen = rng.choice([8, 12, 16, 20, 22, 24, 24, 24, 28, 32])
+            ip = f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}"
+            entries.append(f"{ip}/{plen}")
+    start = time.perf_counter()
+    matcher = WhitelistMatcher(entries)
+    built = time.perf_counter() - start
+    ips = [f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}"
+           for _ in range(lookups)]
+    start = time.perf_counter()
+    hits = sum(1 for ip in ips if ip in matcher)
+    per_lookup = (time.perf_counter() - start) / lookups
+    print(f"{n} prefix: dựng {built * 1000:.0f} ms, tra {per_lookup * 1e6:.2f} µs/IP ({hits} khớp)")
+    keys = [ipaddr.pack(ip) for ip in ips]
+    start = time.perf_counter()
+    sum(1 for key in keys if key in matcher)
+    print(f"  khóa int (collector): {(time.perf_counter() - start) / lookups * 1e6:.2f} µs/IP")
+    sample = ips[:200]
+    start = time.perf_counter()
+    for ip in sample:
+        ip in entries
+    print(f"  list Python cũ: {(time.perf_counter() - start) / len(sample) * 1e6:.0f} µs/IP")
+
+
+if __name__ == "__main__":
+    import sys
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Lưu lịch sử số đếm theo IP và tính Z-Score cho DosDetector.
+
+- MatrixHistory (cần NumPy): lịch sử của mọi IP nằm trong một ma trận ring-buffer
+  (mỗi IP một hàng, bảng IP -> hàng), mean / stdev / Z-Score của cả một loại số
+  liệu được tính bằng một phép toán vector.
+- DequeHistory: bản thuần Python (ring-buffer nhỏ + statistics), dùng khi không có NumPy.
+
+Cả hai có chung hàm update(stats, min_count) trả về [(ip, count, z), ...] cho các
+IP có count > min_count. Z-Score được tính như cũ: mẫu hiện tại được thêm vào lịch
+sử trước, stdev là độ lệch chuẩn mẫu (n-1), cần ít nhất min_samples mẫu.
+
+Số IP được theo dõi bị giới hạn bởi max_keys: khi vượt, IP lâu không xuất hiện
+nhất bị loại (LRU); IP không xuất hiện quá idle_ttl giây cũng bị loại. Nhờ vậy
+SYN flood giả mạo nguồn không làm bộ nhớ tăng mãi, kể cả khi một chu kỳ đã có
+nhiều IP mới hơn max_keys.
+
+export_state() / import_state() chuyển lịch sử sang dạng mảng nhị phân chung cho
+cả hai engine (dùng bởi state_store khi lưu / khôi phục trạng thái).
+"""
+import statistics
+import time
+from array import array
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HISTORY_LEN = 20
+MIN_SAMPLES = 5
+MAX_KEYS = 200000
+IDLE_TTL = 900
+
+
+class _Entry:
+    """Lịch sử của một IP: ring-buffer array('i') gọn hơn deque"""
+    __slots__ = ('values', 'pos', 'last_seen')
+
+    def __init__(self):
+        self.values = array('i')
+        self.pos = 0
+        self.last_seen = 0.0
+
+
+class DequeHistory:
+    """Mỗi IP một ring-buffer nhỏ trong OrderedDict (thứ tự LRU), tính bằng statistics"""
+
+    def __init__(self, history_len=HISTORY_LEN, min_samples=MIN_SAMPLES,
+                 max_keys=MAX_KEYS, idle_ttl=IDLE_TTL):
+        self.history_len = history_len
+        self.min_samples = min_samples
+        self.max_keys = max_keys
+        self.idle_ttl = idle_ttl
+        self.store = OrderedDict()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.store)
+
+    @property
+    def tracked_keys(self):
+        return len(self.store)
+
+    def z_score(self, history, current_val):
+        if len(history) < self.min_samples:
+            return 0.0
+        try:
+            mean = statistics.mean(history)
+            stdev = statistics.stdev(history)
+            if stdev == 0: return 0.0
+            return (current_val - mean) / stdev
+        except:
+            return 0.0
+
+    def _evict(self, now):
+        store = self.store
+        # Phần tử đầu OrderedDict là IP lâu không thấy nhất
+        while store:
+            ip, entry = next(iter(store.items()))
+            if len(store) > self.max_keys or now - entry.last_seen > self.idle_ttl:
+                del store[ip]
+                self.evictions += 1
+            else:
+                break
+
+    def update(self, stats, min_count=None, now=None):
+        return self.update_batch(stats, stats.values(), min_count, now)
+
+    def update_batch(self, ips, counts, min_count=None, now=None):
+        """Như update nhưng nhận danh sách khóa và số đếm song song (không dựng dict)"""
+        now = time.time() if now is None else now
+        result = []
+        store = self.store
+        history_len = self.history_len
+        for ip, count in zip(ips, counts):
+            entry = store.get(ip)
+            if entry is None:
+                entry = store[ip] = _Entry()
+            else:
+                store.move_to_end(ip)
+            entry.last_seen = now
+            if len(entry.values) < history_len:
+                entry.values.append(count)
+            else:
+                entry.values[entry.pos] = count
+                entry.pos = (entry.pos + 1) % history_len
+            if min_count is None or count > min_count:
+                result.append((ip, count, self.z_score(entry.values, count)))
+        self._evict(now)
+        return result
+
+    def export_state(self):
+        L = self.history_len
+        data, n, pos, last_seen = array('i'), array('i'), array('i'), array('d')
+        for entry in self.store.values():
+            data.extend(entry.values)
+            data.extend([0] * (L - len(entry.values)))
+            n.append(len(entry.values))
+            pos.append(entry.pos)
+            last_seen.append(entry.last_seen)
+        return _state(self, list(self.store), data.tobytes(), n.tobytes(), pos.tobytes(), last_seen.tobytes())
+
+    def import_state(self, state):
+        if state['history_len'] != self.history_len:
+            return False
+        L = self.history_len
+        data, n, pos, last_seen = (array(code) for code in 'iiid')
+        data.frombytes(state['data']); n.frombytes(state['n'])
+        pos.frombytes(state['pos']); last_seen.frombytes(state['last_seen'])
+        store = self.store = OrderedDict()
+        for i, ip in enumerate(state['keys']):
+            entry = store[ip] = _Entry()
+            entry.values = data[i * L:i * L + n[i]]
+            entry.pos = pos[i]
+            entry.last_seen = last_seen[i]
+        return True
+
+
+class MatrixHistory:
+    """Ring-buffer dạng ma trận NumPy, một hàng cho mỗi IP"""
+
+    def __init__(self, history_len=HISTORY_LEN, min_samples=MIN_SAMPLES,
+                 max_keys=MAX_KEYS, idle_ttl=IDLE_TTL, capacity=1024):
+        self.history_len = history_len
+        self.min_samples = min_samples
+        self.max_keys = max_keys
+        self.idle_ttl = idle_ttl
+        self.evictions = 0
+        self.index = {}        # ip -> hàng
+        self.keys = []         # hàng -> ip (None = hàng trống)
+        self.free_rows = []
+        self.data = np.zeros((capacity, history_len), dtype=np.int32)
+        self.n = np.zeros(capacity, dtype=np.int32)    # số mẫu đã có (tối đa history_len)
+        self.pos = np.zeros(capacity, dtype=np.int32)  # cột sẽ ghi tiếp theo
+        self.last_seen = np.full(capacity, -np.inf)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def tracked_keys(self):
+        return len(self.index)
+
+    def _grow(self, needed):
+        capacity = len(self.n)
+        while capacity < needed:
+            capacity *= 2
+        extra = capacity - len(self.n)
+        self.data = np.concatenate([self.data, np.zeros((extra, self.history_len), dtype=np.int32)])
+        self.n = np.concatenate([self.n, np.zeros(extra, dtype=np.int32)])
+        self.pos = np.concatenate([self.pos, np.zeros(extra, dtype=np.int32)])
+        self.last_seen = np.concatenate([self.last_seen, np.full(extra, -np.inf)])
+
+    def _release(self, rows):
+        if not len(rows):
+            return
+        for row in rows.tolist():
+            del self.index[self.keys[row]]
+            self.keys[row] = None
+        self.data[rows] = 0
+        self.n[rows] = 0
+        self.pos[rows] = 0
+        self.last_seen[rows] = -np.inf
+        self.free_rows.extend(rows.tolist())
+        self.evictions += len(rows)
+
+    def _evict(self, now, incoming):
+        """Loại IP quá idle_ttl, rồi IP cũ nhất nếu chưa đủ chỗ cho `incoming` IP mới"""
+        seen = self.last_seen[:len(self.keys)]
+        # Hàng trống (đã giải phóng, chờ trong free_rows) có last_seen = -inf: không loại lại
+        self._release(np.flatnonzero((seen > -np.inf) & (seen < now - self.idle_ttl)))
+        excess = len(self.index) + incoming - self.max_keys
+        if excess > 0:
+            # Không loại các IP vừa cập nhật trong chu kỳ này (last_seen == now)
+            candidates = np.flatnonzero((seen > -np.inf) & (seen < now))
+            if len(candidates) > excess:
+                oldest = np.argpartition(seen[candidates], excess)[:excess]
+                candidates = candidates[oldest]
+            self._release(candidates)
+
+    def _rows(self, ips, counts, now):
+        """Hàng của từng IP; -1 cho IP mới không còn chỗ (vượt max_keys ngay trong chu kỳ)"""
+        index, keys = self.index, self.keys
+        rows = list(map(index.get, ips))
+        missing = rows.count(None)
+        if missing:
+            self.last_seen[[r for r in rows if r is not None]] = now
+            self._evict(now, missing)
+            room = max(self.max_keys - len(index), 0)
+            if missing > room:
+                # Một chu kỳ có nhiều IP mới hơn số chỗ còn lại (flood giả mạo nguồn):
+                # chỉ giữ các IP mới có số đếm cao nhất, phần còn lại không được lưu
+                new = np.array([i for i, row in enumerate(rows) if row is None], dtype=np.int64)
+                drop = missing - room
+                if room:
+                    new = new[np.argpartition(counts[new], drop)[:drop]]
+                for i in new.tolist():
+                    rows[i] = -1
+                self.evictions += drop
+            # Cấp hàng cho các IP lần đầu xuất hiện (ưu tiên hàng đã giải phóng)
+            free = self.free_rows
+            for i, row in enumerate(rows):
+                if row is None:
+                    ip = ips[i]
+                    if free:
+                        row = free.pop()
+                        keys[row] = ip
+                    else:
+                        row = len(keys)
+                        keys.append(ip)
+                    rows[i] = index[ip] = row
+            if len(keys) > len(self.n):
+                self._grow(len(keys))
+        rows = np.array(rows, dtype=np.int64)
+        self.last_seen[rows[rows >= 0]] = now
+        if not missing:
+            self._evict(now, 0)
+        return rows
+
+    def scores(self, rows, counts):
+        """Z-Score vector cho các hàng đã cập nhật (counts = giá trị mới nhất)"""
+        n = self.n[rows]
+        block = self.data[rows].astype(np.float64)
+        valid = np.arange(self.history_len) < n[:, None]
+        nf = np.maximum(n, 1).astype(np.float64)
+        mean = np.where(valid, block, 0.0).sum(axis=1) / nf
+        dev = np.where(valid, block - mean[:, None], 0.0)
+        stdev = np.sqrt((dev * dev).sum(axis=1) / np.maximum(nf - 1, 1))
+        ok = (n >= self.min_samples) & (stdev > 0)
+        return np.where(ok, (counts - mean) / np.where(ok, stdev, 1.0), 0.0)
+
+    def update(self, stats, min_count=None, now=None):
+        ips = list(stats)
+        return self.update_batch(ips, np.fromiter(stats.values(), dtype=np.int64, count=len(ips)), min_count, now)
+
+    def update_batch(self, ips, counts, min_count=None, now=None):
+        """Như update nhưng nhận list khóa + mảng int64 số đếm (không dựng dict)"""
+        now = time.time() if now is None else now
+        if not len(ips):
+            self._evict(now, 0)
+            return []
+        counts = np.asarray(counts, dtype=np.int64)
+        rows = self._rows(ips, counts, now)
+        stored = rows >= 0
+        if stored.all():
+            stored = None
+            w_rows, w_counts = rows, counts
+        else:
+            w_rows, w_counts = rows[stored], counts[stored]
+
+        pos = self.pos[w_rows]
+        self.data[w_rows, pos] = w_counts
+        self.pos[w_rows] = (pos + 1) % self.history_len
+        self.n[w_rows] = np.minimum(self.n[w_rows] + 1, self.history_len)
+
+        if min_count is None:
+            sel = np.arange(len(ips))
+        else:
+            sel = np.flatnonzero(counts > min_count)
+            if not len(sel):
+                return []
+        if stored is None:
+            z = self.scores(rows[sel], counts[sel])
+        else:
+            # IP không được lưu chưa có lịch sử: Z-Score 0 như IP mới
+            z = np.zeros(len(sel))
+            ok = stored[sel]
+            z[ok] = self.scores(rows[sel][ok], counts[sel][ok])
+        return [(ips[i], int(c), float(zs)) for i, c, zs in zip(sel.tolist(), counts[sel].tolist(), z.tolist())]
+
+    def export_state(self):
+        keys = list(self.index)
+        rows = np.fromiter(self.index.values(), dtype=np.int64, count=len(keys))
+        return _state(self, keys, self.data[rows].tobytes(), self.n[rows].tobytes(),
+                      self.pos[rows].tobytes(), self.last_seen[rows].tobytes())
+
+    def import_state(self, state):
+        if state['history_len'] != self.history_len:
+            return False
+        keys = list(state['keys'])
+        k = len(keys)
+        capacity = 1024
+        while capacity < k:
+            capacity *= 2
+        self.index = dict(zip(keys, range(k)))
+        self.keys = keys
+        self.free_rows = []
+        self.data = np.zeros((capacity, self.history_len), dtype=np.int32)
+        self.data[:k] = np.frombuffer(state['data'], dtype=np.int32).reshape(k, self.history_len)
+        self.n = np.zeros(capacity, dtype=np.int32)
+        self.n[:k] = np.frombuffer(state['n'], dtype=np.int32)
+        self.pos = np.zeros(capacity, dtype=np.int32)
+        self.pos[:k] = np.frombuffer(state['pos'], dtype=np.int32)
+        self.last_seen = np.full(capacity, -np.inf)
+        self.last_seen[:k] = np.frombuffer(state['last_seen'], dtype=np.float64)
+        return True
+
+
+def _state(history, keys, data, n, pos, last_seen):
+    """Dạng trao đổi chung: keys + mảng int32 (k x history_len, k, k) và float64 (k)"""
+    return {'history_len': history.history_len, 'keys': keys, 'data': data,
+            'n': n, 'pos': pos, 'last_seen': last_seen}
+
+
+def create_history(history_len=HISTORY_LEN, min_samples=MIN_SAMPLES, max_keys=MAX_KEYS, idle_ttl=IDLE_TTL):
+    if np is not None:
+        return MatrixHistory(history_len, min_samples, max_keys, idle_ttl)
+    return DequeHistory(history_len, min_samples, max_keys, idle_ttl)
+
+
+# === BENCHMARK ===
+def benchmark(sizes=(10000, 100000, 1000000), cycles=12, threshold=50):
+    import random
+    engines = [DequeHistory]
+    if np is not None:
+        engines.append(MatrixHistory)
+    for size in sizes:
+        ips = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(size)]
+        decisions = {}
+        for engine_cls in engines:
+            engine = engine_cls(max_keys=size)
+            rng = random.Random(size)  # Cùng dữ liệu cho mọi engine
+            elapsed = 0.0
+            blocked = []
+            for cycle in range(cycles):
+                # Lưu lượng nền thấp, chu kỳ cuối 1% IP tăng đột biến
+                spike = cycle == cycles - 1
+                stats = {ip: rng.randint(40, 200) if spike and i % 100 == 0 else rng.randint(0, 20)
+                         for i, ip in enumerate(ips)}
+                start = time.perf_counter()
+                blocked = [ip for ip, count, z in engine.update(stats, threshold) if z > 3.0]
+                elapsed += time.perf_counter() - start
+            decisions[engine_cls.__name__] = sorted(blocked)
+            print(f"{size:>8} IP {engine_cls.__name__:14s}: {elapsed / cycles * 1000:9.1f} ms/chu kỳ, "
+                  f"{len(blocked)} IP bị chặn")
+        if len(decisions) == 2:
+            same = decisions['DequeHistory'] == decisions['MatrixHistory']
+            print(f"{'':>8}    quyết định chặn giống nhau: {same}")
+
+
+if __name__ == "__main__":
+    import sys
+    sizes = tuple(int(a) for a in sys.argv[1:]) or (10000, 100000, 1000000)
+    benchmark(sizes)